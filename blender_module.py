@@ -22,13 +22,15 @@
 # GitHub at https://github.com/imoverclocked/io_mesh_img/blob/master/plugin/import_img.py
 # Thanks Tim for your help on this project and for keeping your code OpenSource.
 
-from struct import pack, unpack
 from sys import platform as _platform
-import queue, threading
 import bpy
 from bpy.ops import *
 import os
-import math
+import numpy
+from . import cache_module
+from . import registry_module
+from .dtm_core.importer import dtm_importer
+from .dtm_core import export
 
 def encap_1(val):
     ''' blender 2.5x uses [val] while 2.6x uses val -- this helps ease that '''
@@ -37,684 +39,140 @@ def encap_1(val):
     return val
 
 
-class image_properties:
-    ''' keeps track of image attributes throughout the hirise_dtm_importer class '''
-
-    def __init__(self, name, dimensions, pixel_scale):
-        self.name(name)
-        self.dims(dimensions)
-        self.processed_dims(dimensions)
-        self.pixel_scale(pixel_scale)
-
-    def dims(self, dims=None):
-        if dims is not None:
-            self.__dims = dims
-        return self.__dims
-
-    def processed_dims(self, processed_dims=None):
-        if processed_dims is not None:
-            self.__processed_dims = processed_dims
-        return self.__processed_dims
-
-    def name(self, name=None):
-        if name is not None:
-            self.__name = name
-        return self.__name
-
-    def pixel_scale(self, pixel_scale=None):
-        if pixel_scale is not None:
-            self.__pixel_scale = pixel_scale
-        return self.__pixel_scale
-
-
-class hirise_dtm_importer(object):
-    ''' methods to understand/import a HiRISE DTM formatted as a PDS .IMG '''
-
-    def __init__(self, filepath):
-        self.__filepath = filepath
-        self.__ignore_value = 0x00000000
-        self.__bin_mode = 'BIN6'
-        self.scale(1.0)
-        self.__cropXY = False
-
-    def bin_mode(self, bin_mode=None):
-        if bin_mode != None:
-            self.__bin_mode = bin_mode
-        return self.__bin_mode
-
-    def scale(self, scale=None):
-        if scale is not None:
-            self.__scale = scale
-        return self.__scale
-
-    def crop(self, widthX, widthY, offX, offY):
-        self.__cropXY = [widthX, widthY, offX, offY]
-        return self.__cropXY
-
-    ############################################################################
-    ## PDS Label Operations
-    ############################################################################
-
-    def parsePDSLabel(self, labelIter, currentObjectName=None, level=""):
-        # Let's parse this thing... semi-recursively
-        ## I started writing this caring about everything in the PDS standard but ...
-        ## it's a mess and I only need a few things -- thar be hacks below
-        ## Mostly I just don't care about continued data from previous lines
-        label_structure = []
-
-        # When are we done with this level?
-        endStr = "END"
-        if not currentObjectName is None:
-            endStr = "END_OBJECT = %s" % currentObjectName
-        line = ""
-
-        while not line.rstrip() == endStr:
-            line = next(labelIter)
-
-            # Get rid of comments
-            comment = line.find("/*")
-            if comment > -1:
-                line = line[:comment]
-
-            # Take notice of objects
-            if line[:8] == "OBJECT =":
-                objName = line[8:].rstrip()
-                label_structure.append(
-                    (
-                    objName.lstrip().rstrip(),
-                    self.parsePDSLabel(labelIter, objName.lstrip().rstrip(), level + "	")
-                    )
-                )
-            elif line.find("END_OBJECT =") > -1:
-                pass
-            elif len(line.rstrip().lstrip()) > 0:
-                key_val = line.split(" = ", 2)
-                if len(key_val) == 2:
-                    label_structure.append((key_val[0].rstrip().lstrip(), key_val[1].rstrip().lstrip()))
-
-        return label_structure
-
-    # There has got to be a better way in python?
-    def iterArr(self, label):
-        for line in label:
-            yield line
-
-    def getPDSLabel(self, img):
-        # Just takes file and stores it into an array for later use
-        label = []
-        done = False;
-        # Grab label into array of lines
-        while not done:
-            line = str(img.readline(), 'utf-8')
-            if line.rstrip() == "END":
-                done = True
-            label.append(line)
-        return (label, self.parsePDSLabel(self.iterArr(label)))
-
-    def getLinesAndSamples(self, label):
-        ''' uses the parsed PDS Label to get the LINES and LINE_SAMPLES parameters
-                from the first object named "IMAGE" -- is hackish
-        '''
-        lines = None
-        line_samples = None
-        for obj in label:
-            if obj[0] == "IMAGE":
-                return self.getLinesAndSamples(obj[1])
-            if obj[0] == "LINES":
-                lines = int(obj[1])
-            if obj[0] == "LINE_SAMPLES":
-                line_samples = int(obj[1])
-
-        return ( line_samples, lines )
-
-    def getValidMinMax(self, label):
-        ''' uses the parsed PDS Label to get the VALID_MINIMUM and VALID_MAXIMUM parameters
-                from the first object named "IMAGE" -- is hackish
-        '''
-        lines = None
-        line_samples = None
-        for obj in label:
-            if obj[0] == "IMAGE":
-                return self.getValidMinMax(obj[1])
-            if obj[0] == "VALID_MINIMUM":
-                vmin = float(obj[1])
-            if obj[0] == "VALID_MAXIMUM":
-                vmax = float(obj[1])
-
-        return ( vmin, vmax )
-
-    def getMissingConstant(self, label):
-        ''' uses the parsed PDS Label to get the MISSING_CONSTANT parameter
-                from the first object named "IMAGE" -- is hackish
-        '''
+class hirise_dtm_importer(dtm_importer):
+    ''' methods to understand/import a HiRISE DTM formatted as a PDS .IMG -- the
+        reading, binning and mesh arrays come from dtm_core, this adds the objects
+    '''
 
-        lines = None
-        line_samples = None
-        for obj in label:
-            if obj[0] == "IMAGE":
-                return self.getMissingConstant(obj[1])
-            if obj[0] == "MISSING_CONSTANT":
-                bit_string_repr = obj[1]
-
-        # This is always the same for a HiRISE image, so we are just checking it
-        # to be a little less insane here. If someone wants to support another
-        # constant then go for it. Just make sure this one continues to work too
-        pieces = bit_string_repr.split("#")
-        if pieces[0] == "16" and pieces[1] == "FF7FFFFB":
-            ignore_value = unpack("f", pack("I", 0xFF7FFFFB))[0]
-
-        return ( ignore_value )
-
-    ############################################################################
-    ## Image operations
-    ############################################################################
-
-    # decorator to run a generator in a thread
-    def threaded_generator(func):
-        def start(*args, **kwargs):
-            # Setup a queue of returned items
-            yield_q = queue.Queue()
-            # Thread to run generator inside of
-            def worker():
-                for obj in func(*args, **kwargs): yield_q.put(obj)
-                yield_q.put(StopIteration)
-
-            t = threading.Thread(target=worker)
-            t.start()
-            # yield from the queue as fast as we can
-            obj = yield_q.get()
-            while obj is not StopIteration:
-                yield obj
-                obj = yield_q.get()
-
-        # return the thread-wrapped generator
-        return start
-
-    def bin2(self, image_iter, bin2_method_type="SLOW"):
-        ''' this is an iterator that: Given an image iterator will yield binned lines '''
-
-        ignore_value = self.__ignore_value
-
-        img_props = next(image_iter)
-        # dimensions shrink as we remove pixels
-        processed_dims = img_props.processed_dims()
-        processed_dims = ( processed_dims[0] // 2, processed_dims[1] // 2 )
-        img_props.processed_dims(processed_dims)
-        # each pixel is larger as binning gets larger
-        pixel_scale = img_props.pixel_scale()
-        pixel_scale = ( pixel_scale[0] * 2, pixel_scale[1] * 2 )
-        img_props.pixel_scale(pixel_scale)
-        yield img_props
-
-        # Take two lists  [a1, a2, a3], [b1, b2, b3] and combine them into one
-        # list of [a1 + b1, a2+b2,  ... ] as long as both values are not ignorable
-        combine_fun = lambda a, b: a != ignore_value and b != ignore_value and (a + b) / 2 or ignore_value
-
-        line_count = 0
-        ret_list = []
-        for line in image_iter:
-            if line_count == 1:
-                line_count = 0
-                tmp_list = list(map(combine_fun, line, last_line))
-                while len(tmp_list) > 1:
-                    ret_list.append(combine_fun(tmp_list[0], tmp_list[1]))
-                    del tmp_list[0:2]
-                yield ret_list
-                ret_list = []
-            else:
-                last_line = line
-                line_count += 1
-
-    def bin6(self, image_iter, bin6_method_type="SLOW"):
-        ''' this is an iterator that: Given an image iterator will yield binned lines '''
-
-        img_props = next(image_iter)
-        # dimensions shrink as we remove pixels
-        processed_dims = img_props.processed_dims()
-        processed_dims = ( processed_dims[0] // 6, processed_dims[1] // 6 )
-        img_props.processed_dims(processed_dims)
-        # each pixel is larger as binning gets larger
-        pixel_scale = img_props.pixel_scale()
-        pixel_scale = ( pixel_scale[0] * 6, pixel_scale[1] * 6 )
-        img_props.pixel_scale(pixel_scale)
-        yield img_props
-
-        if bin6_method_type == "FAST":
-            bin6_method = self.bin6_real_fast
-        else:
-            bin6_method = self.bin6_real
-
-        raw_data = []
-        line_count = 0
-        for line in image_iter:
-            raw_data.append(line)
-            line_count += 1
-            if line_count == 6:
-                yield bin6_method(raw_data)
-                line_count = 0
-                raw_data = []
-
-    def bin6_real(self, raw_data):
-        ''' does a 6x6 sample of raw_data and returns a single line of data '''
-        # TODO: make this more efficient
-
-        binned_data = []
-        IGNORE_VALUE = self.__ignore_value
-
-        base = 0
-        for i in range(0, len(raw_data[0]) // 6):
-
-            ints = (raw_data[0][base: base + 6] +
-                    raw_data[1][base: base + 6] +
-                    raw_data[2][base: base + 6] +
-                    raw_data[3][base: base + 6] +
-                    raw_data[4][base: base + 6] +
-                    raw_data[5][base: base + 6] )
-
-            # Filter out those unwanted hugely negative values...
-            ints = [num for num in ints if num != IGNORE_VALUE]
-
-            # If we have all pesky values, return a pesky value
-            if not ints:
-                binned_data.append(IGNORE_VALUE)
-            else:
-                binned_data.append(sum(ints, 0.0) / len(ints))
-
-            base += 6
-
-        return binned_data
-
-    def bin6_real_fast(self, raw_data):
-        ''' takes a single value from each 6x6 sample of raw_data and returns a single line of data '''
-        # TODO: make this more efficient
-
-        binned_data = []
-
-        base = 0
-        for i in range(0, len(raw_data[0]) // 6):
-            binned_data.append(raw_data[0][base])
-            base += 6
-
-        return binned_data
-
-    def bin12(self, image_iter, bin12_method_type="SLOW"):
-        ''' this is an iterator that: Given an image iterator will yield binned lines '''
-
-        img_props = next(image_iter)
-        # dimensions shrink as we remove pixels
-        processed_dims = img_props.processed_dims()
-        processed_dims = ( processed_dims[0] // 12, processed_dims[1] // 12 )
-        img_props.processed_dims(processed_dims)
-        # each pixel is larger as binning gets larger
-        pixel_scale = img_props.pixel_scale()
-        pixel_scale = ( pixel_scale[0] * 12, pixel_scale[1] * 12 )
-        img_props.pixel_scale(pixel_scale)
-        yield img_props
-
-        if bin12_method_type == "FAST":
-            bin12_method = self.bin12_real_fast
-        else:
-            bin12_method = self.bin12_real
-
-        raw_data = []
-        line_count = 0
-        for line in image_iter:
-            raw_data.append(line)
-            line_count += 1
-            if line_count == 12:
-                yield bin12_method(raw_data)
-                line_count = 0
-                raw_data = []
-
-    def bin12_real(self, raw_data):
-        ''' does a 12x12 sample of raw_data and returns a single line of data '''
-
-        binned_data = []
-
-        # Filter out those unwanted hugely negative values...
-        filter_fun = lambda a: self.__ignore_value.__ne__(a)
-
-        base = 0
-        for i in range(0, len(raw_data[0]) // 12):
-
-            ints = list(filter(filter_fun, raw_data[0][base:base + 12] +
-                                           raw_data[1][base:base + 12] +
-                                           raw_data[2][base:base + 12] +
-                                           raw_data[3][base:base + 12] +
-                                           raw_data[4][base:base + 12] +
-                                           raw_data[5][base:base + 12] +
-                                           raw_data[6][base:base + 12] +
-                                           raw_data[7][base:base + 12] +
-                                           raw_data[8][base:base + 12] +
-                                           raw_data[9][base:base + 12] +
-                                           raw_data[10][base:base + 12] +
-                                           raw_data[11][base:base + 12]))
-            len_ints = len(ints)
-
-            # If we have all pesky values, return a pesky value
-            if len_ints == 0:
-                binned_data.append(self.__ignore_value)
-            else:
-                binned_data.append(sum(ints) / len(ints))
-
-            base += 12
-        return binned_data
-
-    def bin12_real_fast(self, raw_data):
-        ''' takes a single value from each 12x12 sample of raw_data and returns a single line of data '''
-        return raw_data[0][11::12]
-
-    def cropXY(self, image_iter, XSize=None, YSize=None, XOffset=0, YOffset=0):
-        ''' return a cropped portion of the image '''
-
-        img_props = next(image_iter)
-        # dimensions shrink as we remove pixels
-        processed_dims = img_props.processed_dims()
-
-        if XSize is None:
-            XSize = processed_dims[0]
-        if YSize is None:
-            YSize = processed_dims[1]
-
-        if XSize + XOffset > processed_dims[0]:
-            XSize = processed_dims[0]
-            XOffset = 0
-        if YSize + YOffset > processed_dims[1]:
-            YSize = processed_dims[1]
-            YOffset = 0
-
-        img_props.processed_dims((XSize, YSize))
-        yield img_props
-
-        currentY = 0
-        for line in image_iter:
-            if currentY >= YOffset and currentY <= YOffset + YSize:
-                yield line[XOffset:XOffset + XSize]
-            # Not much point in reading the rest of the data...
-            if currentY == YOffset + YSize:
-                return
-            currentY += 1
-
-    def getImage(self, img, img_props):
-        ''' Assumes 32-bit pixels -- bins image '''
-        dims = img_props.dims()
-
-        # setup to unpack more efficiently.
-        x_len = dims[0]
-        # little endian (PC_REAL)
-        unpack_str = "<"
-        # unpack_str = ">"
-        unpack_bytes_str = "<"
-        pack_bytes_str = "="
-        # 32 bits/sample * samples/line = y_bytes (per line)
-        x_bytes = 4 * x_len
-        for x in range(0, x_len):
-            # 32-bit float is "d"
-            unpack_str += "f"
-            unpack_bytes_str += "I"
-            pack_bytes_str += "I"
-
-        # Each iterator yields this first ... it is for reference of the next iterator:
-        yield img_props
-
-        for y in range(0, dims[1]):
-            # pixels is a byte array
-            pixels = b''
-            while len(pixels) < x_bytes:
-                new_pixels = img.read(x_bytes - len(pixels))
-                pixels += new_pixels
-                if len(new_pixels) == 0:
-                    x_bytes = -1
-                    pixels = []
-            if len(pixels) == x_bytes:
-                if 0 == 1:
-                    repacked_pixels = b''
-                    for integer in unpack(unpack_bytes_str, pixels):
-                        repacked_pixels += pack("=I", integer)
-                    yield unpack(unpack_str, repacked_pixels)
-                else:
-                    yield unpack(unpack_str, pixels)
-
-    def shiftToOrigin(self, image_iter, image_min_max):
-        ''' takes a generator and shifts the points by the valid minimum
-            also removes points with value self.__ignore_value and replaces them with None
+    def setMeshData(self, me, coords, loops, loop_totals):
+        ''' fills an empty mesh in bulk: coords is (n, 3), loops the vertex index of
+            every face corner and loop_totals the number of corners of every face
         '''
-
-        # use the passed in values ...
-        valid_min = image_min_max[0]
-
-        # pass on dimensions/pixel_scale since we don't modify them here
-        yield next(image_iter)
-
-
-        # closures rock!
-        def normalize_fun(point):
-            if point == self.__ignore_value:
-                return None
-            return point - valid_min
-
-        for line in image_iter:
-            yield list(map(normalize_fun, line))
-
-    def scaleZ(self, image_iter, scale_factor):
-        ''' scales the mesh values by a factor '''
-        # pass on dimensions since we don't modify them here
-        yield next(image_iter)
-
-        scale_factor = self.scale()
-
-        def scale_fun(point):
-            try:
-                return point * scale_factor
-            except:
-                return None
-
-        for line in image_iter:
-            yield list(map(scale_fun, line))
+        me.vertices.add(len(coords))
+        me.vertices.foreach_set("co", numpy.ascontiguousarray(coords, dtype=numpy.float32).ravel())
+
+        loop_totals = numpy.asarray(loop_totals, dtype=numpy.int32)
+        loop_starts = numpy.zeros(len(loop_totals), dtype=numpy.int32)
+        numpy.cumsum(loop_totals[:-1], out=loop_starts[1:])
+
+        me.loops.add(len(loops))
+        me.loops.foreach_set("vertex_index", numpy.asarray(loops, dtype=numpy.int32))
+        me.polygons.add(len(loop_totals))
+        me.polygons.foreach_set("loop_start", loop_starts)
+        me.polygons.foreach_set("loop_total", loop_totals)
+
+        me.update(calc_edges=True)
+
+    def setMeshNormals(self, me, normals):
+        ''' smooth shading with one custom normal per vertex '''
+        if not hasattr(me, "normals_split_custom_set_from_vertices"):
+            # custom normals need blender 2.74+, blender computes its own before that
+            return
+        # The faces of the grid wind clockwise seen from above, so the normals blender
+        # gives them point down -- custom normals must agree with them
+        normals = -numpy.asarray(normals, dtype=numpy.float32)
+        me.polygons.foreach_set("use_smooth", numpy.ones(len(me.polygons), dtype=bool))
+        me.use_auto_smooth = True
+        me.normals_split_custom_set_from_vertices(normals.tolist())
+
+    def setMeshUVs(self, me, uvs, loops):
+        ''' one UV layer, the uvs of every vertex written to all of its loops at once '''
+        if hasattr(me, "uv_textures"):
+            me.uv_textures.new("DTM")
+        else:
+            me.uv_layers.new(name="DTM")
+        uvs = numpy.asarray(uvs, dtype=numpy.float32)[numpy.asarray(loops, dtype=numpy.int64)]
+        me.uv_layers[-1].data.foreach_set("uv", uvs.ravel())
 
     def genMesh(self, image_iter):
         '''Returns a mesh object from an image iterator this has the
-             value-added feature that a value of "None" is ignored
+             value-added feature that a value of NaN is ignored
         '''
 
         # Get the output image size given the above transforms
-        img_props = next(image_iter)
-
-        # Let's interpolate the binned DTM with blender -- yay meshes!
-        coords = []
-        faces = []
-        face_count = 0
-        coord = -1
-        max_x = img_props.processed_dims()[0]
-        max_y = img_props.processed_dims()[1]
-
-        scale_x = self.scale() * img_props.pixel_scale()[0]
-        scale_y = self.scale() * img_props.pixel_scale()[1]
-
-        line_count = 0
-        current_line = []
-        # seed the last line (or previous line) with a line
-        last_line = next(image_iter)
-        point_offset = 0
-        previous_point_offset = 0
-
-        # Let's add any initial points that are appropriate
-        x = 0
-        point_offset += len(last_line) - last_line.count(None)
-        for z in last_line:
-            if z != None:
-                coords.append((x * scale_x, 0.0, z))
-                coord += 1
-            x += 1
-
-        # We want to ignore points with a value of "None" but we also need to create vertices
-        # with an index that we can re-create on the next line. The solution is to remember
-        # two offsets: the point offset and the previous point offset.
-        #     these offsets represent the point index that blender gets -- not the number of
-        #     points we have read from the image
-
-        # if "x" represents points that are "None" valued then conceptually this is how we
-        # think of point indices:
-        #
-        # previous line: offset0   x   x  +1  +2  +3
-        # current line:  offset1   x  +1  +2  +3   x
-
-        # once we can map points we can worry about making triangular or square faces to fill
-        # the space between vertices so that blender is more efficient at managing the final
-        # structure.
-
-
-        # read each new line and generate coordinates+faces
-        for dtm_line in image_iter:
-
-            # Keep track of where we are in the image
-            line_count += 1
-            y_val = line_count * -scale_y
-
-            # Just add all points blindly
-            # TODO: turn this into a map
-            x = 0
-            for z in dtm_line:
-                if z != None:
-                    coords.append((x * scale_x, y_val, z))
-                    coord += 1
-                x += 1
-
-            # Calculate faces
-            for x in range(0, max_x - 1):
-                vals = [
-                    last_line[x + 1],
-                    last_line[x],
-                    dtm_line[x],
-                    dtm_line[x + 1],
-                ]
-
-                # Two or more values of "None" means we can ignore this block
-                none_val = vals.count(None)
-
-                # Common case: we can create a square face
-                if none_val == 0:
-                    faces.append((
-                    previous_point_offset,
-                    previous_point_offset + 1,
-                    point_offset + 1,
-                    point_offset,
-                    ))
-                    face_count += 1
-                elif none_val == 1:
-                    # special case: we can implement a triangular face
-                    ## NB: blender 2.5 makes a triangular face when the last coord is 0
-                    # TODO: implement a triangular face
-                    pass
-
-                if vals[1] != None:
-                    previous_point_offset += 1
-                if vals[2] != None:
-                    point_offset += 1
-
-            # Squeeze the last point offset increment out of the previous line
-            if last_line[-1] != None:
-                previous_point_offset += 1
-
-            # Squeeze the last point out of the current line
-            if dtm_line[-1] != None:
-                point_offset += 1
-
-            # remember what we just saw (and forget anything before that)
-            last_line = dtm_line
+        (img_props, grid) = self.genGrid(image_iter)
 
-        me = bpy.data.meshes.new(img_props.name()) # create a new mesh
-
-        me.from_pydata(coords, [], faces)
-
-        ##
-        # me.vertices.add(len(coords)/3)
-        # me.vertices.foreach_set("co", coords)
-        # me.faces.add(len(faces)/4)
-        # me.faces.foreach_set("vertices_raw", faces)
-
-        me.update()
+        (scale_x, scale_y) = self.gridScale(img_props)
+        normals = None
+        if self.use_normals():
+            normals = self.gridNormals(grid, scale_x, scale_y)
 
         bin_desc = self.bin_mode()
         if bin_desc == 'NONE':
             bin_desc = 'No Bin'
 
-        ob = bpy.data.objects.new("DTM - %s" % bin_desc, me)
-
-        return ob
-
-    ################################################################################
-    #  Yay, done with helper functions ... let's see the abstraction in action!    #
-    ################################################################################
-    def execute(self):
-
-        img = open(self.__filepath, 'rb')
-
-        (label, parsedLabel) = self.getPDSLabel(img)
-
-        image_dims = self.getLinesAndSamples(parsedLabel)
-        img_min_max_vals = self.getValidMinMax(parsedLabel)
-        self.__ignore_value = self.getMissingConstant(parsedLabel)
-
-        # MAGIC VALUE? -- need to formalize this to rid ourselves of bad points
-        img.seek(28)
-        # Crop off 4 lines
-        img.seek(4 * image_dims[0])
-
-        # HiRISE images (and most others?) have 1m x 1m pixels
-        pixel_scale = (1, 1)
-
-        # The image we are importing
-        image_name = os.path.basename(self.__filepath)
-
-        # Set the properties of the image in a manageable object
-        img_props = image_properties(image_name, image_dims, pixel_scale)
+        if self.tile_size():
+            # One empty parent holding a mesh object per tile
+            ob = bpy.data.objects.new("DTM - %s" % bin_desc, None)
+            tiles = self.tileArrays(grid, scale_x, scale_y, self.tile_size(), self.lod_levels())
+            if self.export_path():
+                # the finest level of every tile, as one mesh
+                export.write_mesh(self.export_path(), *export.merge_meshes(
+                    arrays for (origin, level, arrays) in tiles if level == 0))
+            for ((row, col), level, (coords, loops, loop_totals)) in tiles:
+                if len(loops) == 0:
+                    continue
+                tile_name = "%d_%d" % (row // self.tile_size(), col // self.tile_size())
+                if self.lod_levels() > 1:
+                    tile_name = "%s LOD%d" % (tile_name, level)
+                me = bpy.data.meshes.new("%s %s" % (img_props.name(), tile_name))
+                self.setMeshData(me, coords, loops, loop_totals)
+                self.setMeshUVs(me, self.vertexUVs(img_props, coords, scale_x, scale_y), loops)
+                if normals is not None:
+                    self.setMeshNormals(me, self.vertexNormals(normals, coords, scale_x, scale_y))
+                tile = bpy.data.objects.new("DTM - %s - %s" % (bin_desc, tile_name), me)
+                tile.parent = ob
+                if self.lod_levels() > 1:
+                    # What the flyover needs to pick a level for every frame
+                    low = coords.min(axis=0)
+                    high = coords.max(axis=0)
+                    tile['lod_tile'] = "%d_%d" % (row, col)
+                    tile['lod_level'] = level
+                    tile['lod_center'] = ((low + high) / 2).tolist()
+                    tile['lod_size'] = float(numpy.linalg.norm(high[:2] - low[:2]))
+                    # Until a flyover says otherwise only the finest level shows
+                    tile.hide = level > 0
+                    tile.hide_render = level > 0
+            return ob
+
+        (coords, loops, loop_totals) = self.meshArrays(grid, scale_x, scale_y)
+        if self.export_path():
+            export.write_mesh(self.export_path(), coords, loops, loop_totals)
 
-        # Get an iterator to iterate over lines
-        image_iter = self.getImage(img, img_props)
-
-        ## Wrap the image_iter generator with other generators to modify the dtm on a
-        ## line-by-line basis. This creates a stream of modifications instead of reading
-        ## all of the data at once, processing all of the data (potentially several times)
-        ## and then handing it off to blender
-        ## TODO: find a way to alter projection based on transformations below
-
-        if self.__cropXY:
-            image_iter = self.cropXY(image_iter,
-                                     XSize=self.__cropXY[0],
-                                     YSize=self.__cropXY[1],
-                                     XOffset=self.__cropXY[2],
-                                     YOffset=self.__cropXY[3]
-            )
+        me = bpy.data.meshes.new(img_props.name()) # create a new mesh
+        self.setMeshData(me, coords, loops, loop_totals)
+        self.setMeshUVs(me, self.vertexUVs(img_props, coords, scale_x, scale_y), loops)
+        if normals is not None:
+            self.setMeshNormals(me, self.vertexNormals(normals, coords, scale_x, scale_y))
 
-        # Select an appropriate binning mode
-        ## TODO: generalize the binning fn's
-        bin_mode = self.bin_mode()
-        bin_mode_funcs = {
-        'BIN2': self.bin2(image_iter),
-        'BIN6': self.bin6(image_iter),
-        'BIN6-FAST': self.bin6(image_iter, 'FAST'),
-        'BIN12': self.bin12(image_iter),
-        'BIN12-FAST': self.bin12(image_iter, 'FAST')
-        }
-        if bin_mode in bin_mode_funcs.keys():
-            image_iter = bin_mode_funcs[bin_mode]
+        ob = bpy.data.objects.new("DTM - %s" % bin_desc, me)
 
-        image_iter = self.shiftToOrigin(image_iter, img_min_max_vals)
+        return ob
 
-        if self.scale != 1.0:
-            image_iter = self.scaleZ(image_iter, img_min_max_vals)
+    def genMeshFromFile(self, path):
+        ''' a mesh object from arrays written by exportMesh (.npz), nothing is decoded '''
+        (coords, loops, loop_totals) = export.read_npz(path)
+        me = bpy.data.meshes.new(os.path.basename(path))
+        self.setMeshData(me, coords, loops, loop_totals)
+        return bpy.data.objects.new("DTM - %s" % os.path.splitext(os.path.basename(path))[0], me)
 
-        # Create a new mesh object and set data from the image iterator
-        ob_new = self.genMesh(image_iter)
+    def execute(self):
 
-        if img:
-            img.close()
+        if self.filepath().lower().endswith('.npz'):
+            # A mesh exported earlier, straight into blender
+            ob_new = self.genMeshFromFile(self.filepath())
+        else:
+            # Create a new mesh object and set data from the image iterator
+            ob_new = self.genMesh(self.loadImage())
+            # what the scene and flyover stages would otherwise have to read off the vertices
+            ob_new['dtm_stats'] = self.terrain_stats().as_dict()
 
         # Add mesh object to the current scene
         for s in bpy.data.scenes:
             scene = s
         scene.objects.link(ob_new)
+        for tile in ob_new.children:
+            scene.objects.link(tile)
         scene.update()
 
         # deselect other objects
@@ -723,6 +181,8 @@ class hirise_dtm_importer(object):
         # scene.objects.active = ob_new
         # Select the new mesh
         ob_new.select = True
+        for tile in ob_new.children:
+            tile.select = True
 
         return ob_new
 
@@ -735,7 +195,9 @@ class DTMViewerRenderContext:
     #   1 Lamp (Sun)
     #   1 Camera
     #   1 Empty (CameraTarget)
-    def __init__(self, dtm_img, dtm_resolution, dtm_stars, dtm_mist, bin_mode, scale, dtm_texture=None):
+    def __init__(self, dtm_img, dtm_resolution, dtm_stars, dtm_mist, bin_mode, scale, dtm_texture=None,
+                 use_pyramid=False, use_cache=False, mesh_mode='GRID', max_error=0.5, tile_size=0,
+                 lod_levels=1, export_path=None, use_normals=False):
         self.__img = dtm_img
         self.__texture = dtm_texture
         self.__resolution = dtm_resolution
@@ -745,6 +207,14 @@ class DTMViewerRenderContext:
         self.__dtm_max_v = (0.0, 0.0, 0.0)
         self.__dtm_min_v = (0,0, 0.0, 0.0)
         self.__scale = scale
+        self.__use_pyramid = use_pyramid
+        self.__use_cache = use_cache
+        self.__mesh_mode = mesh_mode
+        self.__max_error = max_error
+        self.__tile_size = tile_size
+        self.__lod_levels = lod_levels
+        self.__export_path = export_path
+        self.__use_normals = use_normals
 
     def createDefaultContext(self):
         ''' clears the current scene and fills it with a DTM '''
@@ -758,13 +228,14 @@ class DTMViewerRenderContext:
     def clearScene(self):
         bpy.ops.object.select_all(action='SELECT')
         bpy.ops.object.delete()
+        registry_module.registry.clear(bpy.context.scene)
         for mat in bpy.data.materials:
             bpy.data.materials.remove(mat)
 
     def setupLightSource(self):
         # The default "SUN" points straight down, which is fine for our needs
         bpy.ops.object.lamp_add(type='SUN')
-        sun = bpy.data.objects['Sun']
+        sun = registry_module.registry.register(bpy.context.scene, 'sun', bpy.context.scene.objects.active)
         sun.location = (self.__dtm_min_v[0]+self.__delta_v[0]/2, self.__dtm_min_v[1]+self.__delta_v[1]/2, self.__dtm_max_v[2]+100)
 
     # Set the rendering defaults
@@ -798,7 +269,18 @@ class DTMViewerRenderContext:
         helper = hirise_dtm_importer(self.__img)
         helper.bin_mode(self.__bin_mode)
         helper.scale(self.__scale)
+        helper.use_pyramid(self.__use_pyramid)
+        if self.__use_cache:
+            helper.cache(cache_module.DTMCache())
+        helper.mesh_mode(self.__mesh_mode)
+        helper.max_error(self.__max_error)
+        helper.tile_size(self.__tile_size)
+        helper.lod_levels(self.__lod_levels)
+        helper.export_path(self.__export_path)
+        helper.use_normals(self.__use_normals)
         dtm_mesh = helper.execute()
+        # the flyovers find the DTM (and its tiles) through the registry
+        registry_module.registry.register(bpy.context.scene, 'dtm', dtm_mesh)
 
         bpy.ops.object.select_pattern(pattern=dtm_mesh.name)
 
@@ -831,17 +313,34 @@ class DTMViewerRenderContext:
 
         mtex = mat.texture_slots.add()
         mtex.texture = tex
+        if not self.__texture is None:
+            # the texture covers the whole .IMG, the UVs of the mesh say where it sits
+            mtex.texture_coords = 'UV'
         mtex.color = (0.0, 0.0, 0.0)
 
+        # A tiled DTM is an empty holding one mesh object per tile
+        if dtm_mesh.type == 'EMPTY':
+            dtm_tiles = dtm_mesh.children
+        else:
+            dtm_tiles = [dtm_mesh]
+
         # Add a material to the DTM object
-        dtm_mesh.data.materials.append(mat)
+        for tile in dtm_tiles:
+            tile.data.materials.append(mat)
 
         #Store values for location computations
-        x = tuple(map(lambda xyz: xyz[0], dtm_mesh.bound_box))
-        y = tuple(map(lambda xyz: xyz[1], dtm_mesh.bound_box))
-        z = tuple(map(lambda xyz: xyz[2], dtm_mesh.bound_box))
-        self.__dtm_min_v = (min(x), min(y), min(z))
-        self.__dtm_max_v = (max(x), max(y), max(z))
+        if 'dtm_stats' in dtm_mesh and dtm_mesh['dtm_stats']['count']:
+            # the importer measured the terrain already
+            self.__dtm_min_v = tuple(dtm_mesh['dtm_stats']['min'])
+            self.__dtm_max_v = tuple(dtm_mesh['dtm_stats']['max'])
+        else:
+            # (tiles sit at the origin of their parent, so their bounds line up)
+            bound_box = [xyz for tile in dtm_tiles for xyz in tile.bound_box]
+            x = tuple(map(lambda xyz: xyz[0], bound_box))
+            y = tuple(map(lambda xyz: xyz[1], bound_box))
+            z = tuple(map(lambda xyz: xyz[2], bound_box))
+            self.__dtm_min_v = (min(x), min(y), min(z))
+            self.__dtm_max_v = (max(x), max(y), max(z))
         self.__delta_v = tuple(map(lambda a, b: a - b, self.__dtm_max_v, self.__dtm_min_v))
 
 
@@ -892,11 +391,18 @@ class DTMViewerRenderContext:
 
 #DEM loader
 def load(operator, context, filepath, scale, bin_mode, color_pattern, flyover_pattern,
-         texture_location, cropVars, resolution, stars, mist):
+         texture_location, cropVars, resolution, stars, mist, use_pyramid=False, use_cache=False,
+         mesh_mode='GRID', max_error=0.5, tile_size=0, lod_levels=1, export_format='NONE',
+         use_normals=False):
     print("Bin Mode: %s" % bin_mode)
     print("Scale: %f" % scale)
     print("Color Mapping: %s" % color_pattern)
     print("Flyover Mode: %s" % flyover_pattern)
+    #The mesh can also be written next to the DEM, i.e. DEM.IMG -> DEM.glb
+    export_path = None
+    if export_format != 'NONE':
+        export_path = os.path.splitext(filepath)[0] + '.' + export_format.lower()
+        print('Exporting mesh to: ' + export_path)
     #Strip out the image name for saving later as .blend file
     if _platform == "win32":
         save_path = filepath.split('\\')[-1:]
@@ -916,7 +422,15 @@ def load(operator, context, filepath, scale, bin_mode, color_pattern, flyover_pa
         dtm_stars=stars,
         dtm_mist=mist,
         bin_mode=bin_mode,
-        scale=scale)
+        scale=scale,
+        use_pyramid=use_pyramid,
+        use_cache=use_cache,
+        mesh_mode=mesh_mode,
+        max_error=max_error,
+        tile_size=tile_size,
+        lod_levels=lod_levels,
+        export_path=export_path,
+        use_normals=use_normals)
 
     try:
         print('Processing image in Blender, please be patient...')
@@ -938,9 +452,17 @@ def load(operator, context, filepath, scale, bin_mode, color_pattern, flyover_pa
         return True
     except:
         print("Not saving blend file...")
-        importer = hirise_dtm_importer(context, filepath)
+        importer = hirise_dtm_importer(filepath)
         importer.bin_mode(bin_mode)
         importer.scale(scale)
+        importer.use_pyramid(use_pyramid)
+        if use_cache:
+            importer.cache(cache_module.DTMCache())
+        importer.mesh_mode(mesh_mode)
+        importer.max_error(max_error)
+        importer.tile_size(tile_size)
+        importer.lod_levels(lod_levels)
+        importer.use_normals(use_normals)
         if cropVars:
             importer.crop(cropVars[0], cropVars[1], cropVars[2], cropVars[3])
         importer.execute()
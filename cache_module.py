@@ -0,0 +1,125 @@
+'''This module keeps binned DTM height grids on disk so re-importing the same DTM
+   (with another color map, scale or flyover) does not have to decode the .IMG again.
+   Entries are keyed by the file (size, mtime and a hash of its first and last bytes)
+   plus the bin mode and crop, stored as .npy files with a small .json sidecar, and
+   the least recently used entries are removed once the cache grows past its size cap.'''
+
+import hashlib
+import json
+import os
+import numpy
+
+
+class DTMCache(object):
+    #Bytes hashed at the start and at the end of a file to tell files apart.
+    sample_bytes = 1024 * 1024
+    #Stored value of a missing sample when quantizing to int16.
+    quantized_missing = -32768
+
+    def __init__(self, cache_dir=None, max_bytes=4 * 1024 ** 3, quantize=False):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser("~"), ".spaceblend", "dtm_cache")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        #Store int16 with an offset and scale instead of float32 (half the size).
+        self.quantize = quantize
+
+    #Content address of a DTM file and the parameters used to decode it.
+    def key(self, filepath, *params):
+        stat = os.stat(filepath)
+        digest = hashlib.sha1()
+        digest.update(repr((stat.st_size, stat.st_mtime) + params).encode('utf-8'))
+        with open(filepath, 'rb') as dtm:
+            digest.update(dtm.read(self.sample_bytes))
+            if stat.st_size > self.sample_bytes:
+                dtm.seek(-self.sample_bytes, os.SEEK_END)
+                digest.update(dtm.read(self.sample_bytes))
+        return digest.hexdigest()
+
+    def paths(self, key):
+        return os.path.join(self.cache_dir, key + ".npy"), os.path.join(self.cache_dir, key + ".json")
+
+    #Returns (lines, meta) for a cached grid or None. Float32 grids come back memory mapped.
+    def load(self, key):
+        data_path, meta_path = self.paths(key)
+        if not os.path.exists(data_path) or not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, 'r') as meta_file:
+                meta = json.load(meta_file)
+            lines = numpy.load(data_path, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+        if 'quantized' in meta:
+            lines = self.dequantize(lines, meta)
+        #Touch the entry so it is the most recently used.
+        os.utime(data_path, None)
+        os.utime(meta_path, None)
+        return lines, meta
+
+    #Stores a (lines, samples) grid where missing samples equal meta['ignore_value'].
+    def store(self, key, lines, meta):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        meta = dict(meta)
+        lines = numpy.asarray(lines, dtype=numpy.float32)
+        if self.quantize:
+            lines = self.quantize_lines(lines, meta)
+        data_path, meta_path = self.paths(key)
+        #Write to temporary files first so a crash never leaves a half written entry.
+        with open(data_path + ".tmp", 'wb') as data_file:
+            numpy.save(data_file, lines)
+        with open(meta_path + ".tmp", 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(data_path + ".tmp", data_path)
+        os.replace(meta_path + ".tmp", meta_path)
+        self.evict(keep=key)
+
+    #Removes the least recently used entries until the cache fits in max_bytes.
+    def evict(self, keep=None):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            data_path, meta_path = self.paths(key)
+            try:
+                size = os.path.getsize(data_path) + os.path.getsize(meta_path)
+                used = os.path.getmtime(meta_path)
+            except OSError:
+                continue
+            entries.append((used, key, size))
+            total += size
+        for used, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in self.paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
+
+    def quantize_lines(self, lines, meta):
+        valid = lines != meta['ignore_value']
+        if valid.any():
+            offset = float(lines[valid].min())
+            scale = (float(lines[valid].max()) - offset) / 65534.0
+        else:
+            offset = 0.0
+            scale = 0.0
+        if scale == 0.0:
+            scale = 1.0
+        quantized = numpy.empty(lines.shape, dtype=numpy.int16)
+        quantized.fill(self.quantized_missing)
+        quantized[valid] = numpy.round((lines[valid] - offset) / scale - 32767.0)
+        meta['quantized'] = {'offset': offset, 'scale': scale}
+        return quantized
+
+    def dequantize(self, quantized, meta):
+        offset = meta['quantized']['offset']
+        scale = meta['quantized']['scale']
+        lines = ((quantized.astype(numpy.float32) + 32767.0) * scale + offset).astype(numpy.float32)
+        lines[quantized == self.quantized_missing] = meta['ignore_value']
+        return lines
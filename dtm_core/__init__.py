@@ -0,0 +1,14 @@
+'''Everything that turns a HiRISE DTM into numbers: reading the PDS label and image
+   lines, binning, the height grid and the vertex/face arrays of the mesh, and the
+   geometry the flyovers are planned with. Nothing in here imports bpy, so the
+   package can be imported on its own (with the add-on directory on sys.path) in a
+   worker process, a benchmark or a test run without Blender.'''
+
+from . import label
+from . import pyramid
+from . import rtin
+from . import stats
+from . import importer
+from . import geometry
+from . import heightfield
+from . import export
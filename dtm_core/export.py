@@ -0,0 +1,163 @@
+'''Writes the vertex/face arrays of a DTM mesh to binary PLY, glTF (.glb) or .npz
+   files, and reads the .npz back. Every writer takes the arrays setMeshData uses:
+   (n, 3) vertex coordinates, the vertex index of every face corner (loops) and the
+   number of corners of every face (loop_totals).'''
+
+import json
+import os
+import struct
+import numpy
+
+# Faces written to a PLY file per chunk, so large meshes never need a second copy
+# of the whole face list in memory
+chunk_faces = 1 << 20
+
+
+def loop_starts(loop_totals):
+    ''' index of the first loop of every face '''
+    loop_totals = numpy.asarray(loop_totals, dtype=numpy.int64)
+    starts = numpy.zeros(len(loop_totals), dtype=numpy.int64)
+    numpy.cumsum(loop_totals[:-1], out=starts[1:])
+    return starts
+
+
+def merge_meshes(meshes):
+    ''' one (coords, loops, loop_totals) out of several, i.e. the tiles of a DTM '''
+    meshes = list(meshes)
+    if not meshes:
+        return ( numpy.empty((0, 3), dtype=numpy.float32), numpy.empty(0, dtype=numpy.int64),
+                 numpy.empty(0, dtype=numpy.int32) )
+    offsets = numpy.cumsum([0] + [len(coords) for (coords, loops, loop_totals) in meshes[:-1]])
+    coords = numpy.concatenate([mesh[0] for mesh in meshes])
+    loops = numpy.concatenate([numpy.asarray(mesh[1], dtype=numpy.int64) + offset
+                               for (mesh, offset) in zip(meshes, offsets)])
+    loop_totals = numpy.concatenate([mesh[2] for mesh in meshes])
+    return ( coords, loops, loop_totals )
+
+
+def triangulate(loops, loop_totals):
+    ''' (n, 3) triangles of the faces, a face of k corners becomes a fan of k - 2 '''
+    loops = numpy.asarray(loops, dtype=numpy.int64)
+    loop_totals = numpy.asarray(loop_totals, dtype=numpy.int64)
+    starts = loop_starts(loop_totals)
+    triangles = []
+    for corner in range(2, int(loop_totals.max()) if len(loop_totals) else 2):
+        faces = starts[loop_totals > corner]
+        triangles.append(numpy.column_stack((loops[faces], loops[faces + corner - 1], loops[faces + corner])))
+    if not triangles:
+        return numpy.empty((0, 3), dtype=numpy.int64)
+    return numpy.concatenate(triangles)
+
+
+def write_ply(path, coords, loops, loop_totals):
+    ''' binary little endian PLY, faces are written in chunks '''
+    coords = numpy.ascontiguousarray(coords, dtype='<f4')
+    loops = numpy.asarray(loops)
+    loop_totals = numpy.asarray(loop_totals, dtype=numpy.int64)
+    starts = loop_starts(loop_totals)
+    with open(path, 'wb') as ply:
+        ply.write(("ply\n"
+                   "format binary_little_endian 1.0\n"
+                   "element vertex %d\n"
+                   "property float x\n"
+                   "property float y\n"
+                   "property float z\n"
+                   "element face %d\n"
+                   "property list uchar int vertex_indices\n"
+                   "end_header\n" % (len(coords), len(loop_totals))).encode('ascii'))
+        coords.tofile(ply)
+        for first in range(0, len(loop_totals), chunk_faces):
+            totals = loop_totals[first:first + chunk_faces]
+            face_loops = loops[starts[first]:starts[first] + totals.sum()].astype('<i4')
+            # every face is its corner count (1 byte) followed by its 4 byte indices
+            face_starts = numpy.arange(len(totals)) + 4 * (starts[first:first + len(totals)] - starts[first])
+            record = numpy.empty(len(totals) + 4 * len(face_loops), dtype=numpy.uint8)
+            record[face_starts] = totals
+            corner = numpy.arange(len(face_loops)) - numpy.repeat(starts[first:first + len(totals)] - starts[first], totals)
+            loop_bytes = numpy.repeat(face_starts, totals) + 1 + 4 * corner
+            record[loop_bytes[:, numpy.newaxis] + numpy.arange(4)] = face_loops.view(numpy.uint8).reshape(-1, 4)
+            record.tofile(ply)
+
+
+def write_glb(path, coords, loops, loop_totals):
+    ''' binary glTF 2.0 with one float32 position and one uint32 index buffer. glTF is
+        y-up and expects the front of a triangle to wind counter-clockwise, so
+        vertices are rotated from blender's z-up and triangles are wound to face up
+    '''
+    coords = numpy.asarray(coords, dtype=numpy.float32)
+    positions = numpy.empty(coords.shape, dtype='<f4')
+    positions[:, 0] = coords[:, 0]
+    positions[:, 1] = coords[:, 2]
+    positions[:, 2] = -coords[:, 1]
+
+    triangles = triangulate(loops, loop_totals)
+    if len(triangles):
+        corners = coords[triangles]
+        normal_z = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])[:, 2]
+        triangles[normal_z < 0] = triangles[normal_z < 0][:, ::-1]
+    indices = numpy.ascontiguousarray(triangles, dtype='<u4')
+
+    position_bytes = positions.nbytes
+    index_bytes = indices.nbytes
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'SpaceBlend DTM importer'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 0}, 'indices': 1, 'mode': 4}]}],
+        'buffers': [{'byteLength': position_bytes + index_bytes}],
+        'bufferViews': [
+            {'buffer': 0, 'byteOffset': 0, 'byteLength': position_bytes, 'target': 34962},
+            {'buffer': 0, 'byteOffset': position_bytes, 'byteLength': index_bytes, 'target': 34963},
+        ],
+        'accessors': [
+            {'bufferView': 0, 'componentType': 5126, 'count': len(positions), 'type': 'VEC3',
+             'min': positions.min(axis=0).tolist() if len(positions) else [0.0, 0.0, 0.0],
+             'max': positions.max(axis=0).tolist() if len(positions) else [0.0, 0.0, 0.0]},
+            {'bufferView': 1, 'componentType': 5125, 'count': indices.size, 'type': 'SCALAR'},
+        ],
+    }
+    json_chunk = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+    bin_length = position_bytes + index_bytes
+    bin_padding = -bin_length % 4
+
+    with open(path, 'wb') as glb:
+        glb.write(struct.pack('<4sII', b'glTF', 2, 12 + 8 + len(json_chunk) + 8 + bin_length + bin_padding))
+        glb.write(struct.pack('<I4s', len(json_chunk), b'JSON'))
+        glb.write(json_chunk)
+        glb.write(struct.pack('<I4s', bin_length + bin_padding, b'BIN\0'))
+        positions.tofile(glb)
+        indices.tofile(glb)
+        glb.write(b'\0' * bin_padding)
+
+
+def write_npz(path, coords, loops, loop_totals):
+    ''' the arrays as they are, for blender (read_npz) or numpy based tools '''
+    with open(path, 'wb') as npz:
+        numpy.savez(npz,
+                    coords=numpy.asarray(coords, dtype=numpy.float32),
+                    loops=numpy.asarray(loops, dtype=numpy.int32),
+                    loop_totals=numpy.asarray(loop_totals, dtype=numpy.int32))
+
+
+def read_npz(path):
+    ''' (coords, loops, loop_totals) of a file written by write_npz '''
+    with numpy.load(path) as npz:
+        return ( npz['coords'], npz['loops'], npz['loop_totals'] )
+
+
+# file extension -> writer
+writers = {
+    '.ply': write_ply,
+    '.glb': write_glb,
+    '.npz': write_npz,
+}
+
+
+def write_mesh(path, coords, loops, loop_totals):
+    ''' writes the mesh in the format its extension names '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in writers:
+        raise ValueError("Unknown mesh format", path)
+    writers[extension](path, coords, loops, loop_totals)
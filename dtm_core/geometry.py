@@ -0,0 +1,224 @@
+'''The geometry the flyovers are planned with, on plain tuples and numpy arrays of
+   vertex coordinates.'''
+
+import math
+import numpy
+
+
+def distance_two_points(point_one, point_two):
+    ''' euclidean distance between two (x, y, z) points '''
+    return math.sqrt((point_one[0] - point_two[0])*(point_one[0] - point_two[0]) +
+                     (point_one[1] - point_two[1])*(point_one[1] - point_two[1]) +
+                     (point_one[2] - point_two[2])*(point_one[2] - point_two[2]))
+
+
+def midpoint_two_points(point_one, point_two):
+    return (point_one[0]+point_two[0])/2, (point_one[1]+point_two[1])/2, (point_one[2]+point_two[2])/2
+
+
+def get_center(boundaries):
+    ''' midpoint of the DEM from the list returned by dem_boundaries '''
+    x_cross_mid_p = midpoint_two_points(boundaries[0], boundaries[1])
+    y_cross_mid_p = midpoint_two_points(boundaries[2], boundaries[3])
+    return midpoint_two_points(x_cross_mid_p, y_cross_mid_p)
+
+
+def dem_boundaries(coords):
+    ''' [x max point, x min point, y max point, y min point, z max value] of an
+        (n, 3) array of vertex coordinates. Same answer as scanning the vertices in
+        order from the starting values (0, 0, 0), (100, 0, 0), (0, 0, 0),
+        (0, 100, 0) and -10: the maxima keep the last vertex of a tie, the minima
+        the first one
+    '''
+    coords = numpy.asarray(coords).reshape(-1, 3)
+
+    def point(index):
+        return tuple(float(value) for value in coords[index])
+
+    x_max_point = (0, 0, 0)
+    x_min_point = (100, 0, 0)
+    y_max_point = (0, 0, 0)
+    y_min_point = (0, 100, 0)
+    z_max_value = -10
+    if len(coords):
+        x = coords[:, 0]
+        y = coords[:, 1]
+        if x.max() >= x_max_point[0]:
+            x_max_point = point(len(x) - 1 - numpy.argmax(x[::-1]))
+        if x.min() < x_min_point[0]:
+            x_min_point = point(numpy.argmin(x))
+        if y.max() >= y_max_point[1]:
+            y_max_point = point(len(y) - 1 - numpy.argmax(y[::-1]))
+        if y.min() < y_min_point[1]:
+            y_min_point = point(numpy.argmin(y))
+        if coords[:, 2].max() > z_max_value:
+            z_max_value = float(coords[:, 2].max())
+    return [x_max_point, x_min_point, y_max_point, y_min_point, z_max_value]
+
+
+def closest_points(coords, points, max_distance=100):
+    ''' the vertex of coords closest to every point (the first one of a tie), or
+        the point itself when no vertex is within max_distance
+    '''
+    coords = numpy.asarray(coords, dtype=numpy.float64).reshape(-1, 3)
+    closest = []
+    for point in points:
+        closest.append((point[0], point[1], point[2]))
+        if len(coords) == 0:
+            continue
+        distance = numpy.sqrt(((coords - numpy.asarray(point[:3], dtype=numpy.float64)) ** 2).sum(axis=1))
+        index = numpy.argmin(distance)
+        if distance[index] < max_distance:
+            closest[-1] = tuple(float(value) for value in coords[index])
+    return closest
+
+
+def sample_path(points, count):
+    ''' resamples a polyline into count points evenly spaced by distance along it.
+        Blender moves objects that follow a path at constant speed, so these are the
+        positions of the camera on evenly spaced frames
+    '''
+    points = numpy.asarray(points, dtype=numpy.float64)
+    lengths = numpy.concatenate(([0.0], numpy.cumsum(numpy.linalg.norm(numpy.diff(points, axis=0), axis=1))))
+    targets = numpy.linspace(0.0, lengths[-1], count)
+    return numpy.column_stack([numpy.interp(targets, lengths, points[:, axis]) for axis in range(0, 3)])
+
+
+def follow_path(path, offset):
+    ''' where an object parented to a path (blender's FOLLOW parenting) is on every
+        point of it: its offset from the first point turns with the heading of the path
+    '''
+    path = numpy.asarray(path, dtype=numpy.float64).reshape(-1, 3)
+    offset = numpy.asarray(offset, dtype=numpy.float64)
+    if len(path) < 2:
+        return path + offset
+    tangents = numpy.gradient(path[:, :2], axis=0)
+    heading = numpy.unwrap(numpy.arctan2(tangents[:, 1], tangents[:, 0]))
+    (cos, sin) = ( numpy.cos(heading - heading[0]), numpy.sin(heading - heading[0]) )
+    return path + numpy.column_stack((cos * offset[0] - sin * offset[1],
+                                      sin * offset[0] + cos * offset[1],
+                                      numpy.full(len(path), offset[2])))
+
+
+def frustum_visibility(cameras, targets, view, box_min, box_max, margin=0.1, chunk=64):
+    ''' (frames, boxes) whether any part of each axis aligned box can be in view of a
+        camera at every camera point looking at the target. view is (tan of half the
+        horizontal angle, tan of half the vertical angle, clip start, clip end), widened
+        by margin. Conservative: a box is only out of view when all of its corners are
+        outside of the same side of the frustum
+    '''
+    box_min = numpy.asarray(box_min, dtype=numpy.float64).reshape(-1, 3)
+    box_max = numpy.asarray(box_max, dtype=numpy.float64).reshape(-1, 3)
+    # (boxes, 8, 3) corners, every combination of min and max per axis
+    pick = numpy.array([[(corner >> axis) & 1 for axis in range(0, 3)] for corner in range(0, 8)], dtype=bool)
+    corners = numpy.where(pick[numpy.newaxis], box_max[:, numpy.newaxis, :], box_min[:, numpy.newaxis, :])
+    (x_axis, y_axis, z_axis) = look_at_axes(cameras, targets)
+    cameras = numpy.asarray(cameras, dtype=numpy.float64).reshape(-1, 3)
+    tan_x = view[0] * (1.0 + margin)
+    tan_y = view[1] * (1.0 + margin)
+
+    visible = numpy.empty((len(cameras), len(box_min)), dtype=bool)
+    for first in range(0, len(cameras), chunk):
+        frames = slice(first, first + chunk)
+        offset = corners[numpy.newaxis] - cameras[frames, numpy.newaxis, numpy.newaxis, :]
+        x = numpy.einsum('fbkc,fc->fbk', offset, x_axis[frames])
+        y = numpy.einsum('fbkc,fc->fbk', offset, y_axis[frames])
+        depth = -numpy.einsum('fbkc,fc->fbk', offset, z_axis[frames])
+        outside = ((x > depth * tan_x).all(axis=2) | (x < -depth * tan_x).all(axis=2) |
+                   (y > depth * tan_y).all(axis=2) | (y < -depth * tan_y).all(axis=2) |
+                   (depth < view[2]).all(axis=2) | (depth > view[3]).all(axis=2))
+        visible[frames] = ~outside
+    return visible
+
+
+def frame_ranges(frames):
+    ''' "1-20, 35, 40-42" for the sorted frame numbers '''
+    frames = numpy.asarray(frames, dtype=numpy.int64)
+    if len(frames) == 0:
+        return ""
+    breaks = numpy.flatnonzero(numpy.diff(frames) != 1)
+    starts = frames[numpy.concatenate(([0], breaks + 1))]
+    ends = frames[numpy.concatenate((breaks, [len(frames) - 1]))]
+    return ", ".join(str(start) if start == end else "%d-%d" % (start, end) for (start, end) in zip(starts, ends))
+
+
+def look_at_axes(cameras, targets):
+    ''' the (n, 3) x, y and z axes of a camera at every camera point looking at the
+        target: its -Z axis on the target, its Y axis up like blender's TRACK_TO with
+        UP_Y
+    '''
+    cameras = numpy.asarray(cameras, dtype=numpy.float64).reshape(-1, 3)
+    targets = numpy.asarray(targets, dtype=numpy.float64).reshape(-1, 3)
+    z_axis = cameras - targets
+    z_axis /= numpy.maximum(numpy.linalg.norm(z_axis, axis=1), 1e-12)[:, numpy.newaxis]
+    x_axis = numpy.cross((0.0, 0.0, 1.0), z_axis)
+    length = numpy.linalg.norm(x_axis, axis=1)
+    # looking straight up or down: any heading will do, keep x
+    straight = length < 1e-9
+    x_axis[straight] = (1.0, 0.0, 0.0)
+    length[straight] = 1.0
+    x_axis /= length[:, numpy.newaxis]
+    y_axis = numpy.cross(z_axis, x_axis)
+    return ( x_axis, y_axis, z_axis )
+
+
+def look_at_euler(cameras, targets):
+    ''' (n, 3) XYZ euler rotations turning a camera at every camera point so it looks
+        at the target (see look_at_axes). The angles are unwrapped so they never jump
+        between frames
+    '''
+    (x_axis, y_axis, z_axis) = look_at_axes(cameras, targets)
+    # rotation = Rz * Ry * Rx, the columns are the x, y and z axes
+    euler = numpy.column_stack((numpy.arctan2(y_axis[:, 2], z_axis[:, 2]),
+                                numpy.arcsin(numpy.clip(-x_axis[:, 2], -1.0, 1.0)),
+                                numpy.arctan2(x_axis[:, 1], x_axis[:, 0])))
+    return numpy.unwrap(euler, axis=0)
+
+
+def resample_path(points, spacing):
+    ''' resamples a polyline into points at most spacing apart along it, both ends kept '''
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+    length = numpy.linalg.norm(numpy.diff(points, axis=0), axis=1).sum()
+    return sample_path(points, max(int(numpy.ceil(length / spacing)) + 1, 2))
+
+
+def window_filter(values, window, reduce, cyclic=False):
+    ''' reduce (numpy.max, numpy.mean...) of the window values centered on every one,
+        the ends padded with the edge values or wrapped around for a closed path
+    '''
+    half = window // 2
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if half == 0 or len(values) == 0:
+        return values.copy()
+    padded = numpy.pad(values, half, mode='wrap' if cyclic else 'edge')
+    windows = numpy.lib.stride_tricks.as_strided(padded, (len(values), 2 * half + 1), padded.strides * 2)
+    return reduce(windows, axis=1)
+
+
+def clear_terrain(points, terrain, clearance, window, cyclic=False):
+    ''' raises a (densely sampled) path so every point is at least clearance above the
+        terrain height under it. The required height is widened by a max filter and
+        then smoothed by a mean filter of the same window, so the path climbs ahead of
+        a ridge instead of bumping over it and never dips under the clearance. Where
+        the terrain is unknown (NaN) the path is kept as it is
+    '''
+    points = numpy.array(points, dtype=numpy.float64).reshape(-1, 3)
+    required = numpy.asarray(terrain, dtype=numpy.float64) + clearance
+    missing = numpy.isnan(required)
+    required[missing] = points[missing, 2]
+    required = window_filter(window_filter(required, window, numpy.max, cyclic), window, numpy.mean, cyclic)
+    points[:, 2] = numpy.maximum(points[:, 2], required)
+    return points
+
+
+def lod_levels(positions, centers, sizes, level_count):
+    ''' (frames, tiles) level of detail of every tile on every frame. A tile drops one
+        level each time the camera is twice as far away, starting at twice its size
+    '''
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+    centers = numpy.asarray(centers, dtype=numpy.float64)
+    sizes = numpy.asarray(sizes, dtype=numpy.float64)
+    distance = numpy.linalg.norm(positions[:, numpy.newaxis, :] - centers[numpy.newaxis, :, :], axis=2)
+    ratio = numpy.maximum(distance / numpy.maximum(sizes, 1e-9), 1.0)
+    levels = numpy.floor(numpy.log2(ratio)).astype(numpy.int64)
+    return numpy.clip(levels, 0, level_count - 1)
@@ -0,0 +1,191 @@
+'''Terrain heights under any number of (x, y) points at once, by bilinear sampling
+   of the regular grid the DTM mesh was made from.'''
+
+import numpy
+from . import geometry
+
+
+class height_field:
+    ''' grid[row, col] is the height of the vertex at (origin x + col * spacing x,
+        origin y - row * spacing y), NaN where there is none -- the layout
+        gridVertices gives the vertices of a DTM
+    '''
+
+    def __init__(self, grid, spacing, origin=(0.0, 0.0)):
+        self.__grid = numpy.asarray(grid, dtype=numpy.float32)
+        self.__spacing = ( float(spacing[0]), float(spacing[1]) )
+        self.__origin = ( float(origin[0]), float(origin[1]) )
+
+    def grid(self):
+        return self.__grid
+
+    def spacing(self):
+        return self.__spacing
+
+    def origin(self):
+        return self.__origin
+
+    def heights(self, x, y):
+        ''' the terrain height under every (x[i], y[i]): bilinear between the four
+            surrounding vertices, weighted over the valid ones where some are missing,
+            NaN outside the grid or where all four are missing
+        '''
+        x = numpy.asarray(x, dtype=numpy.float64).ravel()
+        y = numpy.asarray(y, dtype=numpy.float64).ravel()
+        heights = numpy.empty(len(x), dtype=numpy.float64)
+        heights.fill(numpy.nan)
+        (rows, cols) = self.__grid.shape
+        if rows == 0 or cols == 0:
+            return heights
+
+        col = (x - self.__origin[0]) / self.__spacing[0]
+        row = (self.__origin[1] - y) / self.__spacing[1]
+        inside = (col >= 0) & (col <= cols - 1) & (row >= 0) & (row <= rows - 1)
+        (col, row) = ( col[inside], row[inside] )
+
+        col0 = numpy.clip(numpy.floor(col).astype(numpy.int64), 0, max(cols - 2, 0))
+        row0 = numpy.clip(numpy.floor(row).astype(numpy.int64), 0, max(rows - 2, 0))
+        col1 = numpy.minimum(col0 + 1, cols - 1)
+        row1 = numpy.minimum(row0 + 1, rows - 1)
+        tx = numpy.clip(col - col0, 0.0, 1.0)
+        ty = numpy.clip(row - row0, 0.0, 1.0)
+
+        corners = numpy.array([self.__grid[row0, col0], self.__grid[row0, col1],
+                               self.__grid[row1, col0], self.__grid[row1, col1]], dtype=numpy.float64)
+        weights = numpy.array([(1 - tx) * (1 - ty), tx * (1 - ty), (1 - tx) * ty, tx * ty])
+        valid = ~numpy.isnan(corners)
+        weights = numpy.where(valid, weights, 0.0)
+        corners = numpy.where(valid, corners, 0.0)
+        total = weights.sum(axis=0)
+        count = valid.sum(axis=0)
+
+        sampled = numpy.empty(len(col), dtype=numpy.float64)
+        sampled.fill(numpy.nan)
+        numpy.divide((weights * corners).sum(axis=0), total, out=sampled, where=total > 0)
+        # on the edge of a hole the nearest corners can all be missing
+        mean = (total == 0) & (count > 0)
+        sampled[mean] = corners[:, mean].sum(axis=0) / count[mean]
+        heights[inside] = sampled
+        return heights
+
+
+def evaluate_trajectory(field, cameras, targets, clearance, samples=64):
+    ''' checks every frame of a flyover at once: cameras and targets are (frames, 3).
+        Each sight line is marched in samples steps against the terrain. Returns a
+        dict of (frames,) arrays: the camera height over the terrain, whether it is
+        under clearance (collides), whether the terrain hides the target (occluded)
+        and how much the camera has to rise to fix both (raise), assuming the target
+        stays where it is
+    '''
+    cameras = numpy.asarray(cameras, dtype=numpy.float64).reshape(-1, 3)
+    targets = numpy.asarray(targets, dtype=numpy.float64).reshape(-1, 3)
+    # the ends are left out: the target usually sits on the terrain
+    t = numpy.linspace(0.0, 1.0, samples + 2)[1:-1]
+    rays = cameras[:, numpy.newaxis, :] + t[numpy.newaxis, :, numpy.newaxis] * (targets - cameras)[:, numpy.newaxis, :]
+    terrain = field.heights(rays[..., 0].ravel(), rays[..., 1].ravel()).reshape(rays.shape[:2])
+    margin = rays[..., 2] - terrain
+    margin[numpy.isnan(margin)] = numpy.inf
+
+    height = cameras[:, 2] - field.heights(cameras[:, 0], cameras[:, 1])
+    height[numpy.isnan(height)] = numpy.inf
+    # raising the camera by h raises the sight line by h * (1 - t)
+    needed = numpy.maximum((-margin / (1.0 - t)).max(axis=1), clearance - height)
+    return {
+        'height': height,
+        'collides': height < clearance,
+        'occluded': (margin < 0).any(axis=1),
+        'raise': numpy.maximum(needed, 0.0),
+    }
+
+
+def raise_trajectory(cameras, report, window=1):
+    ''' the cameras raised by the report of evaluate_trajectory, the raise widened and
+        smoothed over window frames like geometry.clear_terrain does
+    '''
+    cameras = numpy.array(cameras, dtype=numpy.float64).reshape(-1, 3)
+    lift = geometry.window_filter(geometry.window_filter(report['raise'], window, numpy.max), window, numpy.mean)
+    cameras[:, 2] += lift
+    return cameras
+
+
+def from_vertices(coords, spacing=None):
+    ''' the height_field of the vertices of a DTM mesh (or of its tiles, any levels
+        of detail included). The spacing is the smallest step between two vertex x
+        (and y) when it isn't known
+    '''
+    coords = numpy.asarray(coords, dtype=numpy.float64).reshape(-1, 3)
+    if len(coords) == 0:
+        return height_field(numpy.empty((0, 0), dtype=numpy.float32), (1.0, 1.0))
+    if spacing is None:
+        spacing = tuple(smallest_step(coords[:, axis]) for axis in (0, 1))
+
+    cols = numpy.rint(coords[:, 0] / spacing[0]).astype(numpy.int64)
+    rows = numpy.rint(-coords[:, 1] / spacing[1]).astype(numpy.int64)
+    (first_col, first_row) = ( cols.min(), rows.min() )
+    grid = numpy.empty((rows.max() - first_row + 1, cols.max() - first_col + 1), dtype=numpy.float32)
+    grid.fill(numpy.nan)
+    grid[rows - first_row, cols - first_col] = coords[:, 2]
+    return height_field(grid, spacing, ( first_col * spacing[0], -first_row * spacing[1] ))
+
+
+def from_triangles(coords, triangles, spacing=None, chunk=1 << 20):
+    ''' the height_field of a triangle mesh of a DTM: every grid node a triangle
+        covers gets the height of the triangle there, so the nodes an adaptive mesh
+        has no vertex on are filled too and only the nodes off the terrain are NaN.
+        The spacing is the smallest step between two vertex x (and y) when it isn't
+        known
+    '''
+    coords = numpy.asarray(coords, dtype=numpy.float64).reshape(-1, 3)
+    triangles = numpy.asarray(triangles, dtype=numpy.int64).reshape(-1, 3)
+    if len(coords) == 0 or len(triangles) == 0:
+        return from_vertices(coords, spacing)
+    if spacing is None:
+        spacing = tuple(smallest_step(coords[:, axis]) for axis in (0, 1))
+
+    # vertices in (fractional) grid nodes, the nodes lined up like from_vertices
+    cols = coords[:, 0] / spacing[0]
+    rows = -coords[:, 1] / spacing[1]
+    (first_col, first_row) = ( int(numpy.rint(cols.min())), int(numpy.rint(rows.min())) )
+    grid = numpy.empty((int(numpy.rint(rows.max())) - first_row + 1, int(numpy.rint(cols.max())) - first_col + 1),
+                       dtype=numpy.float32)
+    grid.fill(numpy.nan)
+    (rows, cols) = ( rows - first_row, cols - first_col )
+    grid[numpy.rint(rows).astype(numpy.int64), numpy.rint(cols).astype(numpy.int64)] = coords[:, 2]
+
+    (row, col, z) = ( rows[triangles], cols[triangles], coords[:, 2][triangles] )
+    low = numpy.ceil(numpy.column_stack((row.min(axis=1), col.min(axis=1))) - 1e-6).astype(numpy.int64)
+    high = numpy.floor(numpy.column_stack((row.max(axis=1), col.max(axis=1))) + 1e-6).astype(numpy.int64)
+    (low, high) = ( numpy.maximum(low, 0), numpy.minimum(high, numpy.array(grid.shape) - 1) )
+    # the node boxes rounded up to powers of two, so a few shapes cover every triangle
+    extent = 2 ** numpy.ceil(numpy.log2(numpy.maximum(high - low + 1, 1))).astype(numpy.int64)
+    det = (row[:, 1] - row[:, 0]) * (col[:, 2] - col[:, 0]) - (col[:, 1] - col[:, 0]) * (row[:, 2] - row[:, 0])
+    # a triangle within 2 x 2 nodes covers no node but its corners, which hold vertices already
+    usable = (numpy.abs(det) > 1e-12) & (high >= low).all(axis=1) & (high - low > 1).any(axis=1)
+    keys = extent[:, 0] * (grid.shape[1] + 1) * 2 + extent[:, 1]
+    for key in numpy.unique(keys[usable]):
+        group = numpy.flatnonzero(usable & (keys == key))
+        offsets = numpy.indices(extent[group[0]]).reshape(2, -1).T
+        count = max(chunk // len(offsets), 1)
+        for first in range(0, len(group), count):
+            part = group[first:first + count]
+            nodes = low[part, numpy.newaxis, :] + offsets[numpy.newaxis]
+            (node_row, node_col) = ( nodes[..., 0] - row[part, 0:1], nodes[..., 1] - col[part, 0:1] )
+            (row_b, col_b) = ( row[part, 1:2] - row[part, 0:1], col[part, 1:2] - col[part, 0:1] )
+            (row_c, col_c) = ( row[part, 2:3] - row[part, 0:1], col[part, 2:3] - col[part, 0:1] )
+            wb = (node_row * col_c - node_col * row_c) / det[part, numpy.newaxis]
+            wc = (row_b * node_col - col_b * node_row) / det[part, numpy.newaxis]
+            wa = 1.0 - wb - wc
+            inside = ((wa >= -1e-6) & (wb >= -1e-6) & (wc >= -1e-6) &
+                      (nodes <= high[part, numpy.newaxis, :]).all(axis=2))
+            heights = wa * z[part, 0:1] + wb * z[part, 1:2] + wc * z[part, 2:3]
+            grid[nodes[..., 0][inside], nodes[..., 1][inside]] = heights[inside]
+    return height_field(grid, spacing, ( first_col * spacing[0], -first_row * spacing[1] ))
+
+
+def smallest_step(values):
+    ''' the smallest (non rounding noise) difference between two of the values '''
+    steps = numpy.diff(numpy.unique(values))
+    steps = steps[steps > 1e-6 * max(1.0, float(numpy.abs(values).max()))]
+    if len(steps) == 0:
+        return 1.0
+    return float(steps.min())
@@ -0,0 +1,966 @@
+'''Reads a HiRISE DTM (.IMG) into a height grid and the vertex/face arrays of its mesh.
+   The Blender importer (blender_module.hirise_dtm_importer) only adds the steps
+   that create Blender objects.'''
+
+from struct import pack, unpack
+import queue, threading
+import concurrent.futures
+import os
+import numpy
+from .label import image_properties, pds_label
+from .pyramid import dtm_pyramid
+from .rtin import rtin_tile
+from .stats import terrain_stats
+from . import export
+
+
+# The last pyramid built, kept so re-importing the same DTM with another bin mode
+# does not have to read the file again
+dtm_pyramid_cache = {}
+
+
+class dtm_importer(object):
+    ''' methods to understand/read a HiRISE DTM formatted as a PDS .IMG and turn it
+        into a height grid and mesh arrays
+    '''
+
+    # bin mode -> (bin factor, bin method type, sample offset of the FAST modes)
+    bin_modes = {
+        'BIN2': (2, 'SLOW', 0),
+        'BIN4': (4, 'SLOW', 0),
+        'BIN6': (6, 'SLOW', 0),
+        'BIN6-FAST': (6, 'FAST', 0),
+        'BIN8': (8, 'SLOW', 0),
+        'BIN12': (12, 'SLOW', 0),
+        'BIN12-FAST': (12, 'FAST', 11),
+        'BIN16': (16, 'SLOW', 0),
+        'BIN24': (24, 'SLOW', 0),
+    }
+
+    def __init__(self, filepath):
+        self.__filepath = filepath
+        self.__ignore_value = 0x00000000
+        self.__bin_mode = 'BIN6'
+        self.scale(1.0)
+        self.__cropXY = False
+        self.__reader_mode = 'MMAP'
+        self.__label = None
+        self.__use_pyramid = False
+        self.__cache = None
+        self.__mesh_mode = 'GRID'
+        self.__max_error = 0.5
+        self.__tile_size = 0
+        self.__lod_levels = 1
+        self.__export_path = None
+        self.__use_normals = False
+        self.__terrain_stats = None
+
+    def filepath(self):
+        return self.__filepath
+
+    def bin_mode(self, bin_mode=None):
+        if bin_mode != None:
+            self.__bin_mode = bin_mode
+        return self.__bin_mode
+
+    def scale(self, scale=None):
+        if scale is not None:
+            self.__scale = scale
+        return self.__scale
+
+    def use_pyramid(self, use_pyramid=None):
+        ''' build (or reuse) every averaged bin level at once instead of only the current one '''
+        if use_pyramid is not None:
+            self.__use_pyramid = use_pyramid
+        return self.__use_pyramid
+
+    def cache(self, cache=None):
+        ''' a cache_module.DTMCache to keep binned lines in across imports (or None) '''
+        if cache is not None:
+            self.__cache = cache
+        return self.__cache
+
+    def mesh_mode(self, mesh_mode=None):
+        ''' 'GRID' makes one vertex per (binned) sample, 'ADAPTIVE' keeps only the
+            vertices needed to stay within max_error of the grid
+        '''
+        if mesh_mode is not None:
+            self.__mesh_mode = mesh_mode
+        return self.__mesh_mode
+
+    def max_error(self, max_error=None):
+        ''' the vertical error (in meters) allowed by the ADAPTIVE mesh mode '''
+        if max_error is not None:
+            self.__max_error = max_error
+        return self.__max_error
+
+    def tile_size(self, tile_size=None):
+        ''' samples along each side of a tile object, 0 imports a single mesh object '''
+        if tile_size is not None:
+            self.__tile_size = tile_size
+        return self.__tile_size
+
+    def lod_levels(self, lod_levels=None):
+        ''' resolutions built for every tile (each one half the previous one), the
+            flyover shows one of them depending on the distance to the camera
+        '''
+        if lod_levels is not None:
+            self.__lod_levels = lod_levels
+        return self.__lod_levels
+
+    def export_path(self, export_path=None):
+        ''' where to also write the mesh arrays (.ply, .glb or .npz), or None '''
+        if export_path is not None:
+            self.__export_path = export_path
+        return self.__export_path
+
+    def use_normals(self, use_normals=None):
+        ''' give the mesh smooth normals computed from the height grid '''
+        if use_normals is not None:
+            self.__use_normals = use_normals
+        return self.__use_normals
+
+    def terrain_stats(self):
+        ''' the terrain_stats of the last import, complete once its lines are read '''
+        return self.__terrain_stats
+
+    def reader_mode(self, reader_mode=None):
+        ''' 'MMAP' maps the .IMG into memory and yields numpy views of each line,
+            'STREAM' reads and unpacks each line with struct
+        '''
+        if reader_mode is not None:
+            self.__reader_mode = reader_mode
+        return self.__reader_mode
+
+    def crop(self, widthX, widthY, offX, offY):
+        self.__cropXY = [widthX, widthY, offX, offY]
+        return self.__cropXY
+
+    ############################################################################
+    ## PDS Label Operations
+    ############################################################################
+
+    def parsePDSLabel(self, labelIter, currentObjectName=None, level=""):
+        # Let's parse this thing... semi-recursively
+        ## I started writing this caring about everything in the PDS standard but ...
+        ## it's a mess and I only need a few things -- thar be hacks below
+        ## Mostly I just don't care about continued data from previous lines
+        label_structure = []
+
+        # When are we done with this level?
+        endStr = "END"
+        if not currentObjectName is None:
+            endStr = "END_OBJECT = %s" % currentObjectName
+        line = ""
+
+        while not line.rstrip() == endStr:
+            line = next(labelIter)
+
+            # Get rid of comments
+            comment = line.find("/*")
+            if comment > -1:
+                line = line[:comment]
+
+            # Take notice of objects
+            if line[:8] == "OBJECT =":
+                objName = line[8:].rstrip()
+                label_structure.append(
+                    (
+                    objName.lstrip().rstrip(),
+                    self.parsePDSLabel(labelIter, objName.lstrip().rstrip(), level + "	")
+                    )
+                )
+            elif line.find("END_OBJECT =") > -1:
+                pass
+            elif len(line.rstrip().lstrip()) > 0:
+                key_val = line.split(" = ", 2)
+                if len(key_val) == 2:
+                    label_structure.append((key_val[0].rstrip().lstrip(), key_val[1].rstrip().lstrip()))
+
+        return label_structure
+
+    # There has got to be a better way in python?
+    def iterArr(self, label):
+        for line in label:
+            yield line
+
+    def getPDSLabel(self, img):
+        # Just takes file and stores it into an array for later use
+        label = []
+        done = False;
+        # Grab label into array of lines
+        while not done:
+            line = str(img.readline(), 'utf-8')
+            if line.rstrip() == "END":
+                done = True
+            label.append(line)
+        return (label, self.parsePDSLabel(self.iterArr(label)))
+
+    def getLinesAndSamples(self, label):
+        ''' uses the indexed PDS Label (pds_label) to get the LINES and LINE_SAMPLES
+                parameters from the first object named "IMAGE"
+        '''
+        return label.dims()
+
+    def getValidMinMax(self, label):
+        ''' uses the indexed PDS Label (pds_label) to get the VALID_MINIMUM and
+                VALID_MAXIMUM parameters from the first object named "IMAGE"
+        '''
+        return label.valid_min_max()
+
+    def getMissingConstant(self, label):
+        ''' uses the indexed PDS Label (pds_label) to get the MISSING_CONSTANT parameter
+                from the first object named "IMAGE"
+        '''
+        ignore_value = self.__ignore_value
+        bit_string_repr = label.get("MISSING_CONSTANT", "")
+
+        # This is always the same for a HiRISE image, so we are just checking it
+        # to be a little less insane here. If someone wants to support another
+        # constant then go for it. Just make sure this one continues to work too
+        pieces = bit_string_repr.split("#")
+        if pieces[0] == "16" and pieces[1] == "FF7FFFFB":
+            ignore_value = unpack("f", pack("I", 0xFF7FFFFB))[0]
+
+        return ( ignore_value )
+
+    def seekLine(self, img, line):
+        ''' moves the file pointer straight to the start of any image line '''
+        img.seek(self.__label.line_offset(line))
+
+    ############################################################################
+    ## Image operations
+    ############################################################################
+
+    # decorator to run a generator in a thread
+    def threaded_generator(func):
+        def start(*args, **kwargs):
+            # Setup a queue of returned items
+            yield_q = queue.Queue()
+            # Thread to run generator inside of
+            def worker():
+                for obj in func(*args, **kwargs): yield_q.put(obj)
+                yield_q.put(StopIteration)
+
+            t = threading.Thread(target=worker)
+            t.start()
+            # yield from the queue as fast as we can
+            obj = yield_q.get()
+            while obj is not StopIteration:
+                yield obj
+                obj = yield_q.get()
+
+        # return the thread-wrapped generator
+        return start
+
+    def binN(self, image_iter, factor, bin_method_type="SLOW", sample_offset=0):
+        ''' this is an iterator that: Given an image iterator will yield lines binned
+            factor x factor, one binned line for every factor lines of the image
+        '''
+
+        img_props = next(image_iter)
+        # dimensions shrink as we remove pixels
+        processed_dims = img_props.processed_dims()
+        processed_dims = ( processed_dims[0] // factor, processed_dims[1] // factor )
+        img_props.processed_dims(processed_dims)
+        # each pixel is larger as binning gets larger
+        pixel_scale = img_props.pixel_scale()
+        pixel_scale = ( pixel_scale[0] * factor, pixel_scale[1] * factor )
+        img_props.pixel_scale(pixel_scale)
+        if bin_method_type == "FAST":
+            img_props.bin(factor, sample_offset, 0)
+        else:
+            img_props.bin(factor, (factor - 1) / 2.0, (factor - 1) / 2.0)
+        yield img_props
+
+        raw_data = []
+        for line in image_iter:
+            raw_data.append(line)
+            if len(raw_data) == factor:
+                if bin_method_type == "FAST":
+                    yield self.sampleBlock(raw_data, factor, sample_offset)
+                else:
+                    for binned_line in self.binBlock(raw_data, factor):
+                        yield binned_line
+                raw_data = []
+
+    def buildPyramid(self, image_iter, factors):
+        ''' consumes an image iterator once and returns a dtm_pyramid of all factors '''
+        img_props = next(image_iter)
+        pyramid = dtm_pyramid(factors, self.__ignore_value, img_props.processed_dims(), img_props.pixel_scale())
+        for line in image_iter:
+            pyramid.add_line(line)
+        return pyramid
+
+    def getPyramidLevel(self, pyramid, img_props, factor):
+        ''' same protocol as binN, but the lines come from an already built pyramid '''
+        img_props.processed_dims(pyramid.dims(factor))
+        img_props.pixel_scale(pyramid.pixel_scale(factor))
+        img_props.bin(factor, (factor - 1) / 2.0, (factor - 1) / 2.0)
+        yield img_props
+
+        for line in pyramid.level(factor):
+            yield line
+
+    def pyramidKey(self, crop):
+        ''' identifies the file (and crop) a cached pyramid was built from '''
+        stat = os.stat(self.__filepath)
+        return ( os.path.abspath(self.__filepath), stat.st_size, stat.st_mtime, crop )
+
+    def binBlock(self, raw_data, factor):
+        ''' does a factor x factor mean of raw_data (a multiple of factor lines) ignoring
+            self.__ignore_value, and returns one binned line per factor lines
+        '''
+        IGNORE_VALUE = self.__ignore_value
+
+        block = numpy.asarray(raw_data, dtype=numpy.float32)
+        rows = block.shape[0] // factor
+        cols = block.shape[1] // factor
+        # (rows, factor, cols, factor) so every bin is reduced over axes 1 and 3
+        block = block[:rows * factor, :cols * factor].reshape(rows, factor, cols, factor)
+
+        # Filter out those unwanted hugely negative values...
+        valid = block != IGNORE_VALUE
+        count = valid.sum(axis=(1, 3))
+        total = numpy.where(valid, block, 0.0).sum(axis=(1, 3), dtype=numpy.float64)
+
+        # If we have all pesky values, return a pesky value
+        binned = numpy.empty((rows, cols), dtype=numpy.float32)
+        binned.fill(IGNORE_VALUE)
+        numpy.divide(total, count, out=binned, where=count > 0)
+        return binned
+
+    def sampleBlock(self, raw_data, factor, sample_offset=0):
+        ''' takes a single value from each factor x factor sample of raw_data and returns
+            a single line of data
+        '''
+        line = numpy.asarray(raw_data[0])
+        return line[sample_offset::factor][:len(line) // factor]
+
+    def cropBounds(self, dims, XSize=None, YSize=None, XOffset=0, YOffset=0):
+        ''' clamps a crop request to the image dimensions '''
+        if XSize is None:
+            XSize = dims[0]
+        if YSize is None:
+            YSize = dims[1]
+
+        if XSize + XOffset > dims[0]:
+            XSize = dims[0]
+            XOffset = 0
+        if YSize + YOffset > dims[1]:
+            YSize = dims[1]
+            YOffset = 0
+
+        return ( XSize, YSize, XOffset, YOffset )
+
+    def cropXY(self, image_iter, XSize=None, YSize=None, XOffset=0, YOffset=0):
+        ''' return a cropped portion of the image '''
+
+        img_props = next(image_iter)
+        # dimensions shrink as we remove pixels
+        processed_dims = img_props.processed_dims()
+
+        (XSize, YSize, XOffset, YOffset) = self.cropBounds(processed_dims, XSize, YSize, XOffset, YOffset)
+
+        img_props.processed_dims((XSize, YSize))
+        img_props.offset(XOffset, YOffset)
+        yield img_props
+
+        currentY = 0
+        for line in image_iter:
+            if currentY >= YOffset and currentY <= YOffset + YSize:
+                yield line[XOffset:XOffset + XSize]
+            # Not much point in reading the rest of the data...
+            if currentY == YOffset + YSize:
+                return
+            currentY += 1
+
+    def lineWindow(self, dims, lines=None):
+        ''' turns an optional (first_line, line_count) window into a valid range '''
+        if lines is None:
+            return ( 0, dims[1] )
+        first_line = min(max(lines[0], 0), dims[1])
+        return ( first_line, min(first_line + lines[1], dims[1]) )
+
+    def sampleDtype(self):
+        if self.__label is None:
+            # little endian (PC_REAL)
+            return '<f4'
+        return self.__label.dtype()
+
+    def getImage(self, img, img_props, lines=None):
+        ''' Assumes 32-bit pixels -- reads the (first_line, line_count) window of lines,
+            or every line when no window is given
+        '''
+        dims = img_props.dims()
+        (first_line, last_line) = self.lineWindow(dims, lines)
+        if self.__label is not None:
+            self.seekLine(img, first_line)
+
+        # setup to unpack more efficiently.
+        x_len = dims[0]
+        # '<' for little endian (PC_REAL), '>' for big endian (IEEE_REAL)
+        unpack_str = self.sampleDtype()[0]
+        unpack_bytes_str = "<"
+        pack_bytes_str = "="
+        # 32 bits/sample * samples/line = y_bytes (per line)
+        x_bytes = 4 * x_len
+        for x in range(0, x_len):
+            # 32-bit float is "d"
+            unpack_str += "f"
+            unpack_bytes_str += "I"
+            pack_bytes_str += "I"
+
+        # Each iterator yields this first ... it is for reference of the next iterator:
+        img_props.offset(0, first_line)
+        yield img_props
+
+        for y in range(first_line, last_line):
+            # pixels is a byte array
+            pixels = b''
+            while len(pixels) < x_bytes:
+                new_pixels = img.read(x_bytes - len(pixels))
+                pixels += new_pixels
+                if len(new_pixels) == 0:
+                    x_bytes = -1
+                    pixels = []
+            if len(pixels) == x_bytes:
+                if 0 == 1:
+                    repacked_pixels = b''
+                    for integer in unpack(unpack_bytes_str, pixels):
+                        repacked_pixels += pack("=I", integer)
+                    yield unpack(unpack_str, repacked_pixels)
+                else:
+                    yield unpack(unpack_str, pixels)
+
+    def dataOffset(self, img):
+        ''' where the image data starts: from the PDS label, or the current file
+            position when there is no label
+        '''
+        if self.__label is not None:
+            return self.__label.data_offset()
+        return img.tell()
+
+    def availableLines(self, img, img_props):
+        ''' Assumes 32-bit pixels -- the number of complete lines present in the file,
+            a truncated file simply yields fewer lines
+        '''
+        dims = img_props.dims()
+        offset = self.dataOffset(img)
+        img.seek(0, os.SEEK_END)
+        lines = min(dims[1], (img.tell() - offset) // (4 * dims[0]))
+        img.seek(offset)
+        return max(lines, 0)
+
+    def mapImage(self, img, img_props):
+        ''' Assumes 32-bit pixels -- memory maps the image data and returns it as a
+            read-only (lines, samples) float32 array
+        '''
+        dims = img_props.dims()
+        offset = self.dataOffset(img)
+        lines = self.availableLines(img, img_props)
+
+        if lines <= 0:
+            return numpy.empty((0, dims[0]), dtype=self.sampleDtype())
+        return numpy.memmap(img, dtype=self.sampleDtype(), mode='r', offset=offset, shape=(lines, dims[0]))
+
+    def getImageStrided(self, img, img_props, factor, sample_offset=0, crop=None):
+        ''' reader for the FAST bin modes: only the first line of every factor lines is
+            read and only the sampled columns are kept, so a BINn-FAST import touches
+            about 1/n of the file. Yields the same lines as cropXY + binN(..., 'FAST')
+        '''
+        dims = img_props.dims()
+        if crop is None:
+            crop = ( dims[0], dims[1], 0, 0 )
+            lines = ( 0, dims[1] )
+        else:
+            # cropXY keeps the line at YOffset + YSize too, hence the extra line
+            lines = ( crop[3], crop[1] + 1 )
+        (XSize, YSize, XOffset, YOffset) = crop
+
+        # dimensions shrink as we remove pixels
+        img_props.processed_dims(( XSize // factor, YSize // factor ))
+        # each pixel is larger as binning gets larger
+        pixel_scale = img_props.pixel_scale()
+        img_props.pixel_scale(( pixel_scale[0] * factor, pixel_scale[1] * factor ))
+        img_props.offset(XOffset, YOffset)
+        img_props.bin(factor, sample_offset, 0)
+        yield img_props
+
+        # Only complete factor x factor regions are sampled
+        (first_line, last_line) = self.lineWindow(( dims[0], self.availableLines(img, img_props) ), lines)
+        last_line = first_line + (last_line - first_line) // factor * factor
+        first_sample = XOffset + sample_offset
+        last_sample = XOffset + XSize // factor * factor
+
+        if self.reader_mode() == 'MMAP':
+            # a strided view -- only the pages holding the sampled lines are touched
+            image = self.mapImage(img, img_props)
+            for line in image[first_line:last_line:factor, first_sample:last_sample:factor]:
+                yield line
+            return
+
+        dtype = numpy.dtype(self.sampleDtype())
+        for y in range(first_line, last_line, factor):
+            img.seek(self.__label.line_offset(y) + first_sample * dtype.itemsize)
+            pixels = img.read((last_sample - first_sample) * dtype.itemsize)
+            yield numpy.frombuffer(pixels, dtype=dtype)[::factor]
+
+    def getImageMapped(self, img, img_props, lines=None):
+        ''' same protocol as getImage but every line is a numpy view into the memory
+            mapped file -- nothing is copied or unpacked until a later stage needs it
+        '''
+        image = self.mapImage(img, img_props)
+        (first_line, last_line) = self.lineWindow(image.shape[::-1], lines)
+
+        # Each iterator yields this first ... it is for reference of the next iterator:
+        img_props.offset(0, first_line)
+        yield img_props
+
+        for y in range(first_line, last_line):
+            yield image[y]
+
+    def cacheStore(self, image_iter, cache, key, image_min_max):
+        ''' passes the lines through untouched and stores them in the cache once the
+            last one has been read
+        '''
+        img_props = next(image_iter)
+        yield img_props
+
+        lines = []
+        for line in image_iter:
+            lines.append(numpy.array(line, dtype=numpy.float32))
+            yield line
+
+        if lines:
+            lines = numpy.array(lines)
+        else:
+            lines = numpy.empty((0, img_props.processed_dims()[0]), dtype=numpy.float32)
+        cache.store(key, lines, {
+            'dims': img_props.dims(),
+            'processed_dims': img_props.processed_dims(),
+            'pixel_scale': img_props.pixel_scale(),
+            'origin': img_props.origin(),
+            'step': img_props.step(),
+            'valid_min_max': image_min_max,
+            'ignore_value': self.__ignore_value,
+        })
+
+    def getCachedImage(self, lines, meta):
+        ''' same protocol as the readers, for lines that came out of the cache '''
+        self.__ignore_value = meta['ignore_value']
+        img_props = image_properties(os.path.basename(self.__filepath), tuple(meta['dims']), tuple(meta['pixel_scale']))
+        img_props.processed_dims(tuple(meta['processed_dims']))
+        img_props.origin(tuple(meta.get('origin', (0, 0))))
+        img_props.step(tuple(meta.get('step', (1, 1))))
+        yield img_props
+
+        for line in lines:
+            yield line
+
+    def measureTerrain(self, image_iter, image_min_max):
+        ''' passes the (transformed) lines through untouched and gathers their
+            terrain_stats on the way
+        '''
+        img_props = next(image_iter)
+        height_range = ( 0.0, (image_min_max[1] - image_min_max[0]) * self.scale() )
+        self.__terrain_stats = terrain_stats(self.gridScale(img_props), height_range)
+        yield img_props
+
+        for line in image_iter:
+            self.__terrain_stats.add_line(line)
+            yield line
+
+    def transformZ(self, image_iter, image_min_max):
+        ''' takes a generator and, in one pass over each line, replaces points with value
+            self.__ignore_value by NaN, shifts the points by the valid minimum and
+            scales them by self.scale(). Lines come out as float32 numpy arrays
+        '''
+
+        # use the passed in values ...
+        valid_min = image_min_max[0]
+        scale_factor = self.scale()
+
+        # pass on dimensions/pixel_scale since we don't modify them here
+        yield next(image_iter)
+
+        for line in image_iter:
+            # a private float32 copy we can modify in place (lines may be read-only views)
+            line = numpy.array(line, dtype=numpy.float32)
+            line[line == self.__ignore_value] = numpy.nan
+            line -= valid_min
+            if scale_factor != 1.0:
+                line *= scale_factor
+            yield line
+
+    def genGrid(self, image_iter):
+        ''' collects the lines of an image iterator into one (lines, samples) array '''
+        img_props = next(image_iter)
+        lines = list(image_iter)
+        if lines:
+            grid = numpy.array(lines, dtype=numpy.float32)
+        else:
+            grid = numpy.empty((0, img_props.processed_dims()[0]), dtype=numpy.float32)
+        return ( img_props, grid )
+
+    def gridVertices(self, grid, valid, scale_x, scale_y):
+        ''' (x, y, z) of every valid sample, line by line '''
+        (rows, cols) = numpy.nonzero(valid)
+        coords = numpy.empty((len(rows), 3), dtype=numpy.float32)
+        coords[:, 0] = cols * scale_x
+        coords[:, 1] = rows * -scale_y
+        coords[:, 2] = grid[valid]
+        return coords
+
+    def gridIndex(self, valid):
+        ''' maps every sample to the index blender gives its vertex (-1 when invalid) '''
+        # We want to ignore points with a value of NaN but we also need to know the index
+        # of every vertex we do create. Counting the valid points before each point gives
+        # us exactly that. If "x" represents points that are NaN valued then conceptually
+        # this is how we think of point indices:
+        #
+        # previous line: offset0   x   x  +1  +2  +3
+        # current line:  offset1   x  +1  +2  +3   x
+        index = numpy.cumsum(valid.ravel(), dtype=numpy.int64).reshape(valid.shape) - 1
+        index[~valid] = -1
+        return index
+
+    # corners of each cell: previous line x, x + 1 and current line x + 1, x
+    cell_corners = ( (slice(None, -1), slice(None, -1)),
+                     (slice(None, -1), slice(1, None)),
+                     (slice(1, None), slice(1, None)),
+                     (slice(1, None), slice(None, -1)) )
+
+    def gridQuads(self, valid, index):
+        ''' one (v0, v1, v2, v3) face for every cell with four valid corners, ordered
+            like the cells of the image
+        '''
+        corners = self.cell_corners
+        quads = valid[corners[0]] & valid[corners[1]] & valid[corners[2]] & valid[corners[3]]
+        return numpy.column_stack([index[corner][quads] for corner in corners])
+
+    def gridTriangles(self, valid, index):
+        ''' one triangle for every cell with exactly one missing corner, so the ragged
+            edges of a DTM keep the half of the cell that has data. The three corners
+            keep the winding of the quad they come from
+        '''
+        corners = self.cell_corners
+        corner_valid = [valid[corner] for corner in corners]
+        missing = 4 - sum(mask.astype(numpy.int8) for mask in corner_valid)
+
+        triangles = []
+        for dropped in range(0, 4):
+            cells = (missing == 1) & ~corner_valid[dropped]
+            kept = [corner for (i, corner) in enumerate(corners) if i != dropped]
+            triangles.append(numpy.column_stack([index[corner][cells] for corner in kept]))
+        return numpy.concatenate(triangles)
+
+    # Largest RTIN tile, bigger grids are split into tiles sharing their border samples
+    adaptive_tile_size = 1025
+
+    def adaptiveTileSize(self, dims):
+        ''' the smallest 2^k + 1 tile that covers dims, up to adaptive_tile_size '''
+        size = 2
+        while size + 1 < max(dims) and size + 1 < self.adaptive_tile_size:
+            size *= 2
+        return size + 1
+
+    def adaptiveFaces(self, grid, max_error, keep_border=False):
+        ''' triangles of an RTIN mesh over the grid as (n, 3) flat sample indices.
+            Samples on a border shared by two tiles (or on the border of the grid
+            with keep_border) are always kept so the tiles meet without cracks, and
+            triangles touching a missing sample are dropped
+        '''
+        (rows, cols) = grid.shape
+        rtin = rtin_tile(self.adaptiveTileSize(grid.shape))
+        step = rtin.size() - 1
+        faces = []
+        for row in range(0, max(rows - 1, 1), step):
+            for col in range(0, max(cols - 1, 1), step):
+                heights = numpy.full((rtin.size(), rtin.size()), numpy.nan, dtype=numpy.float32)
+                window = grid[row:row + rtin.size(), col:col + rtin.size()]
+                heights[:window.shape[0], :window.shape[1]] = window
+
+                forced = numpy.zeros(heights.shape, dtype=bool)
+                forced[0, :] = keep_border or row > 0
+                forced[-1, :] = keep_border or row + step < rows - 1
+                forced[:, 0] |= keep_border or col > 0
+                forced[:, -1] |= keep_border or col + step < cols - 1
+                if keep_border:
+                    # the border of the grid may end inside a padded tile
+                    forced[min(rows - 1 - row, step), :] = True
+                    forced[:, min(cols - 1 - col, step)] = True
+
+                corners = rtin.triangles(rtin.errors(heights, forced), max_error)
+                corners = corners[~numpy.isnan(heights[corners[..., 0], corners[..., 1]]).any(axis=1)]
+                faces.append((corners[..., 0] + row) * cols + corners[..., 1] + col)
+
+        faces = numpy.concatenate(faces) if faces else numpy.empty((0, 3), dtype=numpy.int64)
+        # Wind every triangle the same way as the grid quads
+        (y, x) = numpy.divmod(faces, cols)
+        area = (x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) - (x[:, 2] - x[:, 0]) * (y[:, 1] - y[:, 0])
+        faces[area < 0] = faces[area < 0][:, ::-1]
+        return faces
+
+    def adaptiveVertices(self, grid, faces, scale_x, scale_y):
+        ''' (x, y, z) of the samples used by faces and the faces re-indexed to them '''
+        (used, faces) = numpy.unique(faces, return_inverse=True)
+        (rows, cols) = numpy.divmod(used, grid.shape[1])
+        coords = numpy.empty((len(used), 3), dtype=numpy.float32)
+        coords[:, 0] = cols * scale_x
+        coords[:, 1] = rows * -scale_y
+        coords[:, 2] = grid.ravel()[used]
+        return ( coords, faces.reshape(-1, 3) )
+
+    def gridGradient(self, grid, axis):
+        ''' change of the height per sample along an axis of the grid: central
+            differences, one-sided next to a missing sample or the border of the
+            grid, and 0 for samples without a valid neighbour
+        '''
+        heights = numpy.swapaxes(grid, 0, axis)
+        previous = numpy.full(heights.shape, numpy.nan, dtype=numpy.float32)
+        following = numpy.full(heights.shape, numpy.nan, dtype=numpy.float32)
+        previous[1:] = heights[:-1]
+        following[:-1] = heights[1:]
+
+        gradient = (following - previous) / 2
+        forward = following - heights
+        backward = heights - previous
+        gradient = numpy.where(numpy.isnan(gradient), forward, gradient)
+        gradient = numpy.where(numpy.isnan(gradient), backward, gradient)
+        gradient[numpy.isnan(gradient)] = 0.0
+        return numpy.swapaxes(gradient, 0, axis)
+
+    def gridNormals(self, grid, scale_x, scale_y):
+        ''' (lines, samples, 3) unit normals (pointing up) of the height field, from
+            the same grid for every tile so shading matches across tile borders
+        '''
+        normals = numpy.empty(grid.shape + (3,), dtype=numpy.float32)
+        # x grows with the sample, y shrinks with the line
+        normals[..., 0] = -self.gridGradient(grid, 1) / scale_x
+        normals[..., 1] = self.gridGradient(grid, 0) / scale_y
+        normals[..., 2] = 1.0
+        normals /= numpy.sqrt((normals ** 2).sum(axis=2))[..., numpy.newaxis]
+        return normals
+
+    def vertexSamples(self, coords, scale_x, scale_y):
+        ''' (rows, cols) of the grid samples the vertices were made from '''
+        cols = numpy.rint(coords[:, 0] / scale_x).astype(numpy.int64)
+        rows = numpy.rint(-coords[:, 1] / scale_y).astype(numpy.int64)
+        return ( rows, cols )
+
+    def vertexNormals(self, normals, coords, scale_x, scale_y):
+        ''' the normals of the samples the vertices were made from '''
+        (rows, cols) = self.vertexSamples(coords, scale_x, scale_y)
+        return normals[rows, cols]
+
+    def vertexUVs(self, img_props, coords, scale_x, scale_y):
+        ''' (n, 2) texture coordinates of the vertices: the center of the source image
+            sample each one came from, so a texture made from the whole .IMG (the GDAL
+            color relief) lines up however the DTM was cropped or binned
+        '''
+        (rows, cols) = self.vertexSamples(coords, scale_x, scale_y)
+        (origin, step, dims) = ( img_props.origin(), img_props.step(), img_props.dims() )
+        uvs = numpy.empty((len(coords), 2), dtype=numpy.float32)
+        uvs[:, 0] = (origin[0] + cols * step[0] + 0.5) / dims[0]
+        # images start at the top, textures at the bottom
+        uvs[:, 1] = 1.0 - (origin[1] + rows * step[1] + 0.5) / dims[1]
+        return uvs
+
+    def meshArrays(self, grid, scale_x, scale_y, keep_border=False):
+        ''' (coords, loops, loop_totals) of the mesh over grid '''
+        if self.mesh_mode() == 'ADAPTIVE':
+            # Heights are already scaled, so is the error we allow
+            faces = self.adaptiveFaces(grid, self.max_error() * self.scale(), keep_border)
+            (coords, faces) = self.adaptiveVertices(grid, faces, scale_x, scale_y)
+            loops = faces.ravel()
+            loop_totals = numpy.full(len(faces), 3, dtype=numpy.int32)
+        else:
+            # Let's interpolate the binned DTM with blender -- yay meshes!
+            valid = ~numpy.isnan(grid)
+            coords = self.gridVertices(grid, valid, scale_x, scale_y)
+            index = self.gridIndex(valid)
+            quads = self.gridQuads(valid, index)
+            # Cells missing a single corner become triangles instead of holes
+            triangles = self.gridTriangles(valid, index)
+
+            loops = numpy.concatenate((quads.ravel(), triangles.ravel()))
+            loop_totals = numpy.concatenate((numpy.full(len(quads), 4, dtype=numpy.int32),
+                                             numpy.full(len(triangles), 3, dtype=numpy.int32)))
+
+        return ( coords, loops, loop_totals )
+
+    def tileOrigins(self, dims, tile_size):
+        ''' (line, sample) of the first sample of every tile. A tile spans
+            tile_size + 1 samples so neighbouring tiles share their border samples
+        '''
+        (rows, cols) = dims
+        return [ (row, col) for row in range(0, max(rows - 1, 1), tile_size)
+                            for col in range(0, max(cols - 1, 1), tile_size) ]
+
+    def tileLodLevels(self, tile_size, lod_levels):
+        ''' the number of levels whose sample spacing divides the tile, so coarser
+            tiles still end on the samples they share with their neighbours
+        '''
+        while lod_levels > 1 and tile_size % 2 ** (lod_levels - 1) != 0:
+            lod_levels -= 1
+        return max(lod_levels, 1)
+
+    def tileArrays(self, grid, scale_x, scale_y, tile_size, lod_levels=1):
+        ''' ((line, sample), level, mesh arrays) of every tile and level of detail,
+            built in a pool of threads (numpy releases the GIL for most of the work).
+            Level n keeps every 2^n-th sample of the tile
+        '''
+        def build(job):
+            ((row, col), level) = job
+            factor = 2 ** level
+            window = grid[row:row + tile_size + 1:factor, col:col + tile_size + 1:factor]
+            (coords, loops, loop_totals) = self.meshArrays(window, scale_x * factor, scale_y * factor,
+                                                           keep_border=True)
+            coords[:, 0] += col * scale_x
+            coords[:, 1] -= row * scale_y
+            return ( coords, loops, loop_totals )
+
+        jobs = [ (origin, level) for origin in self.tileOrigins(grid.shape, tile_size)
+                                 for level in range(0, self.tileLodLevels(tile_size, lod_levels)) ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            return [ job + (arrays,) for (job, arrays) in zip(jobs, pool.map(build, jobs)) ]
+
+    ################################################################################
+    #  Yay, done with helper functions ... let's see the abstraction in action!    #
+    ################################################################################
+    def decodeImage(self, img):
+        ''' reads the label and sets up the stream of (cropped, binned) lines;
+            returns the line iterator and the valid min/max of the image
+        '''
+        (label, parsedLabel) = self.getPDSLabel(img)
+        self.__label = pds_label(parsedLabel)
+
+        image_dims = self.getLinesAndSamples(self.__label)
+        img_min_max_vals = self.getValidMinMax(self.__label)
+        self.__ignore_value = self.getMissingConstant(self.__label)
+
+        # The label tells us where the image starts (^IMAGE), so there is no need
+        # to guess at offsets -- any line can be reached with seekLine
+        self.seekLine(img, 0)
+
+        # HiRISE images (and most others?) have 1m x 1m pixels
+        pixel_scale = (1, 1)
+
+        # The image we are importing
+        image_name = os.path.basename(self.__filepath)
+
+        # Set the properties of the image in a manageable object
+        img_props = image_properties(image_name, image_dims, pixel_scale)
+
+        if self.reader_mode() == 'MMAP':
+            reader = self.getImageMapped
+        else:
+            reader = self.getImage
+
+        # Only read the lines we are going to keep when cropping; cropXY keeps the
+        # line at YOffset + YSize too, hence the extra line
+        lines = None
+        crop = None
+        if self.__cropXY:
+            crop = self.cropBounds(image_dims, *self.__cropXY)
+            lines = (crop[3], crop[1] + 1)
+
+        # Select an appropriate binning mode
+        bin_mode = self.bin_mode()
+        (factor, bin_method_type, sample_offset) = self.bin_modes.get(bin_mode, (1, None, 0))
+
+        if bin_method_type == 'FAST':
+            # The FAST modes keep one sample per region, so only read those samples
+            image_iter = self.getImageStrided(img, img_props, factor, sample_offset, crop)
+        elif bin_method_type is not None and self.use_pyramid():
+            # Every averaged bin mode comes out of one pyramid, built the first time
+            # this file (and crop) is imported
+            key = self.pyramidKey(crop)
+            if key not in dtm_pyramid_cache:
+                image_iter = reader(img, img_props, lines)
+                if crop:
+                    image_iter = self.cropXY(image_iter, XSize=crop[0], YSize=crop[1], XOffset=crop[2], YOffset=0)
+                factors = [f for (f, method_type, offset) in self.bin_modes.values() if method_type == 'SLOW']
+                dtm_pyramid_cache.clear()
+                dtm_pyramid_cache[key] = self.buildPyramid(image_iter, factors)
+            # the pyramid starts where the crop does, whether it was just built or not
+            img_props.origin(( crop[2], crop[3] ) if crop else ( 0, 0 ))
+            image_iter = self.getPyramidLevel(dtm_pyramid_cache[key], img_props, factor)
+        else:
+            # Get an iterator to iterate over lines
+            image_iter = reader(img, img_props, lines)
+
+            ## Wrap the image_iter generator with other generators to modify the dtm on a
+            ## line-by-line basis. This creates a stream of modifications instead of reading
+            ## all of the data at once, processing all of the data (potentially several times)
+            ## and then handing it off to blender
+            ## TODO: find a way to alter projection based on transformations below
+
+            if crop:
+                # the reader already skipped the lines above the crop
+                image_iter = self.cropXY(image_iter,
+                                         XSize=crop[0],
+                                         YSize=crop[1],
+                                         XOffset=crop[2],
+                                         YOffset=0
+                )
+
+            if bin_method_type is not None:
+                image_iter = self.binN(image_iter, factor, bin_method_type, sample_offset)
+
+        return ( image_iter, img_min_max_vals )
+
+    def loadImage(self):
+        ''' the line iterator of the whole import (img_props first): cached lines or
+            the decoded .IMG, with nodata -> NaN, shifted to the valid minimum and
+            scaled. The .IMG is closed once the last line has been read
+        '''
+        img = None
+        cached = None
+        if self.cache() is not None:
+            cache_key = self.cache().key(self.__filepath, self.bin_mode(), self.__cropXY)
+            cached = self.cache().load(cache_key)
+
+        if cached is not None:
+            # Warm cache: the binned lines are already on disk, the .IMG isn't even opened
+            (lines, meta) = cached
+            image_iter = self.getCachedImage(lines, meta)
+            img_min_max_vals = tuple(meta['valid_min_max'])
+        else:
+            img = open(self.__filepath, 'rb')
+            (image_iter, img_min_max_vals) = self.decodeImage(img)
+            if self.cache() is not None:
+                image_iter = self.cacheStore(image_iter, self.cache(), cache_key, img_min_max_vals)
+
+        # nodata -> NaN, shift to the valid minimum and scale, all in one pass
+        image_iter = self.transformZ(image_iter, img_min_max_vals)
+        # bounds and statistics for the later stages, while the lines go by
+        image_iter = self.measureTerrain(image_iter, img_min_max_vals)
+
+        try:
+            for item in image_iter:
+                yield item
+        finally:
+            if img:
+                img.close()
+
+    def loadGrid(self):
+        ''' (img_props, grid) of the whole import, see loadImage '''
+        return self.genGrid(self.loadImage())
+
+    def gridScale(self, img_props):
+        ''' (x, y) distance between two vertices of the grid '''
+        return ( self.scale() * img_props.pixel_scale()[0], self.scale() * img_props.pixel_scale()[1] )
+
+    def exportMesh(self, path=None):
+        ''' decodes the DTM and writes its mesh arrays (the untiled, finest mesh) to
+            path or export_path without going through blender
+        '''
+        if path is None:
+            path = self.export_path()
+        (img_props, grid) = self.loadGrid()
+        (scale_x, scale_y) = self.gridScale(img_props)
+        (coords, loops, loop_totals) = self.meshArrays(grid, scale_x, scale_y)
+        export.write_mesh(path, coords, loops, loop_totals)
+        return path
@@ -0,0 +1,133 @@
+'''The PDS label of a DTM and the properties of the image it describes.'''
+
+class image_properties:
+    ''' keeps track of image attributes throughout the dtm_importer class '''
+
+    def __init__(self, name, dimensions, pixel_scale):
+        self.name(name)
+        self.dims(dimensions)
+        self.processed_dims(dimensions)
+        self.pixel_scale(pixel_scale)
+        self.origin((0, 0))
+        self.step((1, 1))
+
+    def dims(self, dims=None):
+        if dims is not None:
+            self.__dims = dims
+        return self.__dims
+
+    def processed_dims(self, processed_dims=None):
+        if processed_dims is not None:
+            self.__processed_dims = processed_dims
+        return self.__processed_dims
+
+    def name(self, name=None):
+        if name is not None:
+            self.__name = name
+        return self.__name
+
+    def pixel_scale(self, pixel_scale=None):
+        if pixel_scale is not None:
+            self.__pixel_scale = pixel_scale
+        return self.__pixel_scale
+
+    def origin(self, origin=None):
+        ''' (sample, line) of the source image the first processed sample came from '''
+        if origin is not None:
+            self.__origin = origin
+        return self.__origin
+
+    def step(self, step=None):
+        ''' source samples (x, y) between two processed samples '''
+        if step is not None:
+            self.__step = step
+        return self.__step
+
+    def offset(self, x, y):
+        ''' the processed image starts (x, y) processed samples further in '''
+        (origin, step) = ( self.origin(), self.step() )
+        self.origin(( origin[0] + x * step[0], origin[1] + y * step[1] ))
+
+    def bin(self, factor, x, y):
+        ''' factor x factor samples became one, positioned (x, y) source steps into them '''
+        self.offset(x, y)
+        step = self.step()
+        self.step(( step[0] * factor, step[1] * factor ))
+
+
+class pds_label:
+    ''' indexes a parsed PDS label so keywords can be looked up in O(1) and the
+        image data can be located without scanning the file from the top
+    '''
+
+    # SAMPLE_TYPE -> numpy byte order
+    byte_orders = {
+        'PC_REAL': '<',
+        'IEEE_REAL': '>',
+        'MAC_REAL': '>',
+        'SUN_REAL': '>',
+    }
+
+    def __init__(self, parsed_label, object_name="IMAGE"):
+        self.__keys = {}
+        self.__object = {}
+        for key, val in parsed_label:
+            if isinstance(val, list):
+                # only the first object with the name we care about is used (same as before)
+                if key == object_name and not self.__object:
+                    self.__object = dict(item for item in val if not isinstance(item[1], list))
+            elif key not in self.__keys:
+                self.__keys[key] = val
+
+    def get(self, key, default=None):
+        ''' looks up a keyword in the image object first and the label second '''
+        if key in self.__object:
+            return self.__object[key]
+        return self.__keys.get(key, default)
+
+    def dims(self):
+        return ( int(self.get("LINE_SAMPLES")), int(self.get("LINES")) )
+
+    def valid_min_max(self):
+        return ( float(self.get("VALID_MINIMUM")), float(self.get("VALID_MAXIMUM")) )
+
+    def record_bytes(self):
+        return int(self.get("RECORD_BYTES", 0))
+
+    def label_records(self):
+        return int(self.get("LABEL_RECORDS", 0))
+
+    def sample_type(self):
+        return self.get("SAMPLE_TYPE", "PC_REAL")
+
+    def sample_bits(self):
+        return int(self.get("SAMPLE_BITS", 32))
+
+    def dtype(self):
+        ''' numpy dtype string of a sample, i.e. '<f4' for PC_REAL '''
+        if self.sample_bits() != 32:
+            raise ValueError("Only 32-bit samples are supported", self.sample_bits())
+        return self.byte_orders.get(self.sample_type(), '<') + 'f4'
+
+    def line_bytes(self):
+        return self.dims()[0] * self.sample_bits() // 8
+
+    def data_offset(self):
+        ''' byte offset of the first image line, taken from the ^IMAGE pointer
+            which is either a 1-based record number or a 1-based byte count
+        '''
+        pointer = self.get("^IMAGE")
+        if pointer is not None:
+            # ^IMAGE = 2, ^IMAGE = 1234 <BYTES> or ^IMAGE = ("FILE.IMG", 2)
+            pointer = pointer.strip("()").split(",")[-1].strip()
+            if pointer.endswith("<BYTES>"):
+                return int(pointer[:-7]) - 1
+            return (int(pointer) - 1) * self.record_bytes()
+        if self.record_bytes() and self.label_records():
+            return self.label_records() * self.record_bytes()
+        # Old behaviour: assume the label fits in a record one line long
+        return self.line_bytes()
+
+    def line_offset(self, line):
+        ''' byte offset of any line of the image '''
+        return self.data_offset() + line * self.line_bytes()
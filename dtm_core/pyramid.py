@@ -0,0 +1,80 @@
+'''All the averaged bin levels of a DTM, built from one pass over its lines.'''
+
+import numpy
+
+
+class dtm_pyramid:
+    ''' builds every bin level of a DTM in a single streaming pass. Each level is
+        computed from the closest finer level that divides it, weighting the parent
+        bins by their number of valid samples so the result is the same nodata-aware
+        mean binBlock computes from the full resolution lines
+    '''
+
+    def __init__(self, factors, ignore_value, dims, pixel_scale):
+        self.__ignore_value = ignore_value
+        self.__dims = dims
+        self.__pixel_scale = pixel_scale
+        self.__count_type = numpy.min_scalar_type(max(factors) ** 2)
+        self.__children = {1: []}
+        self.__pending = {}
+        self.__lines = {}
+        self.__levels = {}
+        for factor in sorted(set(factors)):
+            parent = max(f for f in self.__children if factor % f == 0)
+            self.__children[parent].append(factor)
+            self.__children[factor] = []
+            self.__pending[factor] = []
+            self.__lines[factor] = []
+
+    def factors(self):
+        return sorted(self.__lines)
+
+    def dims(self, factor=1):
+        return ( self.__dims[0] // factor, self.__dims[1] // factor )
+
+    def pixel_scale(self, factor=1):
+        return ( self.__pixel_scale[0] * factor, self.__pixel_scale[1] * factor )
+
+    def add_line(self, line):
+        ''' feeds one full resolution line into every level '''
+        line = numpy.asarray(line, dtype=numpy.float32)
+        counts = (line != self.__ignore_value).astype(self.__count_type)
+        self.__push(1, line, counts)
+
+    def __push(self, parent, line, counts):
+        for factor in self.__children[parent]:
+            pending = self.__pending[factor]
+            pending.append((line, counts))
+            if len(pending) == factor // parent:
+                (binned, binned_counts) = self.__reduce(pending, factor // parent)
+                self.__pending[factor] = []
+                self.__lines[factor].append(binned)
+                self.__push(factor, binned, binned_counts)
+
+    def __reduce(self, pending, ratio):
+        means = numpy.array([item[0] for item in pending])
+        counts = numpy.array([item[1] for item in pending])
+        cols = means.shape[1] // ratio
+        means = means[:, :cols * ratio].reshape(ratio, cols, ratio)
+        counts = counts[:, :cols * ratio].reshape(ratio, cols, ratio)
+
+        # a parent bin counts as many times as it has valid samples
+        total = numpy.where(counts > 0, means, 0.0).astype(numpy.float64)
+        total = (total * counts).sum(axis=(0, 2))
+        count = counts.sum(axis=(0, 2), dtype=self.__count_type)
+
+        binned = numpy.empty(cols, dtype=numpy.float32)
+        binned.fill(self.__ignore_value)
+        numpy.divide(total, count, out=binned, where=count > 0)
+        return ( binned, count )
+
+    def level(self, factor):
+        ''' the binned (lines, samples) array of one level '''
+        if factor not in self.__levels:
+            lines = self.__lines[factor]
+            if lines:
+                self.__levels[factor] = numpy.array(lines)
+            else:
+                self.__levels[factor] = numpy.empty((0, self.dims(factor)[0]), dtype=numpy.float32)
+            self.__lines[factor] = []
+        return self.__levels[factor]
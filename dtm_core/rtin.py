@@ -0,0 +1,111 @@
+'''Right-triangulated irregular networks, the adaptive mesh of a height grid.'''
+
+import numpy
+
+
+class rtin_tile:
+    ''' a right-triangulated irregular network over a (2^k + 1) x (2^k + 1) tile of
+        heights. Every triangle is split at the midpoint of its hypotenuse, so the
+        whole hierarchy is known from the tile size alone: the error of a vertex is
+        the worst height error, over every sample they cover, of the triangles that
+        would drop it, and keeping every
+        vertex whose error is above the tolerance gives a mesh without cracks
+    '''
+
+    def __init__(self, size):
+        self.__size = size
+        tile = size - 1
+        # the two halves of the tile; (a, b) is the hypotenuse, c the right angle
+        self.__roots = ( numpy.array([[0, 0], [tile, tile]], dtype=numpy.int32),
+                         numpy.array([[tile, tile], [0, 0]], dtype=numpy.int32),
+                         numpy.array([[0, tile], [tile, 0]], dtype=numpy.int32) )
+        # every level of triangles that can still be split, coarsest first
+        self.__levels = []
+        (a, b, c) = self.__roots
+        while abs(int(a[0][0]) - int(c[0][0])) + abs(int(a[0][1]) - int(c[0][1])) > 1:
+            self.__levels.append((a, b, c))
+            (a, b, c) = self.split(a, b, c)
+
+    def size(self):
+        return self.__size
+
+    def split(self, a, b, c):
+        ''' the children of each triangle: (c, a, m) and (b, c, m) '''
+        m = (a + b) // 2
+        return ( numpy.concatenate((c, b)), numpy.concatenate((a, c)), numpy.concatenate((m, m)) )
+
+    def coverage(self, ab, ac):
+        ''' the samples (offsets from a) covered by the triangle with corners a, a + ab
+            and a + ac, and their (a, b, c) barycentric weights
+        '''
+        low = numpy.minimum(numpy.minimum(ab, ac), 0)
+        high = numpy.maximum(numpy.maximum(ab, ac), 0)
+        offsets = numpy.indices(high - low + 1).reshape(2, -1).T + low
+        det = float(ab[0] * ac[1] - ab[1] * ac[0])
+        wb = (offsets[:, 0] * ac[1] - offsets[:, 1] * ac[0]) / det
+        wc = (ab[0] * offsets[:, 1] - ab[1] * offsets[:, 0]) / det
+        weights = numpy.column_stack((1.0 - wb - wc, wb, wc))
+        inside = (weights >= -1e-9).all(axis=1)
+        return ( offsets[inside], weights[inside] )
+
+    def coverage_errors(self, heights, a, b, c, chunk=1 << 20):
+        ''' the largest difference, over every sample each triangle covers, between the
+            height and the plane through the corners. Inf where one is missing
+        '''
+        error = numpy.zeros(len(a), dtype=numpy.float32)
+        corner_heights = numpy.column_stack([heights[corner[:, 0], corner[:, 1]] for corner in (a, b, c)])
+        # triangles of the same depth only come in a few orientations, each covering the same samples
+        shapes = numpy.concatenate((b - a, c - a), axis=1).astype(numpy.int64)
+        span = 2 * self.__size + 1
+        keys = (((shapes[:, 0] + self.__size) * span + shapes[:, 1] + self.__size) * span +
+                shapes[:, 2] + self.__size) * span + shapes[:, 3] + self.__size
+        (first_triangles, groups) = numpy.unique(keys, return_index=True, return_inverse=True)[1:]
+        for (index, first_triangle) in enumerate(first_triangles):
+            shape = shapes[first_triangle]
+            group = numpy.flatnonzero(groups == index)
+            (offsets, weights) = self.coverage(shape[:2], shape[2:])
+            count = max(chunk // len(offsets), 1)
+            for first in range(0, len(group), count):
+                triangles = group[first:first + count]
+                points = a[triangles, numpy.newaxis, :] + offsets[numpy.newaxis]
+                plane = corner_heights[triangles].dot(weights.T)
+                difference = numpy.abs(plane - heights[points[..., 0], points[..., 1]])
+                difference[numpy.isnan(difference)] = numpy.inf
+                error[triangles] = difference.max(axis=1)
+        return error
+
+    def errors(self, heights, forced=None):
+        ''' the height error of every vertex, including the errors of the vertices it
+            depends on. Missing heights (NaN) and forced vertices never get dropped
+        '''
+        errors = numpy.zeros(heights.shape, dtype=numpy.float32)
+        errors[numpy.isnan(heights)] = numpy.inf
+        if forced is not None:
+            errors[forced] = numpy.inf
+        for depth in reversed(range(len(self.__levels))):
+            (a, b, c) = self.__levels[depth]
+            m = (a + b) // 2
+            # the whole triangle has to be within the error, not only its hypotenuse
+            error = self.coverage_errors(heights, a, b, c)
+            if depth < len(self.__levels) - 1:
+                # a vertex must be kept whenever one of its children is
+                left = (a + c) // 2
+                right = (b + c) // 2
+                error = numpy.maximum(error, errors[left[:, 0], left[:, 1]])
+                error = numpy.maximum(error, errors[right[:, 0], right[:, 1]])
+            numpy.maximum.at(errors, (m[:, 0], m[:, 1]), error)
+        return errors
+
+    def triangles(self, errors, max_error):
+        ''' (n, 3, 2) (line, sample) corners of the triangles that keep the error
+            under max_error
+        '''
+        kept = []
+        (a, b, c) = self.__roots
+        for depth in range(len(self.__levels)):
+            m = (a + b) // 2
+            split = errors[m[:, 0], m[:, 1]] > max_error
+            kept.append(numpy.stack((a[~split], b[~split], c[~split]), axis=1))
+            (a, b, c) = self.split(a[split], b[split], c[split])
+        kept.append(numpy.stack((a, b, c), axis=1))
+        return numpy.concatenate(kept)
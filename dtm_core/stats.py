@@ -0,0 +1,111 @@
+'''Bounds and statistics of a DTM, gathered while its lines stream through the
+   importer so later stages never have to walk the vertices of the mesh.'''
+
+import numpy
+from . import geometry
+
+
+class terrain_stats:
+    ''' accumulates, one line at a time, what the scene and flyover stages ask of the
+        terrain: the height range, the first/last valid sample of every line (from
+        which the extreme points come), the valid bounds, a height histogram and the
+        centroid. Lines hold heights after transformZ (NaN where there is no data)
+    '''
+
+    def __init__(self, scale, height_range, bins=64):
+        self.__scale = scale
+        low = float(height_range[0])
+        high = float(max(height_range[1], height_range[0]))
+        if high <= low:
+            high = low + 1.0
+        self.__range = ( low, high )
+        self.__histogram = numpy.zeros(bins, dtype=numpy.int64)
+        self.__line = 0
+        self.__count = 0
+        self.__sums = numpy.zeros(3, dtype=numpy.float64)
+        self.__z_range = ( numpy.inf, -numpy.inf )
+        # per line: the first and last valid column and their heights
+        self.__ends = []
+
+    def add_line(self, line):
+        line = numpy.asarray(line, dtype=numpy.float32)
+        cols = numpy.flatnonzero(~numpy.isnan(line))
+        row = self.__line
+        self.__line += 1
+        if len(cols) == 0:
+            return
+
+        heights = line[cols]
+        self.__count += len(cols)
+        self.__sums += ( cols.sum(dtype=numpy.float64), float(row) * len(cols), heights.sum(dtype=numpy.float64) )
+        self.__z_range = ( min(self.__z_range[0], float(heights.min())), max(self.__z_range[1], float(heights.max())) )
+        self.__ends.append(( row, cols[0], line[cols[0]], cols[-1], line[cols[-1]] ))
+
+        bins = len(self.__histogram)
+        (low, high) = self.__range
+        index = ((heights - low) * (bins / (high - low))).astype(numpy.int64)
+        self.__histogram += numpy.bincount(numpy.clip(index, 0, bins - 1), minlength=bins)
+
+    def count(self):
+        return self.__count
+
+    def point(self, row, col, z):
+        ''' the (x, y, z) of the vertex made from a sample '''
+        return ( float(numpy.float32(col * self.__scale[0])), float(numpy.float32(row * -self.__scale[1])), float(z) )
+
+    def extremes(self):
+        ''' the vertices with the largest and smallest x and y, and the highest, in the
+            order blender numbers the vertices of the grid mesh
+        '''
+        if not self.__ends:
+            return []
+        ends = numpy.array(self.__ends, dtype=numpy.float64)
+        (rows, first_cols, last_cols) = ( ends[:, 0], ends[:, 1], ends[:, 3] )
+        # x max: last line reaching the largest column, x min: first line reaching the smallest
+        x_max = numpy.flatnonzero(last_cols == last_cols.max())[-1]
+        x_min = numpy.flatnonzero(first_cols == first_cols.min())[0]
+        points = [
+            ( rows[x_min], first_cols[x_min], ends[x_min, 2] ),
+            ( rows[0], first_cols[0], ends[0, 2] ),
+            ( rows[0], last_cols[0], ends[0, 4] ),
+            ( rows[-1], first_cols[-1], ends[-1, 2] ),
+            ( rows[x_max], last_cols[x_max], ends[x_max, 4] ),
+        ]
+        points.sort(key=lambda point: (point[0], point[1]))
+        return [self.point(*point) for point in points]
+
+    def boundaries(self):
+        ''' the list FlyoverDriver.get_dem_boundaries returns, without the vertices '''
+        boundaries = geometry.dem_boundaries(self.extremes())
+        if self.__count and self.__z_range[1] > boundaries[4]:
+            boundaries[4] = self.__z_range[1]
+        return boundaries
+
+    def as_dict(self):
+        ''' plain lists and numbers, ready to be stored as a custom property '''
+        if not self.__count:
+            return { 'count': 0 }
+        ends = numpy.array(self.__ends, dtype=numpy.float64)
+        (first_row, last_row) = ( ends[0, 0], ends[-1, 0] )
+        (first_col, last_col) = ( ends[:, 1].min(), ends[:, 3].max() )
+        low = self.point(last_row, first_col, self.__z_range[0])
+        high = self.point(first_row, last_col, self.__z_range[1])
+        centroid = self.__sums / self.__count
+        boundaries = self.boundaries()
+        return {
+            'count': self.__count,
+            'spacing': list(self.__scale),
+            'min': list(low),
+            'max': list(high),
+            'valid_bounds': [int(first_row), int(last_row), int(first_col), int(last_col)],
+            'boundaries': [value for point in boundaries[:4] for value in point] + [boundaries[4]],
+            'centroid': list(self.point(centroid[1], centroid[0], centroid[2])),
+            'histogram': self.__histogram.tolist(),
+            'histogram_range': list(self.__range),
+        }
+
+
+def boundaries(stats):
+    ''' the get_dem_boundaries list back from the 'boundaries' of as_dict '''
+    values = [float(value) for value in stats['boundaries']]
+    return [tuple(values[0:3]), tuple(values[3:6]), tuple(values[6:9]), tuple(values[9:12]), values[12]]
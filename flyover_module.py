@@ -1,17 +1,53 @@
 import bpy
-import math
-from bpy.props import *
+import hashlib
+import mathutils
+import numpy
 import os
+from .dtm_core import export
+from .dtm_core import geometry
+from .dtm_core import stats
+from .dtm_core import heightfield
+from . import registry_module
 
 
 class FlyoverDriver(object):
+    #The function making the flyover of each pattern of the UI.
+    pattern_functions = {'NoFlyover': 'no_flyover', 'CirclePattern': 'circle_pattern',
+                         'DiamondPattern': 'diamond_pattern', 'LinearPattern': 'linear_pattern'}
+    #Height field of the DEM and a digest of the meshes it was built from, it is only built again...
+    #...once the DTM changes, every flyover (i.e. of a batch) of the same DTM shares it.
+    height_field = (None, None)
+    #The scene the flyover is made in while a batch makes one in each of its scenes, None for the...
+    #...current scene.
+    scene = None
+    #Render settings the new scenes of a batch take from the scene of the DTM.
+    render_settings = ('engine', 'use_raytrace', 'resolution_x', 'resolution_y', 'resolution_percentage',
+                       'pixel_aspect_x', 'pixel_aspect_y')
+
     #Class constructor.
-    def __init__(self, scale):
+    def __init__(self, scale, follow_terrain=False, path_spacing=10.0, clearance=2.5, smoothing=200.0,
+                 verify_path=False, auto_raise=False, bake_motion=False, cull_tiles=False):
         #Changed this module to be modular.
         #Meaning we can call all the functions here without having to worry about class initialization.
         #Can be useful for users who don't want to run the entire plug-in again to get different fly paths.
         #Can also be useful for other meshes to create flyovers.
         self.scale = scale
+        #Terrain following: the paths get a point every path_spacing meters, each at least...
+        #...clearance (in scene units, like check_height) over the terrain, smoothed over smoothing meters.
+        self.follow_terrain = follow_terrain
+        self.path_spacing = path_spacing
+        self.clearance = clearance
+        self.smoothing = smoothing
+        #Check every frame for the camera going under clearance or losing sight of its target,...
+        #...and raise the path where it does.
+        self.verify_path = verify_path
+        self.auto_raise = auto_raise
+        #Bake the camera and target motion to keyframes instead of following the path live.
+        self.bake_motion = bake_motion
+        #Hide the tiles of a tiled DTM while (or as long as) they are out of the camera's view.
+        self.cull_tiles = cull_tiles
+        #Where the camera of every flyover of a batch is, None outside of a batch.
+        self.sights = None
         return
 
     #No flyover itself. Calls helper functions to create a focus in...
@@ -30,10 +66,7 @@ class FlyoverDriver(object):
         #Create both the target and camera, wit1h the camera looking at the target.
         FlyoverDriver.make_camera_and_target(camera_point, camera_target)
         #Selecting our camera.
-        camera = None
-        for item in bpy.data.objects:
-            if item.type == 'CAMERA':
-                camera = item
+        camera = FlyoverDriver.get_object('camera', 'CAMERA')
         #Simple error checking to ensure a camera is selected.
         if camera is None:
             print("Problem with selecting the camera in no_flyover.")
@@ -53,21 +86,83 @@ class FlyoverDriver(object):
     #Liner pattern wrapper function.
     def linear_pattern(self):
         bool = FlyoverDriver.linear_pattern_main(self)
-        FlyoverDriver.set_environment()
+        self.finish_flyover()
         return bool
 
     #Circle pattern wrapper function.
     def circle_pattern(self):
         bool = FlyoverDriver.circle_pattern_main(self)
-        FlyoverDriver.set_environment()
+        self.finish_flyover()
         return bool
 
     #Diamon pattern wrapper function.
     def diamond_pattern(self):
         bool = FlyoverDriver.diamond_pattern_main(self)
-        FlyoverDriver.set_environment()
+        self.finish_flyover()
         return bool
 
+    #Everything that follows the making of the path: frames and output, the checks of the path,...
+    #...the levels of detail and, last, baking the motion (it takes the camera off the path).
+    def finish_flyover(self):
+        FlyoverDriver.set_environment()
+        if self.verify_path or self.auto_raise:
+            self.check_trajectory(self.auto_raise)
+        if self.sights is None:
+            FlyoverDriver.set_level_of_detail(self.cull_tiles)
+        else:
+            #The tiles are shared by every flyover of a batch, their visibility is keyed once for all.
+            self.sights.append(FlyoverDriver.camera_sight())
+        if self.bake_motion:
+            FlyoverDriver.bake_trajectory()
+
+    #Makes a flyover of every pattern from one imported DTM. The first one is made in the current...
+    #...scene, every other one in a new scene linking the objects of the current one, so the DTM...
+    #...objects and meshes are shared instead of copied and the DEM is only read once, for...
+    #...the height field all of them use. The flyovers are made in their scene without making it...
+    #...the scene of the window, which works without one (blender -b) too. Returns the scenes,...
+    #...in the order of the patterns.
+    def batch_flyover(self, patterns):
+        patterns = [pattern for pattern in patterns if pattern in FlyoverDriver.pattern_functions]
+        if not patterns:
+            print("No flyover pattern to make in batch flyover.")
+            return []
+        base = FlyoverDriver.get_scene()
+        #Make the scenes before any flyover, so they only link the DTM and its lights.
+        scenes = [base]
+        for pattern in patterns[1:]:
+            scenes.append(FlyoverDriver.link_scene(base, base.name + " - " + pattern))
+        previous = FlyoverDriver.scene
+        self.sights = []
+        try:
+            for pattern, scene in zip(patterns, scenes):
+                FlyoverDriver.scene = scene
+                print("Making the " + pattern + " flyover in scene " + scene.name)
+                getattr(self, FlyoverDriver.pattern_functions[pattern])()
+                if scene != base:
+                    #Each scene writes its own video.
+                    scene.render.filepath = os.path.join(os.getcwd(), pattern + "_")
+            FlyoverDriver.scene = base
+            FlyoverDriver.set_level_of_detail(self.cull_tiles, self.sights)
+        finally:
+            FlyoverDriver.scene = previous
+            self.sights = None
+        return scenes
+
+    #A new scene with the objects of base linked (not copied) in it, in the same roles, and its world,...
+    #...layers and render settings. Made with bpy.data: the scene.new operator makes the new scene the...
+    #...one of the window only once it returns, and there is no window with blender -b.
+    @staticmethod
+    def link_scene(base, name):
+        scene = bpy.data.scenes.new(name)
+        for item in base.objects:
+            scene.objects.link(item)
+        scene.world = base.world
+        scene.layers = base.layers
+        for setting in FlyoverDriver.render_settings:
+            setattr(scene.render, setting, getattr(base.render, setting))
+        registry_module.registry.link_scene(base, scene)
+        return scene
+
     #############################################################
     ###########Main Flyover Functions############################
     #############################################################
@@ -76,13 +171,12 @@ class FlyoverDriver(object):
     def linear_pattern_main(self):
         list_holder = FlyoverDriver.get_liner_path()
         list_holder = FlyoverDriver.check_height(list_holder)
+        if self.follow_terrain:
+            list_holder = self.terrain_path(list_holder)
         FlyoverDriver.make_path("Curve", "Linear", list_holder)
         FlyoverDriver.make_camera(list_holder[0])
         #Select the camera for additional setting adjustments.
-        camera = None
-        for item in bpy.data.objects:
-            if item.type == 'CAMERA':
-                camera = item
+        camera = FlyoverDriver.get_object('camera', 'CAMERA')
         #Simple error checking to ensure a camera is selected.
         if camera is None:
             print("Problem with selecting the camera in linea pattern main.")
@@ -96,21 +190,30 @@ class FlyoverDriver(object):
         #Get the boundaries and midpoint of the mesh.
         boundaries_list = FlyoverDriver.get_dem_boundaries()
         midpoint_mesh = FlyoverDriver.get_center(boundaries_list)
-        #Create the circle around the mesh.
-        bpy.ops.curve.primitive_bezier_circle_add()
-        circle = bpy.data.objects['BezierCircle']
-        circle.location = (midpoint_mesh[0], midpoint_mesh[1], midpoint_mesh[2]+25)
         radius = FlyoverDriver.distance_two_points(boundaries_list[0], boundaries_list[1]) + 15
-        circle.scale = (radius, radius, 1.0)
+        if self.follow_terrain:
+            #A closed poly path around the mesh, starting under the camera and kept clear of the terrain.
+            count = max(int(numpy.ceil(2 * numpy.pi * radius / (self.path_spacing * self.scale))), 8)
+            angles = numpy.linspace(-numpy.pi / 2, 3 * numpy.pi / 2, count + 1)
+            circle_points = numpy.column_stack((midpoint_mesh[0] + radius * numpy.cos(angles),
+                                                midpoint_mesh[1] + radius * numpy.sin(angles),
+                                                numpy.full(count + 1, midpoint_mesh[2] + 25)))
+            circle_points = self.terrain_path(circle_points, cyclic=True)
+            FlyoverDriver.make_path("Curve", "Circle", circle_points, cyclic=True)
+        else:
+            #Create the circle around the mesh.
+            bpy.ops.curve.primitive_bezier_circle_add(FlyoverDriver.context_override())
+            circle = FlyoverDriver.register_object('curve', FlyoverDriver.get_scene().objects.active)
+            circle.location = (midpoint_mesh[0], midpoint_mesh[1], midpoint_mesh[2]+25)
+            circle.scale = (radius, radius, 1.0)
         #Define where the camera will be placed. Should be right on the circle.
         camera_point = (midpoint_mesh[0], midpoint_mesh[1] - radius, midpoint_mesh[2]+25)
+        if self.follow_terrain:
+            camera_point = tuple(circle_points[0])
         #Creat the camera.
         FlyoverDriver.make_camera_and_target(camera_point, midpoint_mesh)
         #Select the camera for additional setting adjustments.
-        camera = None
-        for item in bpy.data.objects:
-            if item.type == 'CAMERA':
-                camera = item
+        camera = FlyoverDriver.get_object('camera', 'CAMERA')
         #Simple error checking to ensure a camera is selected.
         if camera is None:
             print("Problem with selecting the camera in circle pattern main.")
@@ -145,14 +248,13 @@ class FlyoverDriver(object):
         point_list = [side_two_midpoint, side_three_midpoint, side_four_midpoint, side_one_midpoint, side_two_midpoint]
         #Make it so our points are above the mesh.
         point_list = FlyoverDriver.check_height(point_list)
+        if self.follow_terrain:
+            point_list = self.terrain_path(point_list)
         #Create both the path and the camera.
         FlyoverDriver.make_path("Curve", "Diamond", point_list)
         FlyoverDriver.make_camera(side_two_midpoint)
         #Select the camera for additional setting adjustments.
-        camera = None
-        for item in bpy.data.objects:
-            if item.type == 'CAMERA':
-                camera = item
+        camera = FlyoverDriver.get_object('camera', 'CAMERA')
         #Simple error checking to ensure a camera is selected.
         if camera is None:
             print("Problem with selecting the camera in diamond pattern main.")
@@ -163,36 +265,19 @@ class FlyoverDriver(object):
     #############################################################
     ###########Check Height Helper Function######################
     #############################################################
-    #Function to take an input of points and make them exactly 2.5 units higher then the closest vertex in the mesh.
+    #Function to take an input of points and make them exactly 2.5 units higher then the terrain under them.
     @staticmethod
     def check_height(input_list):
-        #Prep list of vertices in which are the closest points in the mesh from our input..
-        prep_list = []
-        #Set the same number of vertices as our input list.
-        for item in input_list:
-            prep_list.append((item[0], item[1], item[2]))
-        #Holder list to check the overall distance of a vertex in the mesh from the input lists vertex.
-        holder_list = []
-        #Setting up our holder list to start comparing distances to the appropriate index.
-        for item in input_list:
-            holder_list.append(100)
-        #Run through each object to find the MESH.
-        for item in bpy.data.objects:
-            if item.type == 'MESH':
-                #Run through each vertex to get our data.
-                for vertex in item.data.vertices:
-                    #Check each vertex in our input list against each vertex in the mesh.
-                    for input_index, input_vertex in enumerate(input_list):
-                        #New point to input into our distance calculation.
-                        vertex_point = (vertex.co.x, vertex.co.y, vertex.co.z)
-                        #Calculating the distance between our input list point and the mesh vertex point.
-                        #Optimize later if able to.
-                        distance = FlyoverDriver.distance_two_points(input_vertex, vertex_point)
-                        #Compare our distance and the holders value.
-                        if distance < holder_list[input_index]:
-                            #If the new distance is closer then we can update our temp variables.
-                            holder_list[input_index] = distance
-                            prep_list[input_index] = (vertex.co.x, vertex.co.y, vertex.co.z)
+        points = numpy.array([item[:3] for item in input_list], dtype=numpy.float64).reshape(-1, 3)
+        #The terrain height under every point of our input list, all at once.
+        heights = FlyoverDriver.get_height_field().heights(points[:, 0], points[:, 1])
+        prep_list = [(point[0], point[1], height) for (point, height) in zip(points.tolist(), heights.tolist())]
+        #Off the terrain, the closest vertex in the mesh (or the point itself) like before.
+        missing = numpy.flatnonzero(numpy.isnan(heights))
+        if len(missing):
+            coords = FlyoverDriver.get_dem_coords()
+            for (index, item) in zip(missing, geometry.closest_points(coords, points[missing].tolist())):
+                prep_list[index] = item
         #Setting up our return list.
         return_list = []
         #Get the values from our prep list and place them into our final return list.
@@ -209,24 +294,25 @@ class FlyoverDriver(object):
     @staticmethod
     def make_camera_and_target(point, target_point):
         #Creat both the camera and target.
-        bpy.ops.object.camera_add(view_align=False, enter_editmode=False, location=point)
-        bpy.ops.object.add(type='EMPTY')
+        scene = FlyoverDriver.get_scene()
+        bpy.ops.object.camera_add(FlyoverDriver.context_override(), view_align=False, enter_editmode=False,
+                                  location=point)
+        #The scene renders through it (blender -b has no view to make it the scene's camera).
+        scene.camera = FlyoverDriver.register_object('camera', scene.objects.active)
+        bpy.ops.object.add(FlyoverDriver.context_override(), type='EMPTY')
+        FlyoverDriver.register_object('camera_target', scene.objects.active)
         #Place the empty object variable as camera_target.
-        camera_target = None
-        for item in bpy.data.objects:
-            if item.type == 'EMPTY':
-                camera_target = item
+        camera_target = FlyoverDriver.get_object('camera_target', 'EMPTY')
         #Place the camera object variable as camera
-        camera = None
-        for item in bpy.data.objects:
-            if item.type == 'CAMERA':
-                camera = item
+        camera = FlyoverDriver.get_object('camera', 'CAMERA')
         #Simple error checking to ensure a camera and target are selected.
         if camera_target is None or camera is None:
             print("Problem selecting camera and target in make_camera_and_target.")
             return
         #Setting up the camera targets name and location.
         camera_target.name = 'CameraTarget'
+        #The registry knows objects by name (blender may have added a .001 to it).
+        FlyoverDriver.register_object('camera_target', camera_target)
         camera_target.location = target_point
         #Setting up the constraint on the camera.
         camera.select = True
@@ -243,17 +329,15 @@ class FlyoverDriver(object):
     @staticmethod
     def make_camera(point):
         #Creat both the camera and target.
-        bpy.ops.object.camera_add(view_align=False, enter_editmode=False, location=point)
-        #Place the empty object variable as camera_target.
-        camera_target = None
-        for item in bpy.data.objects:
-            if item.type == 'CURVE':
-                camera_target = item
+        scene = FlyoverDriver.get_scene()
+        bpy.ops.object.camera_add(FlyoverDriver.context_override(), view_align=False, enter_editmode=False,
+                                  location=point)
+        #The scene renders through it (blender -b has no view to make it the scene's camera).
+        scene.camera = FlyoverDriver.register_object('camera', scene.objects.active)
+        #Place the curve object variable as camera_target.
+        camera_target = FlyoverDriver.get_object('curve', 'CURVE')
         #Place the camera object variable as camera
-        camera = None
-        for item in bpy.data.objects:
-            if item.type == 'CAMERA':
-                camera = item
+        camera = FlyoverDriver.get_object('camera', 'CAMERA')
         #Simple error checking to ensure a camera and curve are selected.
         if camera is None or camera_target is None:
             print("Problem selecting a camera and curve in make_camera.")
@@ -274,15 +358,9 @@ class FlyoverDriver(object):
         #Deselect all other objects.
         FlyoverDriver.deselect_objects()
         #Select camera.
-        camera = None
-        for item in bpy.data.objects:
-            if item.type == 'CAMERA':
-                camera = item
+        camera = FlyoverDriver.get_object('camera', 'CAMERA')
         #Select the curve.
-        curve = None
-        for item in bpy.data.objects:
-            if item.type == 'CURVE':
-                curve = item
+        curve = FlyoverDriver.get_object('curve', 'CURVE')
         #Simple error checking to see if either camera or curve is still none.
         if camera is None or curve is None:
             print("No path or camera to attach to one another in attach_camera_to_path.")
@@ -290,8 +368,8 @@ class FlyoverDriver(object):
         camera.select = True
         curve.select = True
         #Set the camera to follow the curve.
-        bpy.context.scene.objects.active = curve
-        bpy.ops.object.parent_set(type='FOLLOW')
+        FlyoverDriver.get_scene().objects.active = curve
+        bpy.ops.object.parent_set(FlyoverDriver.parent_override(camera, curve), type='FOLLOW')
         return
 
     #Add a target to the path.
@@ -300,15 +378,9 @@ class FlyoverDriver(object):
         #Deselect all other objects.
         FlyoverDriver.deselect_objects()
         #Select the target.
-        camera_target = None
-        for item in bpy.data.objects:
-            if item.type == 'EMPTY':
-                camera_target = item
+        camera_target = FlyoverDriver.get_object('camera_target', 'EMPTY')
         #Select the curve.
-        curve = None
-        for item in bpy.data.objects:
-            if item.type == 'CURVE':
-                curve = item
+        curve = FlyoverDriver.get_object('curve', 'CURVE')
         #Simple error checking to see if we have selected a target and curve.
         if camera_target is None or curve is None:
             print("No path or target to attach to one another in add_target_to_path.")
@@ -316,132 +388,522 @@ class FlyoverDriver(object):
         camera_target.select = True
         curve.select = True
         #Set the target to follow the path.
-        bpy.ops.object.parent_set(type='FOLLOW')
+        FlyoverDriver.get_scene().objects.active = curve
+        bpy.ops.object.parent_set(FlyoverDriver.parent_override(camera_target, curve), type='FOLLOW')
         return
 
     #Deselection of objects.
     @staticmethod
     def deselect_objects():
-        #Look through all objects and make sure they are deselected.
-        for item in bpy.data.objects:
+        for item in FlyoverDriver.get_scene().objects:
             item.select = False
         return
 
+    #The scene the flyover is made in: the one of the batch if any, the current one otherwise.
+    @staticmethod
+    def get_scene():
+        if FlyoverDriver.scene is not None:
+            return FlyoverDriver.scene
+        return bpy.context.scene
+
+    #A context for the operators making the flyover, so they work in get_scene() whether or not it...
+    #...is the scene of the window (and when there is no window, with blender -b).
+    @staticmethod
+    def context_override():
+        override = bpy.context.copy()
+        override['scene'] = FlyoverDriver.get_scene()
+        return override
+
+    #The context for parent_set making child follow the path of curve.
+    @staticmethod
+    def parent_override(child, curve):
+        override = FlyoverDriver.context_override()
+        override['object'] = override['active_object'] = curve
+        override['selected_objects'] = override['selected_editable_objects'] = [child, curve]
+        return override
+
+    #The object of role ('camera', 'camera_target', 'curve', 'dtm'...) in the current scene: the one...
+    #...registered for it or, in scenes the add-on didn't make, the last object of the type in the...
+    #...scene, which is registered from then on.
+    @staticmethod
+    def get_object(role, object_type):
+        scene = FlyoverDriver.get_scene()
+        item = registry_module.registry.get(scene, role)
+        if item is not None:
+            return item
+        for candidate in scene.objects:
+            #A tiled DTM is an empty too, skip it (it has the tiles as children).
+            if candidate.type == object_type and not (object_type == 'EMPTY' and candidate.children):
+                item = candidate
+        if item is not None:
+            registry_module.registry.register(scene, role, item)
+        return item
+
+    #Registers item as the object of role in the current scene and returns it.
+    @staticmethod
+    def register_object(role, item):
+        return registry_module.registry.register(FlyoverDriver.get_scene(), role, item)
+
     #############################################################
     ###########Make Path Helper Function#########################
     #############################################################
-    #Creates a poly path out of N points.
+    #Creates a poly path out of N points (the last one joins the first on a cyclic path).
     @staticmethod
-    def make_path(object_name, curve_name, points):
+    def make_path(object_name, curve_name, points, cyclic=False):
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+        if cyclic:
+            points = points[:-1]
         #Sets up or curve and object to be added to the scene.
         curve_data = bpy.data.curves.new(name=curve_name, type='CURVE')
         curve_data.dimensions = '3D'
         object_data = bpy.data.objects.new(object_name, curve_data)
+        FlyoverDriver.register_object('curve', object_data)
         #Starting point of our curve. The first point in our input list.
-        object_data.location = points[0]
-        bpy.context.scene.objects.link(object_data)
+        object_data.location = tuple(points[0])
+        FlyoverDriver.get_scene().objects.link(object_data)
         #Type of curve, POLY, and the number of points to be added.
         polyline = curve_data.splines.new('POLY')
         polyline.points.add(len(points)-1)
-        #Need a holder for our origin.
-        o_x, o_y, o_z = (0, 0, 0)
-        for index in range(len(points)):
-            if index == 0:
-                #First iteration gives or holder the value of the curve origin.
-                o_x, o_y, o_z = points[index]
-            else:
-                #Because the origin of the curve is different from (0, 0, 0),
-                #we need to change the following points relative to our curve origin.
-                #As if our curve origin is (0, 0, 0).
-                x, y, z = points[index]
-                polyline.points[index].co = ((x - o_x), (y - o_y), (z - o_z), 1)
+        polyline.use_cyclic_u = cyclic
+        #Because the origin of the curve is different from (0, 0, 0),
+        #we need to change the points relative to our curve origin.
+        #As if our curve origin is (0, 0, 0). All of them at once, with a weight of 1.
+        co = numpy.ones((len(points), 4), dtype=numpy.float32)
+        co[:, :3] = points - points[0]
+        polyline.points.foreach_set('co', co.ravel())
 
         return object_data
 
+    #Resamples a path every path_spacing meters and raises it to at least clearance over...
+    #...the terrain, all points queried at once. Closed paths end on their first point.
+    def terrain_path(self, points, cyclic=False):
+        spacing = self.path_spacing * self.scale
+        path = geometry.resample_path(points, spacing)
+        if cyclic:
+            path = path[:-1]
+        terrain = FlyoverDriver.get_height_field().heights(path[:, 0], path[:, 1])
+        window = max(int(round(self.smoothing / self.path_spacing)), 1)
+        path = geometry.clear_terrain(path, terrain, self.clearance, window, cyclic)
+        if cyclic:
+            path = numpy.concatenate((path, path[:1]))
+        return path
+
+    #############################################################
+    ###########Trajectory Helper Functions#######################
+    #############################################################
+    #Where the camera is and where it looks on every frame, all frames at once. The camera and its...
+    #...target ride the curve at constant speed and turn with it when they are parented to it.
+    #Returns (frames, path, cameras, targets), or None when there is no camera or curve. Targets...
+    #...are the points the camera looks at (a camera tracking with +Z looks away from its target).
+    @staticmethod
+    def get_trajectory():
+        #Select the curve and the camera.
+        curve = FlyoverDriver.get_object('curve', 'CURVE')
+        camera = FlyoverDriver.get_object('camera', 'CAMERA')
+        if curve is None or camera is None:
+            print("Curve or camera not found in get trajectory.")
+            return None
+        scene = FlyoverDriver.get_scene()
+        #The camera and target are where they were parented on the first frame.
+        scene.frame_set(scene.frame_start)
+        frames = numpy.arange(scene.frame_start, scene.frame_end + 1)
+        path = FlyoverDriver.sample_path(FlyoverDriver.curve_points(curve), curve.data.path_duration + 1)
+        path = path[numpy.clip(frames - scene.frame_start, 0, len(path) - 1)]
+        #The camera looks at its target empty, or at the curve itself.
+        target = curve
+        track_axis = 'TRACK_NEGATIVE_Z'
+        for constraint in camera.constraints:
+            if constraint.type == 'TRACK_TO' and constraint.target is not None:
+                target = constraint.target
+                track_axis = constraint.track_axis
+        cameras = FlyoverDriver.follow_positions(camera, curve, path)
+        targets = FlyoverDriver.follow_positions(target, curve, path)
+        if track_axis == 'TRACK_Z':
+            targets = 2 * cameras - targets
+        return (frames, path, cameras, targets)
+
+    #World position of an object on every point of the path.
+    @staticmethod
+    def follow_positions(item, curve, path):
+        start = numpy.array(item.matrix_world, dtype=numpy.float64)[:3, 3]
+        if item.parent != curve:
+            return numpy.tile(start, (len(path), 1))
+        return geometry.follow_path(path, start - path[0])
+
+    #Checks on every frame that the camera stays clearance over the terrain and that the terrain...
+    #...doesn't hide its target. Prints the frames that fail and, with auto_raise, replaces the curve...
+    #...by one point per frame, raised (and smoothed) over them.
+    def check_trajectory(self, auto_raise=False, samples=64):
+        trajectory = FlyoverDriver.get_trajectory()
+        if trajectory is None:
+            return False
+        frames, path, cameras, targets = trajectory
+        field = FlyoverDriver.get_height_field()
+        report = heightfield.evaluate_trajectory(field, cameras, targets, self.clearance, samples)
+        FlyoverDriver.print_trajectory_report(frames, report)
+        if not (report['collides'] | report['occluded']).any():
+            return True
+        if not auto_raise:
+            return False
+        #Smooth the raise over as many frames as the path covers in smoothing meters.
+        step = numpy.linalg.norm(numpy.diff(cameras, axis=0), axis=1).mean() if len(cameras) > 1 else 0.0
+        window = max(int(round(self.smoothing * self.scale / step)), 1) if step > 0 else 1
+        raised = heightfield.raise_trajectory(cameras, report, window)
+        curve = FlyoverDriver.get_object('curve', 'CURVE')
+        #set_curve_points takes a cyclic path closed, with its first point again at the end. The last...
+        #...frame is usually a step short of it, so the first raised point closes the loop, which...
+        #...keeps the point of every frame and raises the closing segment as well.
+        closed = numpy.allclose(path[0], path[-1])
+        path = path.copy()
+        path[:, 2] += raised[:, 2] - cameras[:, 2]
+        if any(spline.use_cyclic_u for spline in curve.data.splines):
+            if closed:
+                path[0, 2] = path[-1, 2] = max(path[0, 2], path[-1, 2])
+            else:
+                path = numpy.concatenate((path, path[:1]))
+        FlyoverDriver.set_curve_points(curve, path)
+        #A target riding the curve rose with it, check again.
+        frames, path, cameras, targets = FlyoverDriver.get_trajectory()
+        report = heightfield.evaluate_trajectory(field, cameras, targets, self.clearance, samples)
+        FlyoverDriver.print_trajectory_report(frames, report)
+        return not (report['collides'] | report['occluded']).any()
+
+    #Replaces the path and constraints by keyframes on every frame: the camera location and the...
+    #...rotation looking at its target, the target location. All evaluated at once and written...
+    #...with one foreach_set per F-curve, so no frame depends on the curve or constraints anymore.
+    @staticmethod
+    def bake_trajectory():
+        trajectory = FlyoverDriver.get_trajectory()
+        if trajectory is None:
+            return False
+        frames, path, cameras, targets = trajectory
+        camera = FlyoverDriver.get_object('camera', 'CAMERA')
+        #The target empty moves with the path too, bake it as well.
+        camera_target = None
+        for constraint in camera.constraints:
+            if constraint.type == 'TRACK_TO' and constraint.target is not None and constraint.target.type == 'EMPTY':
+                camera_target = constraint.target
+        #Take the camera (and target) off the path and constraints.
+        for constraint in list(camera.constraints):
+            if constraint.type == 'TRACK_TO':
+                camera.constraints.remove(constraint)
+        camera.parent = None
+        camera.rotation_mode = 'XYZ'
+        FlyoverDriver.keyframe_values(camera, 'location', frames, cameras)
+        FlyoverDriver.keyframe_values(camera, 'rotation_euler', frames, geometry.look_at_euler(cameras, targets))
+        if camera_target is not None:
+            camera_target.parent = None
+            FlyoverDriver.keyframe_values(camera_target, 'location', frames, targets)
+        return True
+
+    #Keys a vector property of an object on every frame, values is (frames, components).
+    @staticmethod
+    def keyframe_values(item, data_path, frames, values):
+        if item.animation_data is None:
+            item.animation_data_create()
+        if item.animation_data.action is None:
+            item.animation_data.action = bpy.data.actions.new(name=item.name + "Action")
+        action = item.animation_data.action
+        for index in range(values.shape[1]):
+            fcurve = action.fcurves.find(data_path, index=index)
+            if fcurve is not None:
+                action.fcurves.remove(fcurve)
+            fcurve = action.fcurves.new(data_path, index=index)
+            fcurve.keyframe_points.add(len(frames))
+            co = numpy.empty((len(frames), 2), dtype=numpy.float32)
+            co[:, 0] = frames
+            co[:, 1] = values[:, index]
+            fcurve.keyframe_points.foreach_set('co', co.ravel())
+            fcurve.update()
+
+    #Prints the frames where the camera is too low or can't see its target.
+    @staticmethod
+    def print_trajectory_report(frames, report):
+        if report['collides'].any():
+            print("Camera under the clearance on frames: " + geometry.frame_ranges(frames[report['collides']]))
+        if report['occluded'].any():
+            print("Camera target hidden by the terrain on frames: " + geometry.frame_ranges(frames[report['occluded']]))
+
+    #Replaces the splines of a curve by one poly spline through points given in world space.
+    @staticmethod
+    def set_curve_points(curve, points):
+        cyclic = any(spline.use_cyclic_u for spline in curve.data.splines)
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+        if cyclic:
+            #The last point is the first one again.
+            points = points[:-1]
+        matrix = numpy.linalg.inv(numpy.array(curve.matrix_world, dtype=numpy.float64))
+        co = numpy.ones((len(points), 4), dtype=numpy.float32)
+        co[:, :3] = points.dot(matrix[:3, :3].T) + matrix[:3, 3]
+        curve.data.splines.clear()
+        polyline = curve.data.splines.new('POLY')
+        polyline.points.add(len(points)-1)
+        polyline.use_cyclic_u = cyclic
+        polyline.points.foreach_set('co', co.ravel())
+
+    #############################################################
+    ###########Level of Detail Helper Functions##################
+    #############################################################
+    #Points of a curve object in world space, bezier segments are sampled with...
+    #...the given number of points each.
+    @staticmethod
+    def curve_points(curve, bezier_resolution=32):
+        points = []
+        for spline in curve.data.splines:
+            if spline.type == 'BEZIER':
+                knots = list(spline.bezier_points)
+                if spline.use_cyclic_u:
+                    knots.append(knots[0])
+                for start, end in zip(knots[:-1], knots[1:]):
+                    segment = mathutils.geometry.interpolate_bezier(start.co, start.handle_right, end.handle_left,
+                                                                    end.co, bezier_resolution + 1)
+                    points.extend(tuple(point) for point in segment[:-1])
+                points.append(tuple(knots[-1].co))
+            else:
+                points.extend(tuple(point.co)[:3] for point in spline.points)
+                if spline.use_cyclic_u:
+                    points.append(tuple(spline.points[0].co)[:3])
+        points = numpy.array(points, dtype=numpy.float64).reshape(-1, 3)
+        matrix = numpy.array(curve.matrix_world, dtype=numpy.float64)
+        return points.dot(matrix[:3, :3].T) + matrix[:3, 3]
+
+    #Resamples a polyline into count points evenly spaced by distance along it.
+    @staticmethod
+    def sample_path(points, count):
+        return geometry.sample_path(points, count)
+
+    #Level of detail of every tile on every frame.
+    @staticmethod
+    def lod_levels(positions, centers, sizes, level_count):
+        return geometry.lod_levels(positions, centers, sizes, level_count)
+
+    #Keyframes the visibility of the tiles of a tiled DTM. With levels of detail every tile...
+    #...shows one level per frame, picked from its distance to the camera on the path. With cull...
+    #...a tile is also hidden on the frames where it is outside of the camera's view, and a tile...
+    #...that is never in view is hidden for good, so the render never loads it. sights are the...
+    #...camera_sight of every flyover seeing the tiles (by default the one of the scene): a tile...
+    #...is in view when any camera sees it and shows the finest level any of them needs.
+    @staticmethod
+    def set_level_of_detail(cull=False, sights=None):
+        #Collect the tiles (the mesh children of a tiled DTM), every level of a tile together.
+        tiles = {}
+        for item in FlyoverDriver.get_dem_meshes():
+            if item.parent is not None and item.parent.type == 'EMPTY':
+                tiles.setdefault(item.get('lod_tile', item.name), []).append(item)
+        has_levels = any(item.get('lod_tile') is not None for name in tiles for item in tiles[name])
+        if not tiles or not (has_levels or cull):
+            return False
+        #Where the cameras are on each frame of their paths.
+        if sights is None:
+            sights = [FlyoverDriver.camera_sight()]
+        sights = [sight for sight in sights if sight is not None]
+        if not sights:
+            return False
+        count = min(len(sight[0]) for sight in sights)
+        frames = sights[0][0][:count]
+        names = sorted(tiles)
+        visible = numpy.ones((count, len(names)), dtype=bool)
+        if cull:
+            bounds = numpy.array([FlyoverDriver.world_bounds(tiles[name]) for name in names])
+            visible[:] = False
+            for (sight_frames, positions, targets, view) in sights:
+                visible |= geometry.frustum_visibility(positions[:count], targets[:count], view,
+                                                       bounds[:, 0], bounds[:, 1])
+            print("Tiles never in view of the camera: %d of %d" % ((~visible.any(axis=0)).sum(), len(names)))
+        levels = None
+        if has_levels:
+            centers = [tuple(tiles[name][0]['lod_center']) for name in names]
+            sizes = [tiles[name][0]['lod_size'] for name in names]
+            level_count = max(item['lod_level'] for name in names for item in tiles[name]) + 1
+            for (sight_frames, positions, targets, view) in sights:
+                sight_levels = FlyoverDriver.lod_levels(positions[:count], centers, sizes, level_count)
+                levels = sight_levels if levels is None else numpy.minimum(levels, sight_levels)
+        for index, name in enumerate(names):
+            for item in tiles[name]:
+                shown = visible[:, index]
+                if levels is not None:
+                    shown = shown & (levels[:, index] == item['lod_level'])
+                FlyoverDriver.key_visibility(item, frames, shown)
+        return True
+
+    #(frames, cameras, targets, view) of the flyover of the scene, see get_trajectory and camera_view.
+    @staticmethod
+    def camera_sight():
+        trajectory = FlyoverDriver.get_trajectory()
+        if trajectory is None:
+            return None
+        frames, path, cameras, targets = trajectory
+        camera = FlyoverDriver.get_object('camera', 'CAMERA')
+        return (frames, cameras, targets, FlyoverDriver.camera_view(camera))
+
+    #Keys hide and hide_render of an object on the frames where it appears or disappears.
+    @staticmethod
+    def key_visibility(item, frames, visible):
+        changes = numpy.flatnonzero(numpy.diff(visible.astype(numpy.int8))) + 1
+        if len(changes) == 0:
+            #Shown (or hidden) the whole time, no keys needed.
+            item.hide = not visible[0]
+            item.hide_render = not visible[0]
+            return
+        for change in numpy.concatenate(([0], changes)):
+            item.hide = not visible[change]
+            item.hide_render = not visible[change]
+            item.keyframe_insert(data_path='hide', frame=int(frames[change]))
+            item.keyframe_insert(data_path='hide_render', frame=int(frames[change]))
+
+    #World space (min, max) corners of the bounding boxes of objects.
+    @staticmethod
+    def world_bounds(items):
+        corners = []
+        for item in items:
+            matrix = numpy.array(item.matrix_world, dtype=numpy.float64)
+            box = numpy.array([tuple(corner) for corner in item.bound_box], dtype=numpy.float64).reshape(-1, 3)
+            corners.append(box.dot(matrix[:3, :3].T) + matrix[:3, 3])
+        corners = numpy.concatenate(corners)
+        return (corners.min(axis=0), corners.max(axis=0))
+
+    #(tan of half the horizontal angle, tan of half the vertical angle, clip start, clip end)...
+    #...of the camera with the render's aspect ratio.
+    @staticmethod
+    def camera_view(camera):
+        render = FlyoverDriver.get_scene().render
+        aspect = (render.resolution_x * render.pixel_aspect_x) / float(render.resolution_y * render.pixel_aspect_y)
+        fit = camera.data.sensor_fit
+        if fit == 'AUTO':
+            fit = 'HORIZONTAL' if aspect >= 1.0 else 'VERTICAL'
+            tan_fit = numpy.tan(camera.data.angle / 2)
+        elif fit == 'HORIZONTAL':
+            tan_fit = numpy.tan(camera.data.angle_x / 2)
+        else:
+            tan_fit = numpy.tan(camera.data.angle_y / 2)
+        if fit == 'HORIZONTAL':
+            return (tan_fit, tan_fit / aspect, camera.data.clip_start, camera.data.clip_end)
+        return (tan_fit * aspect, tan_fit, camera.data.clip_start, camera.data.clip_end)
+
     #############################################################
     ###########General Helper Functions##########################
     #############################################################
     #Helper function to set up the environment; frame lengths, path frames, video output.
     @staticmethod
     def set_environment():
-        bpy.data.scenes["Scene"].frame_end = 1440
+        scene = FlyoverDriver.get_scene()
+        scene.frame_end = 1440
         #Select the curve.
-        curve = None
-        for item in bpy.data.objects:
-            if item.type == 'CURVE':
-                curve = item
+        curve = FlyoverDriver.get_object('curve', 'CURVE')
         #Simple error checking to see if either camera or curve is still none.
         if curve is None:
             print("Curve not found in set environment.")
             return False
         curve.data.path_duration = 1440
         #Change the output to MPEG video with an MPEG-4 codec.
-        bpy.data.scenes["Scene"].render.image_settings.file_format = 'FFMPEG'
-        bpy.context.scene.render.ffmpeg.format = 'MPEG4'
+        scene.render.image_settings.file_format = 'FFMPEG'
+        scene.render.ffmpeg.format = 'MPEG4'
         #Set the video to output to the current working directory
-        bpy.data.scenes["Scene"].render.filepath = os.getcwd()+'/'
+        scene.render.filepath = os.getcwd()+'/'
         return True
 
     #Helper function to get the distance between two functions.
     @staticmethod
     def distance_two_points(point_one, point_two):
-        distance = math.sqrt((point_one[0] - point_two[0])*(point_one[0] - point_two[0]) +
-                             (point_one[1] - point_two[1])*(point_one[1] - point_two[1]) +
-                             (point_one[2] - point_two[2])*(point_one[2] - point_two[2]))
-        return distance
+        return geometry.distance_two_points(point_one, point_two)
 
     #Helper function to find the midpoint between two points.
     @staticmethod
     def midpoint_two_points(point_one, point_two):
-        return (point_one[0]+point_two[0])/2, (point_one[1]+point_two[1])/2, (point_one[2]+point_two[2])/2
+        return geometry.midpoint_two_points(point_one, point_two)
+
+    #The mesh objects of the DTM: the imported DTM (or its tiles, every level of detail included),...
+    #...every MESH object of the scene when the DTM wasn't imported by the add-on.
+    @staticmethod
+    def get_dem_meshes():
+        scene = FlyoverDriver.get_scene()
+        dtm = registry_module.registry.get(scene, 'dtm')
+        if dtm is None:
+            return [item for item in scene.objects if item.type == 'MESH']
+        if dtm.type == 'EMPTY':
+            return [item for item in dtm.children if item.type == 'MESH']
+        return [dtm]
+
+    #Coordinates of the vertices of the DTM meshes as one (n, 3) array.
+    @staticmethod
+    def get_dem_coords():
+        coords = []
+        for item in FlyoverDriver.get_dem_meshes():
+            vertices = numpy.empty(len(item.data.vertices) * 3, dtype=numpy.float32)
+            item.data.vertices.foreach_get('co', vertices)
+            coords.append(vertices.reshape(-1, 3))
+        if not coords:
+            return numpy.empty((0, 3), dtype=numpy.float32)
+        return numpy.concatenate(coords)
+
+    #Bounds and statistics the importer stored on the DTM object, None for other meshes.
+    @staticmethod
+    def get_dem_stats():
+        scene = FlyoverDriver.get_scene()
+        dtm = registry_module.registry.get(scene, 'dtm')
+        items = [dtm] if dtm is not None else scene.objects
+        for item in items:
+            if 'dtm_stats' in item and item['dtm_stats']['count']:
+                return item['dtm_stats']
+        return None
+
+    #The vertices of the DTM meshes and their faces cut into triangles, the finest level of detail only...
+    #...(the coarser ones cover the same ground).
+    @staticmethod
+    def get_dem_triangles():
+        coords = []
+        triangles = []
+        count = 0
+        for item in FlyoverDriver.get_dem_meshes():
+            if item.get('lod_level', 0) != 0:
+                continue
+            mesh = item.data
+            vertices = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+            mesh.vertices.foreach_get('co', vertices)
+            loops = numpy.empty(len(mesh.loops), dtype=numpy.int64)
+            mesh.loops.foreach_get('vertex_index', loops)
+            totals = numpy.empty(len(mesh.polygons), dtype=numpy.int64)
+            mesh.polygons.foreach_get('loop_total', totals)
+            #The loops of a face follow each other, in the order of the faces.
+            triangles.append(export.triangulate(loops, totals) + count)
+            coords.append(vertices.reshape(-1, 3))
+            count += len(mesh.vertices)
+        if not coords:
+            return (numpy.empty((0, 3), dtype=numpy.float32), numpy.empty((0, 3), dtype=numpy.int64))
+        return (numpy.concatenate(coords), numpy.concatenate(triangles))
+
+    #Height field of the DEM for terrain heights under many points at once: the surface of the DTM...
+    #...meshes on the grid spacing the importer measured (or the one the vertices show), so an...
+    #...adaptive mesh has heights between its vertices too. Reading the meshes is cheap next to...
+    #...building the field, so it is the digest of what was read that tells if the last one still holds.
+    @staticmethod
+    def get_height_field():
+        coords, triangles = FlyoverDriver.get_dem_triangles()
+        dem_stats = FlyoverDriver.get_dem_stats()
+        spacing = None
+        if dem_stats is not None:
+            spacing = tuple(dem_stats['spacing'])
+        digest = hashlib.sha1(repr(spacing).encode())
+        digest.update(coords)
+        digest.update(triangles)
+        if FlyoverDriver.height_field[0] != digest.hexdigest():
+            FlyoverDriver.height_field = (digest.hexdigest(), heightfield.from_triangles(coords, triangles, spacing))
+        return FlyoverDriver.height_field[1]
 
     #Helper function to get the boundaries of the DEM.
+    #[Farthest NW corner, farthest SE corner, farthest NE corner, farthest SW corner, max height].
+    #Read from the importer's statistics when there are some, from the vertices otherwise.
     @staticmethod
     def get_dem_boundaries():
-        #Simple value holders for getting our corners and highest point in the DEM.
-        #Farthest NW corner of the DEM.
-        x_max_point = (0, 0, 0)
-        #Farthest SE corner of the DEM.
-        x_min_point = (100, 0, 0)
-        #Farthest NE corner of the DEM.
-        y_max_point = (0, 0, 0)
-        #Farthest SW corner of the DEM.
-        y_min_point = (0, 100, 0)
-        #Max height value of the DEM.
-        z_max_value = -10
-        #Return List
-        return_list = []
-        #Run through each object to find the MESH.
-        for item in bpy.data.objects:
-            if item.type == 'MESH':
-                #Run through each vertex to get our data.
-                for vertex in item.data.vertices:
-                    #Series of if statements to get the correct values for our value holders.
-                    if vertex.co.x >= x_max_point[0]:
-                        x_max_point = (vertex.co.x, vertex.co.y, vertex.co.z)
-                    if vertex.co.x < x_min_point[0]:
-                        x_min_point = (vertex.co.x, vertex.co.y, vertex.co.z)
-                    if vertex.co.y >= y_max_point[1]:
-                        y_max_point = (vertex.co.x, vertex.co.y, vertex.co.z)
-                    if vertex.co.y < y_min_point[1]:
-                        y_min_point = (vertex.co.x, vertex.co.y, vertex.co.z)
-                    if vertex.co.z > z_max_value:
-                        z_max_value = vertex.co.z
-        return_list.append(x_max_point)
-        return_list.append(x_min_point)
-        return_list.append(y_max_point)
-        return_list.append(y_min_point)
-        return_list.append(z_max_value)
-        return return_list
+        dem_stats = FlyoverDriver.get_dem_stats()
+        if dem_stats is not None:
+            return stats.boundaries(dem_stats)
+        return geometry.dem_boundaries(FlyoverDriver.get_dem_coords())
 
     #Gets the center of the mesh.
     @staticmethod
     def get_center(input_list):
-        #Gets us the values midpoint of the mesh.
-        x_cross_mid_p = FlyoverDriver.midpoint_two_points(input_list[0], input_list[1])
-        y_cross_mid_p = FlyoverDriver.midpoint_two_points(input_list[2], input_list[3])
-        return_value = FlyoverDriver.midpoint_two_points(x_cross_mid_p, y_cross_mid_p)
-        return return_value
+        return geometry.get_center(input_list)
 
     #############################################################
     ###########Liner Helper Function#############################
@@ -0,0 +1,69 @@
+'''This module keeps track of the objects the importer and the flyovers make (the DTM,
+   its sun, the cameras, camera targets and paths), by scene and role, so "the" camera or
+   "the" path of a scene is the one that was made for it rather than the first object of
+   its type a scan comes across, and several flyovers can live side by side in their own
+   scenes. Scenes are told apart by an id stored on them (it survives renames, undo and
+   saving) and objects are kept by name, looked up in the scene's objects, so nothing
+   holds on to blender data that undo may free. That lookup is blender's own search of
+   the scene by name (in C, but still linear in the number of objects in 2.7x), not a
+   hash lookup. It does not import bpy: scenes and objects are whatever blender passes.'''
+
+import uuid
+
+
+class ObjectRegistry(object):
+    #ID property of a scene holding its id in the registry.
+    scene_key = 'spaceblend_registry'
+
+    def __init__(self):
+        #{scene id: {role: object name}}
+        self.objects = {}
+
+    #The id of scene, given to it the first time.
+    def scene_id(self, scene):
+        if scene.get(self.scene_key) is None:
+            scene[self.scene_key] = uuid.uuid4().hex
+        return scene[self.scene_key]
+
+    #Remembers item as the object of role in scene.
+    def register(self, scene, role, item):
+        self.objects.setdefault(self.scene_id(scene), {})[role] = item.name
+        return item
+
+    #The object of role in scene, None when there is none or it was deleted or renamed since,...
+    #...found by name with scene.objects.get, a linear search of the scene done by blender.
+    def get(self, scene, role):
+        roles = self.objects.get(scene.get(self.scene_key), {})
+        if role not in roles:
+            return None
+        item = scene.objects.get(roles[role])
+        if item is None:
+            del roles[role]
+        return item
+
+    #Roles of scene and their objects, the ones no longer in the scene left out.
+    def roles(self, scene):
+        roles = {}
+        for role in list(self.objects.get(scene.get(self.scene_key), {})):
+            item = self.get(scene, role)
+            if item is not None:
+                roles[role] = item
+        return roles
+
+    #Forgets the object of role in scene.
+    def unregister(self, scene, role):
+        self.objects.get(scene.get(self.scene_key), {}).pop(role, None)
+
+    #Forgets every object of scene, i.e. when the scene is cleared.
+    def clear(self, scene):
+        self.objects.pop(scene.get(self.scene_key), None)
+
+    #A new scene linking the objects of base (i.e. blender's LINK_OBJECTS) has the same objects in...
+    #...the same roles. It gets an id of its own, a copy of base comes with the one of base.
+    def link_scene(self, base, scene):
+        scene[self.scene_key] = uuid.uuid4().hex
+        self.objects[scene[self.scene_key]] = dict((role, item.name) for (role, item) in self.roles(base).items())
+
+
+#The registry shared by the importer (DTMViewerRenderContext) and the flyovers (FlyoverDriver).
+registry = ObjectRegistry()
@@ -0,0 +1,143 @@
+'''This module renders a saved flyover .blend with several headless Blender processes
+   at once. The frame range is split into chunks of consecutive frames, each chunk is
+   rendered to PNG files by its own "blender -b" process (at most `workers` at a time),
+   frames already on disk are skipped so a crashed or interrupted run picks up where
+   it stopped, and the frames are stitched into the final video with ffmpeg.
+   It does not import bpy and can be run as a script:
+       python render_module.py flyover.blend --workers 8 --video flyover.mp4'''
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+class RenderDriver(object):
+    #Digits in the frame file names, blender's "#####".
+    frame_digits = 5
+    #Seconds between two looks at the running blender processes.
+    poll_interval = 0.5
+
+    def __init__(self, blend_file, output_dir=None, frame_start=1, frame_end=1440, workers=None,
+                 chunk_size=24, blender='blender', ffmpeg='ffmpeg', fps=24):
+        self.blend_file = blend_file
+        if output_dir is None:
+            output_dir = os.path.splitext(blend_file)[0] + "_frames"
+        self.output_dir = output_dir
+        self.frame_start = frame_start
+        self.frame_end = frame_end
+        cpus = os.cpu_count() or 1
+        if workers is None:
+            workers = max(1, cpus // 4)
+        self.workers = workers
+        #Render threads of each blender, the cores shared between the workers.
+        self.threads = max(1, cpus // workers)
+        self.chunk_size = chunk_size
+        self.blender = blender
+        self.ffmpeg = ffmpeg
+        self.fps = fps
+
+    #Path of the PNG of a frame.
+    def frame_path(self, frame):
+        return os.path.join(self.output_dir, "frame_%0*d.png" % (self.frame_digits, frame))
+
+    #A frame is done once its PNG is complete: a crash can leave a truncated file behind.
+    def frame_done(self, frame):
+        path = self.frame_path(frame)
+        try:
+            with open(path, 'rb') as png:
+                png.seek(0, os.SEEK_END)
+                if png.tell() < 12:
+                    return False
+                png.seek(-12, os.SEEK_END)
+                return png.read(12)[4:8] == b'IEND'
+        except (IOError, OSError):
+            return False
+
+    #Frames of the range that still have to be rendered.
+    def pending_frames(self):
+        return [frame for frame in range(self.frame_start, self.frame_end + 1) if not self.frame_done(frame)]
+
+    #Splits frames into (first, last) chunks of at most chunk_size consecutive frames.
+    def chunks(self, frames):
+        chunks = []
+        for frame in frames:
+            if chunks and frame == chunks[-1][1] + 1 and frame - chunks[-1][0] < self.chunk_size:
+                chunks[-1] = (chunks[-1][0], frame)
+            else:
+                chunks.append((frame, frame))
+        return chunks
+
+    #Command line of a headless blender rendering the frames first to last of the .blend as PNG.
+    def blender_command(self, first, last):
+        return [self.blender, '-b', self.blend_file,
+                '-o', os.path.join(os.path.abspath(self.output_dir), "frame_" + "#" * self.frame_digits),
+                '-F', 'PNG', '-x', '1', '-t', str(self.threads),
+                '-s', str(first), '-e', str(last), '-a']
+
+    #Command line of ffmpeg joining the frames into a video.
+    def ffmpeg_command(self, video_path):
+        return [self.ffmpeg, '-y', '-framerate', str(self.fps), '-start_number', str(self.frame_start),
+                '-i', os.path.join(self.output_dir, "frame_%%0%dd.png" % self.frame_digits),
+                '-frames:v', str(self.frame_end - self.frame_start + 1),
+                '-c:v', 'libx264', '-pix_fmt', 'yuv420p', video_path]
+
+    #Renders every pending chunk, keeping workers blender processes busy.
+    #Returns True once every frame of the range is on disk.
+    def render(self):
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        chunks = self.chunks(self.pending_frames())
+        print("Rendering %d chunks with %d blender processes of %d threads" % (len(chunks), self.workers, self.threads))
+        running = []
+        while chunks or running:
+            while chunks and len(running) < self.workers:
+                first, last = chunks.pop(0)
+                process = subprocess.Popen(self.blender_command(first, last),
+                                           stdout=subprocess.DEVNULL)
+                running.append((process, first, last))
+            time.sleep(self.poll_interval)
+            for item in list(running):
+                process, first, last = item
+                if process.poll() is None:
+                    continue
+                running.remove(item)
+                if process.returncode != 0:
+                    print("Blender failed on frames %d-%d (exit code %d)" % (first, last, process.returncode))
+                else:
+                    print("Rendered frames %d-%d" % (first, last))
+        missing = self.pending_frames()
+        if missing:
+            print("%d frames are still missing, run again to resume" % len(missing))
+        return not missing
+
+    #Joins the frames into the video.
+    def stitch(self, video_path):
+        return subprocess.call(self.ffmpeg_command(video_path)) == 0
+
+    #Renders what is missing and, when every frame is there, makes the video.
+    def run(self, video_path=None):
+        if not self.render():
+            return False
+        if video_path is None:
+            video_path = os.path.splitext(self.blend_file)[0] + ".mp4"
+        return self.stitch(video_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a flyover .blend with several blender processes")
+    parser.add_argument('blend_file')
+    parser.add_argument('--output', help="directory of the PNG frames")
+    parser.add_argument('--video', help="video file to make from the frames")
+    parser.add_argument('--start', type=int, default=1, help="first frame")
+    parser.add_argument('--end', type=int, default=1440, help="last frame")
+    parser.add_argument('--workers', type=int, help="blender processes rendering at the same time")
+    parser.add_argument('--chunk-size', type=int, default=24, help="consecutive frames rendered by one process")
+    parser.add_argument('--blender', default='blender', help="blender executable")
+    parser.add_argument('--ffmpeg', default='ffmpeg', help="ffmpeg executable")
+    parser.add_argument('--fps', type=int, default=24)
+    args = parser.parse_args()
+    driver = RenderDriver(args.blend_file, args.output, args.start, args.end, args.workers,
+                          args.chunk_size, args.blender, args.ffmpeg, args.fps)
+    sys.exit(0 if driver.run(args.video) else 1)
@@ -148,4 +148,4 @@ class TestBlenderLoad(unittest.TestCase):
         for item in bpy.data.objects:
             if (item.type == 'MESH'):
                 return True
-        return False
\ No newline at end of file
+        return False
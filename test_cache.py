@@ -0,0 +1,59 @@
+import cache_module
+import unittest
+import tempfile
+import shutil
+import os
+import numpy
+
+#Missing constant used by HiRISE DTMs
+ignore_value = -3.4028226550889045e+38
+
+#These tests focus on storing, loading and evicting binned DTM grids
+class TestDTMCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.dtm = os.path.join(self.cache_dir, "test.IMG")
+        with open(self.dtm, 'wb') as dtm:
+            dtm.write(b"PDS_VERSION_ID = PDS3\r\nEND\r\n" + b"\0" * 64)
+        self.lines = numpy.arange(0, 24, dtype=numpy.float32).reshape(4, 6)
+        self.lines[1][2] = ignore_value
+        self.meta = {'dims': [12, 8], 'processed_dims': [6, 4], 'pixel_scale': [2, 2],
+                     'valid_min_max': [0.0, 23.0], 'ignore_value': ignore_value}
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_key_depends_on_parameters(self):
+        cache = cache_module.DTMCache(self.cache_dir)
+        self.assertEqual(cache.key(self.dtm, 'BIN2', False), cache.key(self.dtm, 'BIN2', False))
+        self.assertNotEqual(cache.key(self.dtm, 'BIN2', False), cache.key(self.dtm, 'BIN6', False))
+
+    def test_missing_entry(self):
+        cache = cache_module.DTMCache(self.cache_dir)
+        self.assertIsNone(cache.load(cache.key(self.dtm, 'BIN2', False)))
+
+    def test_store_and_load(self):
+        cache = cache_module.DTMCache(self.cache_dir)
+        key = cache.key(self.dtm, 'BIN2', False)
+        cache.store(key, self.lines, self.meta)
+        lines, meta = cache.load(key)
+        self.assertTrue(numpy.array_equal(lines, self.lines))
+        self.assertEqual(meta['processed_dims'], [6, 4])
+
+    def test_store_and_load_quantized(self):
+        cache = cache_module.DTMCache(self.cache_dir, quantize=True)
+        key = cache.key(self.dtm, 'BIN2', False)
+        cache.store(key, self.lines, self.meta)
+        lines, meta = cache.load(key)
+        self.assertEqual(lines[1][2], ignore_value)
+        valid = self.lines != ignore_value
+        self.assertTrue(numpy.allclose(lines[valid], self.lines[valid], atol=0.001))
+
+    def test_eviction_keeps_recent_entries(self):
+        cache = cache_module.DTMCache(self.cache_dir, max_bytes=1)
+        first = cache.key(self.dtm, 'BIN2', False)
+        second = cache.key(self.dtm, 'BIN6', False)
+        cache.store(first, self.lines, self.meta)
+        cache.store(second, self.lines, self.meta)
+        self.assertIsNone(cache.load(first))
+        self.assertIsNotNone(cache.load(second))
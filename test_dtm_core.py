@@ -0,0 +1,571 @@
+#dtm_core is imported as a package of its own so these run without Blender (the add-on imports bpy)
+from dtm_core import importer
+from dtm_core import geometry
+from dtm_core import export
+from dtm_core import stats
+from dtm_core import heightfield
+from dtm_core.label import image_properties, pds_label
+import unittest
+import io
+import tempfile
+import shutil
+import os
+import numpy
+
+#A 5 line x 6 sample DTM with one missing sample, data starting at record 21
+label = (b"PDS_VERSION_ID = PDS3\r\n"
+         b"RECORD_BYTES = 40\r\n"
+         b"LABEL_RECORDS = 20\r\n"
+         b"^IMAGE = 21\r\n"
+         b"OBJECT = IMAGE\r\n"
+         b"  LINES = 5\r\n"
+         b"  LINE_SAMPLES = 6\r\n"
+         b"  SAMPLE_TYPE = PC_REAL\r\n"
+         b"  SAMPLE_BITS = 32\r\n"
+         b"  VALID_MINIMUM = 1.0\r\n"
+         b"  VALID_MAXIMUM = 30.0\r\n"
+         b"  MISSING_CONSTANT = 16#FF7FFFFB#\r\n"
+         b"END_OBJECT = IMAGE\r\n"
+         b"END\r\n")
+
+#These tests run the whole import up to the mesh arrays without Blender
+class TestDTMCoreImporter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'test.IMG')
+        heights = numpy.arange(1, 31, dtype='<f4').reshape(5, 6)
+        heights[2][3] = numpy.frombuffer(b'\xfb\xff\x7f\xff', dtype='<f4')[0]
+        with open(self.filepath, 'wb') as img:
+            img.write(label.ljust(800, b' '))
+            img.write(heights.tobytes())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load_grid(self):
+        dtm = importer.dtm_importer(self.filepath)
+        dtm.bin_mode('NONE')
+        (img_props, grid) = dtm.loadGrid()
+        self.assertEqual(img_props.dims(), (6, 5))
+        self.assertEqual(grid.shape, (5, 6))
+        self.assertEqual(grid[0][0], 0.0)
+        self.assertEqual(grid[4][5], 29.0)
+        self.assertTrue(numpy.isnan(grid[2][3]))
+
+    def test_mesh_arrays(self):
+        dtm = importer.dtm_importer(self.filepath)
+        dtm.bin_mode('NONE')
+        dtm.reader_mode('STREAM')
+        (img_props, grid) = dtm.loadGrid()
+        (coords, loops, loop_totals) = dtm.meshArrays(grid, 1.0, 1.0)
+        self.assertEqual(len(coords), 29)
+        #4 x 5 cells, the 4 around the missing sample become triangles
+        self.assertEqual(list(loop_totals).count(4), 16)
+        self.assertEqual(list(loop_totals).count(3), 4)
+        self.assertEqual(len(loops), sum(loop_totals))
+
+    def test_export_mesh_npz_round_trip(self):
+        dtm = importer.dtm_importer(self.filepath)
+        dtm.bin_mode('NONE')
+        path = dtm.exportMesh(os.path.join(self.directory, 'test.npz'))
+        (coords, loops, loop_totals) = export.read_npz(path)
+        self.assertEqual(len(coords), 29)
+        self.assertEqual(len(loop_totals), 20)
+        self.assertEqual(len(loops), 16 * 4 + 4 * 3)
+
+    def test_uvs_of_cropped_and_binned_grid(self):
+        #Every reader and the pyramid (built, then reused) must agree on where the samples came from
+        for (reader_mode, use_pyramid) in [('STREAM', False), ('MMAP', False), ('MMAP', True), ('MMAP', True)]:
+            dtm = importer.dtm_importer(self.filepath)
+            dtm.bin_mode('BIN2')
+            dtm.reader_mode(reader_mode)
+            dtm.use_pyramid(use_pyramid)
+            dtm.crop(4, 3, 1, 1)
+            (img_props, grid) = dtm.loadGrid()
+            self.assertEqual(img_props.origin(), (1.5, 1.5))
+            self.assertEqual(img_props.step(), (2, 2))
+            coords = numpy.array([(0.0, 0.0, 0.0), (2.0, -2.0, 0.0)], dtype=numpy.float32)
+            uvs = dtm.vertexUVs(img_props, coords, 2.0, 2.0)
+            for (a, b) in zip(uvs.ravel(), [2.0 / 6, 1 - 2.0 / 5, 4.0 / 6, 1 - 4.0 / 5]):
+                self.assertAlmostEqual(a, b, places=5)
+        importer.dtm_pyramid_cache.clear()
+
+    def test_terrain_stats(self):
+        dtm = importer.dtm_importer(self.filepath)
+        dtm.bin_mode('NONE')
+        dtm.scale(0.5)
+        (img_props, grid) = dtm.loadGrid()
+        (coords, loops, loop_totals) = dtm.meshArrays(grid, 0.5, 0.5)
+        self.assertEqual(dtm.terrain_stats().boundaries(), geometry.dem_boundaries(coords))
+        result = dtm.terrain_stats().as_dict()
+        self.assertEqual(result['histogram_range'], [0.0, 14.5])
+        self.assertEqual(result['valid_bounds'], [0, 4, 0, 5])
+
+    def test_uvs_of_fast_bin(self):
+        dtm = importer.dtm_importer(self.filepath)
+        dtm.bin_mode('BIN6-FAST')
+        (img_props, grid) = dtm.loadGrid()
+        self.assertEqual(img_props.origin(), (0, 0))
+        self.assertEqual(img_props.step(), (6, 6))
+        uvs = dtm.vertexUVs(img_props, numpy.zeros((1, 3), dtype=numpy.float32), 6.0, 6.0)
+        self.assertAlmostEqual(uvs[0][0], 0.5 / 6, places=5)
+        self.assertAlmostEqual(uvs[0][1], 1 - 0.5 / 5, places=5)
+
+
+#These tests focus on the binary mesh formats
+class TestDTMCoreExport(unittest.TestCase):
+    coords = numpy.array([(0, 0, 0), (1, 0, 0), (1, -1, 0), (0, -1, 0), (2, 0, 1)], dtype=numpy.float32)
+    loops = [0, 1, 2, 3, 1, 4, 2]
+    loop_totals = [4, 3]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_triangulate(self):
+        triangles = export.triangulate(self.loops, self.loop_totals)
+        self.assertEqual(sorted(triangles.tolist()), [[0, 1, 2], [0, 2, 3], [1, 4, 2]])
+
+    def test_ply(self):
+        path = os.path.join(self.directory, 'test.ply')
+        export.write_mesh(path, self.coords, self.loops, self.loop_totals)
+        with open(path, 'rb') as ply:
+            data = ply.read()
+        header = data[:data.index(b'end_header\n') + 11]
+        self.assertTrue(b'element vertex 5\n' in header)
+        self.assertTrue(b'element face 2\n' in header)
+        self.assertEqual(len(data) - len(header), 5 * 12 + (1 + 4 * 4) + (1 + 3 * 4))
+
+    def test_glb(self):
+        path = os.path.join(self.directory, 'test.glb')
+        export.write_mesh(path, self.coords, self.loops, self.loop_totals)
+        with open(path, 'rb') as glb:
+            data = glb.read()
+        self.assertEqual(data[:4], b'glTF')
+        self.assertEqual(len(data) % 4, 0)
+        self.assertEqual(len(data), int(numpy.frombuffer(data[8:12], dtype='<u4')[0]))
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, export.write_mesh, os.path.join(self.directory, 'test.obj'),
+                          self.coords, self.loops, self.loop_totals)
+
+
+#These tests focus on the flyover geometry computed from vertex coordinates
+class TestDTMCoreGeometry(unittest.TestCase):
+    def test_dem_boundaries_ties(self):
+        coords = [(1.0, -2.0, 3.0), (4.0, -1.0, 0.5), (4.0, -5.0, 1.0), (0.0, -5.0, 2.0)]
+        vals = geometry.dem_boundaries(coords)
+        #maxima keep the last vertex of a tie and minima the first one
+        self.assertEqual(vals[0], (4.0, -5.0, 1.0))
+        self.assertEqual(vals[1], (0.0, -5.0, 2.0))
+        #no y is above the starting value of 0
+        self.assertEqual(vals[2], (0, 0, 0))
+        self.assertEqual(vals[3], (4.0, -5.0, 1.0))
+        self.assertEqual(vals[4], 3.0)
+
+    def test_dem_boundaries_empty(self):
+        vals = geometry.dem_boundaries(numpy.empty((0, 3)))
+        self.assertEqual(vals, [(0, 0, 0), (100, 0, 0), (0, 0, 0), (0, 100, 0), -10])
+
+    def test_closest_points(self):
+        coords = [(0.0, 0.0, 1.0), (10.0, 0.0, 2.0), (10.0, 0.0, 3.0)]
+        closest = geometry.closest_points(coords, [(9.0, 0.0, 0.0), (500.0, 0.0, 0.0)])
+        self.assertEqual(closest, [(10.0, 0.0, 2.0), (500.0, 0.0, 0.0)])
+
+    def test_follow_path(self):
+        #A quarter circle: the offset turns with the path
+        angles = numpy.linspace(0.0, numpy.pi / 2, 901)
+        path = numpy.column_stack((numpy.cos(angles), numpy.sin(angles), numpy.zeros(901))) * 10
+        followed = geometry.follow_path(path, (-10.0, 0.0, 1.0))
+        for (a, b) in zip(followed[-1], (0.0, 0.0, 1.0)):
+            self.assertAlmostEqual(a, b, places=1)
+        self.assertEqual(geometry.follow_path(path, (0.0, 0.0, 0.0)).tolist(), path.tolist())
+
+    def test_look_at_euler(self):
+        cameras = numpy.array([(0.0, 0.0, 0.0), (0.0, 0.0, 0.0), (0.0, 0.0, 10.0), (1.0, 2.0, 3.0)])
+        targets = numpy.array([(0.0, 5.0, 0.0), (-3.0, -3.0, -1.0), (0.0, 0.0, 0.0), (1.0, 2.0, 4.0)])
+        for (camera, target, (rx, ry, rz)) in zip(cameras, targets, geometry.look_at_euler(cameras, targets)):
+            (cx, sx, cy, sy, cz, sz) = (numpy.cos(rx), numpy.sin(rx), numpy.cos(ry), numpy.sin(ry), numpy.cos(rz), numpy.sin(rz))
+            rotation = numpy.dot(numpy.dot([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]], [[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]]),
+                                 [[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+            direction = (target - camera) / numpy.linalg.norm(target - camera)
+            self.assertTrue(numpy.allclose(-rotation[:, 2], direction))
+            self.assertTrue(rotation[2][1] >= 0.0)
+        #unwrapped, a full turn keeps going instead of jumping back
+        angles = numpy.linspace(0.0, 4 * numpy.pi, 50)
+        targets = numpy.column_stack((numpy.cos(angles), numpy.sin(angles), numpy.zeros(50)))
+        euler = geometry.look_at_euler(numpy.zeros((50, 3)), targets)
+        self.assertTrue((numpy.abs(numpy.diff(euler, axis=0)) < 1.0).all())
+
+    def test_frustum_visibility(self):
+        #Looking north (+y) with a 90 degree view, boxes ahead, behind, far to the side and past clip end
+        box_min = numpy.array([(-1.0, 10.0, -1.0), (-1.0, -12.0, -1.0), (50.0, 10.0, -1.0), (-1.0, 500.0, -1.0)])
+        box_max = box_min + 2.0
+        cameras = numpy.zeros((2, 3))
+        targets = numpy.array([(0.0, 1.0, 0.0), (0.0, -1.0, 0.0)])
+        visible = geometry.frustum_visibility(cameras, targets, (1.0, 1.0, 0.1, 100.0), box_min, box_max, chunk=1)
+        self.assertEqual(visible.tolist(), [[True, False, False, False], [False, True, False, False]])
+        #A box around the camera is always in view
+        self.assertTrue(geometry.frustum_visibility(cameras, targets, (1.0, 1.0, 0.1, 100.0),
+                                                    [(-1.0, -1.0, -1.0)], [(1.0, 1.0, 1.0)]).all())
+
+    def test_frame_ranges(self):
+        self.assertEqual(geometry.frame_ranges([1, 2, 3, 7, 9, 10]), "1-3, 7, 9-10")
+        self.assertEqual(geometry.frame_ranges([]), "")
+
+    def test_resample_path(self):
+        path = geometry.resample_path([(0.0, 0.0, 0.0), (10.0, 0.0, 0.0), (10.0, 5.0, 0.0)], 2.0)
+        self.assertEqual(len(path), 9)
+        self.assertEqual(path[-1].tolist(), [10.0, 5.0, 0.0])
+        steps = numpy.linalg.norm(numpy.diff(path, axis=0), axis=1)
+        self.assertTrue((steps <= 2.0).all())
+
+    def test_clear_terrain(self):
+        path = numpy.zeros((200, 3))
+        path[:, 0] = numpy.arange(200)
+        terrain = numpy.where(numpy.abs(path[:, 0] - 100) < 3, 50.0, 0.0)
+        terrain[:30] = numpy.nan
+        cleared = geometry.clear_terrain(path, terrain, 2.5, 21)
+        self.assertTrue((cleared[30:, 2] >= terrain[30:] + 2.5 - 1e-9).all())
+        self.assertEqual(cleared[:, :2].tolist(), path[:, :2].tolist())
+        #the path climbs ahead of the ridge
+        self.assertTrue(cleared[85][2] > 2.5)
+        self.assertEqual(cleared[0][2], 0.0)
+        self.assertEqual(cleared[150][2], 2.5)
+
+
+#These tests check the statistics gathered during the import against the mesh itself
+class TestDTMCoreStats(unittest.TestCase):
+    def check_grid(self, grid, scale):
+        dtm = importer.dtm_importer('')
+        terrain = stats.terrain_stats(scale, (0.0, 10.0), bins=5)
+        for line in grid:
+            terrain.add_line(line)
+        coords = dtm.gridVertices(grid, ~numpy.isnan(grid), scale[0], scale[1])
+        self.assertEqual(terrain.boundaries(), geometry.dem_boundaries(coords))
+        result = terrain.as_dict()
+        self.assertEqual(result['count'], len(coords))
+        self.assertEqual(result['min'], coords.min(axis=0).tolist())
+        self.assertEqual(result['max'], coords.max(axis=0).tolist())
+        self.assertEqual(sum(result['histogram']), len(coords))
+        self.assertEqual(stats.boundaries(result), terrain.boundaries())
+        for (a, b) in zip(result['centroid'], coords.astype(numpy.float64).mean(axis=0)):
+            self.assertAlmostEqual(a, b, places=4)
+
+    def test_ragged_grid(self):
+        grid = numpy.random.RandomState(7).uniform(0.0, 10.0, (9, 8)).astype(numpy.float32)
+        grid[0][5:] = numpy.nan
+        grid[3][0] = numpy.nan
+        grid[:2, 0] = numpy.nan
+        grid[6:, 7] = numpy.nan
+        grid[8][:3] = numpy.nan
+        self.check_grid(grid, (0.5, 2.0))
+
+    def test_ties(self):
+        #Every line the same length and height, ties decide every extreme point
+        self.check_grid(numpy.ones((4, 5), dtype=numpy.float32), (1.0, 1.0))
+
+    def test_no_valid_samples(self):
+        terrain = stats.terrain_stats((1.0, 1.0), (0.0, 1.0))
+        terrain.add_line(numpy.array([numpy.nan, numpy.nan], dtype=numpy.float32))
+        self.assertEqual(terrain.as_dict(), {'count': 0})
+        self.assertEqual(terrain.boundaries(), geometry.dem_boundaries(numpy.empty((0, 3))))
+
+
+#These tests focus on the terrain heights the flyovers are checked against
+class TestDTMCoreHeightField(unittest.TestCase):
+    def test_plane(self):
+        #z = 2x - y is reproduced exactly by bilinear sampling
+        grid = numpy.fromfunction(lambda row, col: 2.0 * col + row * 0.5, (5, 6), dtype=numpy.float32)
+        field = heightfield.height_field(grid, (1.0, 0.5))
+        x = numpy.array([0.0, 2.25, 5.0, 4.9, -0.1, 5.1])
+        y = numpy.array([0.0, -0.6, -2.0, -1.95, -1.0, -1.0])
+        heights = field.heights(x, y)
+        for (height, expected) in zip(heights[:4], 2 * x[:4] - y[:4]):
+            self.assertAlmostEqual(height, expected, places=5)
+        self.assertTrue(numpy.isnan(heights[4:]).all())
+
+    def test_missing_corners(self):
+        grid = numpy.array([[1.0, numpy.nan], [3.0, 5.0]], dtype=numpy.float32)
+        field = heightfield.height_field(grid, (1.0, 1.0))
+        heights = field.heights([0.5, 1.0, 0.0], [-0.5, 0.0, -1.0])
+        self.assertAlmostEqual(heights[0], 3.0, places=5)
+        #only the missing corner carries weight, the valid ones are averaged
+        self.assertAlmostEqual(heights[1], 3.0, places=5)
+        self.assertAlmostEqual(heights[2], 3.0, places=5)
+
+    def test_from_vertices(self):
+        dtm = importer.dtm_importer('')
+        grid = numpy.random.RandomState(3).uniform(0.0, 10.0, (6, 7)).astype(numpy.float32)
+        grid[0][:2] = numpy.nan
+        coords = dtm.gridVertices(grid, ~numpy.isnan(grid), 0.25, 0.5)
+        for spacing in [(0.25, 0.5), None]:
+            field = heightfield.from_vertices(coords, spacing)
+            self.assertEqual(field.spacing(), (0.25, 0.5))
+            heights = field.heights(coords[:, 0], coords[:, 1])
+            for (a, b) in zip(heights, coords[:, 2]):
+                self.assertAlmostEqual(a, b, places=5)
+        self.assertTrue(numpy.isnan(heightfield.from_vertices(numpy.empty((0, 3))).heights([0.0], [0.0])).all())
+
+    def test_from_triangles_of_adaptive_mesh(self):
+        #Flat on the left, hilly on the right, with a hole: the flat part keeps few vertices
+        dtm = importer.dtm_importer('')
+        (y, x) = numpy.mgrid[0:33, 0:40].astype(numpy.float32)
+        grid = numpy.where(x < 20, 1.0, 1.0 + 2.0 * numpy.sin(x / 3.0) * numpy.cos(y / 4.0)).astype(numpy.float32)
+        grid[10:14, 25:30] = numpy.nan
+        faces = dtm.adaptiveFaces(grid, 0.25)
+        (coords, faces) = dtm.adaptiveVertices(grid, faces, 0.5, 0.5)
+        self.assertLess(len(coords), grid.size // 2)
+        field = heightfield.from_triangles(coords, faces, (0.5, 0.5))
+        self.assertEqual(field.grid().shape, grid.shape)
+        # the nodes the mesh has no vertex on have heights too, within the error of the mesh
+        valid = ~numpy.isnan(grid)
+        self.assertTrue(numpy.isfinite(field.grid()[valid]).all())
+        self.assertLessEqual(numpy.abs(field.grid()[valid] - grid[valid]).max(), 0.25 + 1e-4)
+        self.assertTrue(numpy.isnan(field.grid()[11:13, 26:29]).all())
+        heights = field.heights(x[valid] * 0.5 + 0.25, y[valid] * -0.5 - 0.25)
+        inside = (x[valid] < 39) & (y[valid] < 32)
+        self.assertTrue(numpy.isfinite(heights[inside]).all())
+        # without the spacing, the smallest step of the vertices
+        self.assertEqual(heightfield.from_triangles(coords, faces).spacing(), (0.5, 0.5))
+
+    def test_evaluate_trajectory(self):
+        #A 10 high ridge along x = 10 between cameras at x = 0 and targets at x = 20
+        grid = numpy.zeros((21, 21), dtype=numpy.float32)
+        grid[:, 10] = 10.0
+        field = heightfield.height_field(grid, (1.0, 1.0))
+        cameras = numpy.array([(0.0, -5.0, 1.0), (0.0, -5.0, 30.0), (5.0, -5.0, 12.0)])
+        targets = numpy.array([(20.0, -5.0, 0.0), (20.0, -5.0, 0.0), (20.0, -5.0, 0.0)])
+        report = heightfield.evaluate_trajectory(field, cameras, targets, 2.5, samples=199)
+        self.assertEqual(report['occluded'].tolist(), [True, False, True])
+        self.assertEqual(report['collides'].tolist(), [True, False, False])
+        raised = heightfield.raise_trajectory(cameras, report)
+        report = heightfield.evaluate_trajectory(field, raised, targets, 2.5, samples=199)
+        self.assertFalse(report['occluded'].any())
+        self.assertFalse(report['collides'].any())
+        self.assertEqual(raised[1].tolist(), cameras[1].tolist())
+
+
+#These tests focus on the normals computed from the height grid
+class TestDTMCoreNormals(unittest.TestCase):
+    def test_sloped_grid(self):
+        dtm = importer.dtm_importer('')
+        #z rises 0.5 per sample along x and 1 per line going down (-y)
+        grid = numpy.fromfunction(lambda row, col: 0.5 * col + row, (4, 5), dtype=numpy.float32)
+        grid[1][2] = numpy.nan
+        normals = dtm.gridNormals(grid, 1.0, 2.0)
+        expected = numpy.array([-0.5, 0.5, 1.0]) / numpy.sqrt(1.5)
+        for (row, col) in [(0, 0), (2, 2), (3, 4), (1, 1), (1, 3)]:
+            for (a, b) in zip(normals[row][col], expected):
+                self.assertAlmostEqual(a, b, places=5)
+
+    def test_vertex_normals(self):
+        dtm = importer.dtm_importer('')
+        normals = numpy.arange(2 * 3 * 3, dtype=numpy.float32).reshape(2, 3, 3)
+        coords = numpy.array([(4.0, -3.0, 0.0), (0.0, 0.0, 0.0)], dtype=numpy.float32)
+        self.assertEqual(dtm.vertexNormals(normals, coords, 2.0, 3.0).tolist(), [normals[1][2].tolist(), normals[0][0].tolist()])
+
+
+#These tests focus on how far the adaptive mesh strays from the heights it was made from
+class TestDTMCoreAdaptiveMesh(unittest.TestCase):
+    def worst_error(self, grid, faces):
+        ''' the largest height difference between a sample and the triangle covering it '''
+        (rows, cols) = numpy.divmod(faces, grid.shape[1])
+        worst = 0.0
+        for (row, col) in zip(rows, cols):
+            (row_low, col_low) = ( row.min(), col.min() )
+            (sample_rows, sample_cols) = numpy.mgrid[row_low:row.max() + 1, col_low:col.max() + 1]
+            (sample_rows, sample_cols) = ( sample_rows.ravel(), sample_cols.ravel() )
+            det = float((row[1] - row[0]) * (col[2] - col[0]) - (col[1] - col[0]) * (row[2] - row[0]))
+            wb = ((sample_rows - row[0]) * (col[2] - col[0]) - (sample_cols - col[0]) * (row[2] - row[0])) / det
+            wc = ((row[1] - row[0]) * (sample_cols - col[0]) - (col[1] - col[0]) * (sample_rows - row[0])) / det
+            wa = 1.0 - wb - wc
+            inside = (wa >= -1e-9) & (wb >= -1e-9) & (wc >= -1e-9)
+            plane = wa * grid[row[0], col[0]] + wb * grid[row[1], col[1]] + wc * grid[row[2], col[2]]
+            worst = max(worst, numpy.abs(plane - grid[sample_rows, sample_cols])[inside].max())
+        return worst
+
+    def test_error_stays_under_max_error(self):
+        (y, x) = numpy.mgrid[0:70, 0:90].astype(numpy.float32)
+        grid = 3.0 * numpy.sin(x / 7.0) * numpy.cos(y / 5.0) + 0.02 * x * y
+        dtm = importer.dtm_importer('unused.IMG')
+        for max_error in (0.5, 0.1, 2.0):
+            faces = dtm.adaptiveFaces(grid, max_error)
+            self.assertLessEqual(self.worst_error(grid, faces), max_error + 1e-4)
+
+    def test_error_stays_under_max_error_across_tiles(self):
+        (y, x) = numpy.mgrid[0:40, 0:40].astype(numpy.float32)
+        grid = 2.0 * numpy.sin(x / 3.0) + numpy.cos(y / 4.0)
+        dtm = importer.dtm_importer('unused.IMG')
+        dtm.adaptive_tile_size = 17
+        faces = dtm.adaptiveFaces(grid, 0.25)
+        self.assertLessEqual(self.worst_error(grid, faces), 0.25 + 1e-4)
+
+
+#These tests focus on the indexed PDS label used to locate the image data
+class TestDTMCorePDSLabel(unittest.TestCase):
+    label = (b"PDS_VERSION_ID = PDS3\r\n"
+             b"RECORD_BYTES = 40\r\n"
+             b"LABEL_RECORDS = 3\r\n"
+             b"^IMAGE = 4\r\n"
+             b"OBJECT = IMAGE\r\n"
+             b"  LINES = 5\r\n"
+             b"  LINE_SAMPLES = 10\r\n"
+             b"  SAMPLE_TYPE = PC_REAL\r\n"
+             b"  SAMPLE_BITS = 32\r\n"
+             b"  VALID_MINIMUM = -10.5\r\n"
+             b"  VALID_MAXIMUM = 20.25\r\n"
+             b"  MISSING_CONSTANT = 16#FF7FFFFB#\r\n"
+             b"END_OBJECT = IMAGE\r\n"
+             b"END\r\n")
+
+    def parse(self, label):
+        dtm = importer.dtm_importer('')
+        (lines, parsed) = dtm.getPDSLabel(io.BytesIO(label))
+        return dtm, pds_label(parsed)
+
+    def test_image_keywords(self):
+        dtm, header = self.parse(self.label)
+        self.assertEqual(dtm.getLinesAndSamples(header), (10, 5))
+        self.assertEqual(dtm.getValidMinMax(header), (-10.5, 20.25))
+        self.assertEqual(header.dtype(), '<f4')
+        self.assertEqual(header.line_bytes(), 40)
+
+    def test_data_offset_from_record_pointer(self):
+        dtm, header = self.parse(self.label)
+        self.assertEqual(header.data_offset(), 120)
+        self.assertEqual(header.line_offset(2), 200)
+
+    def test_data_offset_from_byte_pointer(self):
+        dtm, header = self.parse(self.label.replace(b"^IMAGE = 4", b"^IMAGE = 101 <BYTES>"))
+        self.assertEqual(header.data_offset(), 100)
+
+    def test_data_offset_without_pointer(self):
+        dtm, header = self.parse(self.label.replace(b"^IMAGE = 4\r\n", b""))
+        self.assertEqual(header.data_offset(), 120)
+
+
+#These tests focus on the binning engine shared by all of the BIN modes
+#A fresh dtm ignores values of 0 until a label says otherwise
+class TestDTMCoreBinning(unittest.TestCase):
+    def test_bin_block_mean(self):
+        dtm = importer.dtm_importer('')
+        raw_data = [[1.0, 3.0, 5.0, 7.0, 9.0],
+                    [1.0, 3.0, 5.0, 7.0, 9.0]]
+        binned = dtm.binBlock(raw_data, 2)
+        self.assertEqual(binned.shape, (1, 2))
+        self.assertAlmostEqual(binned[0][0], 2.0)
+        self.assertAlmostEqual(binned[0][1], 6.0)
+
+    def test_bin_block_ignores_missing_values(self):
+        dtm = importer.dtm_importer('')
+        raw_data = [[0.0, 4.0, 0.0, 0.0],
+                    [0.0, 8.0, 0.0, 0.0]]
+        binned = dtm.binBlock(raw_data, 2)
+        self.assertAlmostEqual(binned[0][0], 6.0)
+        self.assertEqual(binned[0][1], 0.0)
+
+    def test_bin_n_dimensions(self):
+        dtm = importer.dtm_importer('')
+        props = image_properties('test', (16, 9), (1, 1))
+        lines = iter([props] + [[1.0] * 16 for y in range(0, 9)])
+        binned = dtm.binN(lines, 4)
+        props = next(binned)
+        self.assertEqual(props.processed_dims(), (4, 2))
+        self.assertEqual(props.pixel_scale(), (4, 4))
+        self.assertEqual(len(list(binned)), 2)
+
+    def test_fast_sample(self):
+        dtm = importer.dtm_importer('')
+        raw_data = [list(range(0, 24))] * 12
+        self.assertEqual(list(dtm.sampleBlock(raw_data, 12, 11)), [11, 23])
+
+    def test_pyramid_matches_direct_binning(self):
+        dtm = importer.dtm_importer('')
+        lines = [[float((x * 7 + y * 3) % 11) for x in range(0, 25)] for y in range(0, 25)]
+        props = image_properties('test', (25, 25), (1, 1))
+        pyramid = dtm.buildPyramid(iter([props] + lines), [2, 4, 6, 12, 24])
+        for factor in [2, 4, 6, 12, 24]:
+            level = pyramid.level(factor)
+            direct = dtm.binBlock(lines[:25 // factor * factor], factor)
+            self.assertEqual(level.shape, direct.shape)
+            for (a, b) in zip(level.ravel(), direct.ravel()):
+                self.assertAlmostEqual(a, b, places=4)
+
+
+#These tests focus on the vertex and face arrays genMesh hands to blender
+class TestDTMCoreMeshArrays(unittest.TestCase):
+    def grid(self):
+        nan = float('nan')
+        return numpy.array([[1.0, 2.0, 3.0],
+                            [4.0, nan, 6.0],
+                            [7.0, 8.0, 9.0]], dtype=numpy.float32)
+
+    def test_vertices_skip_missing_values(self):
+        dtm = importer.dtm_importer('')
+        grid = self.grid()
+        valid = ~numpy.isnan(grid)
+        coords = dtm.gridVertices(grid, valid, 2.0, 3.0)
+        self.assertEqual(len(coords), 8)
+        self.assertEqual(tuple(coords[4]), (4.0, -3.0, 6.0))
+
+    def test_index_map(self):
+        dtm = importer.dtm_importer('')
+        index = dtm.gridIndex(~numpy.isnan(self.grid()))
+        self.assertEqual(index.tolist(), [[0, 1, 2], [3, -1, 4], [5, 6, 7]])
+
+    def test_quads_need_four_valid_corners(self):
+        dtm = importer.dtm_importer('')
+        valid = ~numpy.isnan(self.grid())
+        self.assertEqual(len(dtm.gridQuads(valid, dtm.gridIndex(valid))), 0)
+        valid[1][1] = True
+        quads = dtm.gridQuads(valid, dtm.gridIndex(valid))
+        self.assertEqual(quads.tolist(), [[0, 1, 4, 3], [1, 2, 5, 4], [3, 4, 7, 6], [4, 5, 8, 7]])
+
+    def test_triangles_fill_cells_missing_one_corner(self):
+        dtm = importer.dtm_importer('')
+        valid = ~numpy.isnan(self.grid())
+        triangles = dtm.gridTriangles(valid, dtm.gridIndex(valid))
+        self.assertEqual(sorted(triangles.tolist()), [[0, 1, 3], [1, 2, 4], [3, 6, 5], [4, 7, 6]])
+        valid[1][1] = True
+        self.assertEqual(len(dtm.gridTriangles(valid, dtm.gridIndex(valid))), 0)
+
+    def test_adaptive_mesh_flat_tile(self):
+        dtm = importer.dtm_importer('')
+        grid = numpy.zeros((17, 17), dtype=numpy.float32)
+        faces = dtm.adaptiveFaces(grid, 0.1)
+        (coords, faces) = dtm.adaptiveVertices(grid, faces, 1.0, 1.0)
+        self.assertEqual(len(faces), 2)
+        self.assertEqual(len(coords), 4)
+
+    def test_adaptive_mesh_keeps_every_sample_without_error(self):
+        dtm = importer.dtm_importer('')
+        grid = numpy.random.RandomState(0).rand(10, 13).astype(numpy.float32)
+        faces = dtm.adaptiveFaces(grid, 0.0)
+        (coords, faces) = dtm.adaptiveVertices(grid, faces, 1.0, 1.0)
+        self.assertEqual(len(coords), 10 * 13)
+        self.assertEqual(len(faces), 2 * 9 * 12)
+
+    def test_tiles_share_their_border_samples(self):
+        dtm = importer.dtm_importer('')
+        grid = numpy.arange(7 * 9, dtype=numpy.float32).reshape(7, 9)
+        self.assertEqual(dtm.tileOrigins(grid.shape, 4), [(0, 0), (0, 4), (4, 0), (4, 4)])
+        tiles = dtm.tileArrays(grid, 1.0, 1.0, 4)
+        (coords, loops, loop_totals) = dtm.meshArrays(grid, 1.0, 1.0)
+        self.assertEqual(sum(len(arrays[2]) for (origin, level, arrays) in tiles), len(loop_totals))
+        tile_coords = numpy.concatenate([arrays[0] for (origin, level, arrays) in tiles])
+        self.assertEqual(set(map(tuple, tile_coords.tolist())), set(map(tuple, coords.tolist())))
+
+    def test_tile_levels_of_detail(self):
+        dtm = importer.dtm_importer('')
+        grid = numpy.arange(9 * 9, dtype=numpy.float32).reshape(9, 9)
+        self.assertEqual(dtm.tileLodLevels(4, 3), 3)
+        self.assertEqual(dtm.tileLodLevels(6, 3), 2)
+        tiles = dtm.tileArrays(grid, 1.0, 1.0, 4, lod_levels=3)
+        self.assertEqual(len(tiles), 4 * 3)
+        for (origin, level, (coords, loops, loop_totals)) in tiles:
+            self.assertEqual(len(coords), (4 // 2 ** level + 1) ** 2)
+            # the coarser levels still reach the border of their tile
+            self.assertEqual(coords[:, 0].max() - coords[:, 0].min(), 4.0)
@@ -265,4 +265,81 @@ class TestMiscellaneousFunctions(unittest.TestCase):
         y_min = vals[3]
         self.assertAlmostEqual(y_min[0], 6.42000007)
         self.assertAlmostEqual(y_min[1], -55.13999938)
-        self.assertAlmostEqual(y_min[2], 6.86862039)
\ No newline at end of file
+        self.assertAlmostEqual(y_min[2], 6.86862039)
+
+class TestLevelOfDetail(unittest.TestCase):
+    def test_sample_path_even_spacing(self):
+        points = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (1.0, 3.0, 0.0)]
+        samples = flyover_module.FlyoverDriver.sample_path(points, 5)
+        self.assertEqual(len(samples), 5)
+        self.assertEqual(tuple(samples[0]), (0.0, 0.0, 0.0))
+        self.assertEqual(tuple(samples[1]), (1.0, 0.0, 0.0))
+        self.assertEqual(tuple(samples[4]), (1.0, 3.0, 0.0))
+
+    def test_lod_levels_by_distance(self):
+        positions = [(0.0, 0.0, 0.0), (30.0, 0.0, 0.0), (50.0, 0.0, 0.0), (500.0, 0.0, 0.0)]
+        levels = flyover_module.FlyoverDriver.lod_levels(positions, [(0.0, 0.0, 0.0)], [10.0], 3)
+        self.assertEqual(levels[:, 0].tolist(), [0, 1, 2, 2])
+
+#A small DTM: a grid of size x size vertices one unit apart, registered in scene.
+def make_grid(scene, size):
+    coords = [(x, y, 0.0) for y in range(size) for x in range(size)]
+    faces = [(y * size + x, y * size + x + 1, (y + 1) * size + x + 1, (y + 1) * size + x)
+             for y in range(size - 1) for x in range(size - 1)]
+    mesh = bpy.data.meshes.new("DTM")
+    mesh.from_pydata(coords, [], faces)
+    mesh.update()
+    dtm = bpy.data.objects.new("DTM", mesh)
+    scene.objects.link(dtm)
+    return flyover_module.registry_module.registry.register(scene, 'dtm', dtm)
+
+def remove_grid(scene, dtm):
+    flyover_module.registry_module.registry.clear(scene)
+    scene.objects.unlink(dtm)
+    mesh = dtm.data
+    bpy.data.objects.remove(dtm)
+    bpy.data.meshes.remove(mesh)
+
+class TestHeightField(unittest.TestCase):
+    def test_height_field_is_built_once_per_dtm(self):
+        scene = bpy.context.scene
+        dtm = make_grid(scene, 8)
+        try:
+            field = flyover_module.FlyoverDriver.get_height_field()
+            self.assertIs(flyover_module.FlyoverDriver.get_height_field(), field)
+            #Moving a vertex makes another DTM.
+            dtm.data.vertices[0].co.z = 5.0
+            self.assertIsNot(flyover_module.FlyoverDriver.get_height_field(), field)
+        finally:
+            remove_grid(scene, dtm)
+
+class TestBatchFlyover(unittest.TestCase):
+    def test_batch_makes_a_flyover_in_each_scene(self):
+        registry = flyover_module.registry_module.registry
+        base = bpy.context.scene
+        name = base.name
+        dtm = make_grid(base, 16)
+        flyover = flyover_module.FlyoverDriver(1.0)
+        scenes = flyover.batch_flyover(['DiamondPattern', 'CirclePattern', 'LinearPattern'])
+        try:
+            self.assertEqual(len(scenes), 3)
+            self.assertIs(scenes[0], base)
+            self.assertEqual(base.name, name)
+            self.assertEqual([scene.name for scene in scenes[1:]],
+                             [name + " - CirclePattern", name + " - LinearPattern"])
+            self.assertIs(bpy.context.scene, base)
+            for scene in scenes:
+                #Every scene has its own camera and path and shares the DTM.
+                self.assertIsNotNone(scene.camera)
+                self.assertIs(registry.get(scene, 'camera'), scene.camera)
+                self.assertIsNotNone(registry.get(scene, 'curve'))
+                self.assertIs(registry.get(scene, 'dtm'), dtm)
+                self.assertIn(dtm.name, scene.objects)
+            self.assertEqual(len(set(scene.camera.name for scene in scenes)), 3)
+            self.assertNotIn(scenes[1].camera.name, base.objects)
+        finally:
+            for scene in scenes[1:]:
+                registry.clear(scene)
+                bpy.data.scenes.remove(scene, do_unlink=True)
+            TestFlyoverPatterns.cleanup_flyover(self)
+            remove_grid(base, dtm)
@@ -0,0 +1,84 @@
+import registry_module
+import unittest
+
+
+#Stand-ins for blender scenes and objects, only what the registry looks at
+class Object(object):
+    def __init__(self, name):
+        self.name = name
+
+class Scene(dict):
+    #The ID properties are the dict, objects are linked by name.
+    def __init__(self, name, objects=()):
+        dict.__init__(self)
+        self.name = name
+        self.objects = dict((item.name, item) for item in objects)
+
+    def link(self, item):
+        self.objects[item.name] = item
+        return item
+
+
+#These tests focus on finding the objects of a scene by role
+class TestObjectRegistry(unittest.TestCase):
+    def test_register_and_get(self):
+        registry = registry_module.ObjectRegistry()
+        scene = Scene("Scene")
+        camera = scene.link(Object("Camera"))
+        self.assertIs(registry.register(scene, 'camera', camera), camera)
+        self.assertIs(registry.get(scene, 'camera'), camera)
+        self.assertIsNone(registry.get(scene, 'curve'))
+        self.assertIsNone(registry.get(Scene("Other"), 'camera'))
+
+    def test_scenes_are_apart(self):
+        registry = registry_module.ObjectRegistry()
+        (first, second) = ( Scene("Scene"), Scene("Scene - LinearPattern") )
+        registry.register(first, 'camera', first.link(Object("Camera")))
+        registry.register(second, 'camera', second.link(Object("Camera.001")))
+        self.assertEqual(registry.get(first, 'camera').name, "Camera")
+        self.assertEqual(registry.get(second, 'camera').name, "Camera.001")
+
+    def test_renamed_scene_keeps_its_objects(self):
+        registry = registry_module.ObjectRegistry()
+        scene = Scene("Scene")
+        dtm = registry.register(scene, 'dtm', scene.link(Object("DTM")))
+        scene.name = "Mars"
+        self.assertIs(registry.get(scene, 'dtm'), dtm)
+        #A new scene taking the old name starts empty.
+        self.assertIsNone(registry.get(Scene("Scene", [dtm]), 'dtm'))
+
+    def test_objects_gone_from_the_scene_are_forgotten(self):
+        registry = registry_module.ObjectRegistry()
+        scene = Scene("Scene")
+        registry.register(scene, 'camera', scene.link(Object("Camera")))
+        registry.register(scene, 'curve', scene.link(Object("Curve")))
+        del scene.objects["Camera"]
+        scene.objects["Path"] = scene.objects.pop("Curve")
+        self.assertIsNone(registry.get(scene, 'camera'))
+        self.assertIsNone(registry.get(scene, 'curve'))
+        self.assertEqual(registry.roles(scene), {})
+
+    def test_link_scene(self):
+        registry = registry_module.ObjectRegistry()
+        base = Scene("Scene")
+        dtm = registry.register(base, 'dtm', base.link(Object("DTM")))
+        registry.register(base, 'sun', base.link(Object("Sun")))
+        #Like LINK_OBJECTS, the new scene has the objects and a copy of the ID properties of base.
+        linked = Scene("Scene - CirclePattern", [dtm])
+        linked.update(base)
+        registry.link_scene(base, linked)
+        self.assertIs(registry.get(linked, 'dtm'), dtm)
+        self.assertIsNone(registry.get(linked, 'sun'))
+        #A flyover made in the linked scene leaves the base scene alone.
+        registry.register(linked, 'camera', linked.link(Object("Camera")))
+        self.assertIsNone(registry.get(base, 'camera'))
+
+    def test_clear(self):
+        registry = registry_module.ObjectRegistry()
+        scene = Scene("Scene")
+        registry.register(scene, 'dtm', scene.link(Object("DTM")))
+        registry.register(scene, 'camera', scene.link(Object("Camera")))
+        registry.unregister(scene, 'camera')
+        self.assertEqual(list(registry.roles(scene)), ['dtm'])
+        registry.clear(scene)
+        self.assertIsNone(registry.get(scene, 'dtm'))
@@ -0,0 +1,43 @@
+import render_module
+import unittest
+import tempfile
+import shutil
+import os
+
+#Smallest byte layout frame_done accepts: a PNG signature and an IEND chunk
+png = b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\x00IEND\xaeB`\x82'
+
+#These tests focus on resuming and splitting a render, no blender process is started
+class TestRenderDriver(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.driver = render_module.RenderDriver(os.path.join(self.directory, 'flyover.blend'),
+                                                 output_dir=self.directory, frame_start=1, frame_end=10,
+                                                 workers=2, chunk_size=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pending_frames_skip_complete_pngs(self):
+        for frame in [2, 3, 7]:
+            with open(self.driver.frame_path(frame), 'wb') as frame_file:
+                frame_file.write(png)
+        #A crash can leave a truncated frame behind
+        with open(self.driver.frame_path(8), 'wb') as frame_file:
+            frame_file.write(png[:12])
+        self.assertEqual(self.driver.pending_frames(), [1, 4, 5, 6, 8, 9, 10])
+
+    def test_chunks(self):
+        self.assertEqual(self.driver.chunks([1, 4, 5, 6, 7, 8, 10]), [(1, 1), (4, 6), (7, 8), (10, 10)])
+        self.assertEqual(self.driver.chunks([]), [])
+
+    def test_blender_command(self):
+        command = self.driver.blender_command(4, 6)
+        self.assertEqual(command[:3], ['blender', '-b', self.driver.blend_file])
+        self.assertEqual(command[-5:], ['-s', '4', '-e', '6', '-a'])
+        self.assertTrue(command[command.index('-o') + 1].endswith('frame_#####'))
+
+    def test_frame_paths_match_blender_and_ffmpeg(self):
+        self.assertEqual(os.path.basename(self.driver.frame_path(12)), 'frame_00012.png')
+        command = self.driver.ffmpeg_command('flyover.mp4')
+        self.assertEqual(command[command.index('-i') + 1] % 12, self.driver.frame_path(12))
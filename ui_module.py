@@ -17,7 +17,7 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
     bl_idname = "import_dem.img"
     bl_label  = "Import and SpaceBlend DEM (.IMG)"
     bl_options = {'UNDO'}
-    filter_glob = StringProperty(default="*.IMG", options={'HIDDEN'})
+    filter_glob = StringProperty(default="*.IMG;*.npz", options={'HIDDEN'})
 
     #Color Control consider an option to say if you have GDAL installed or not -- possibly detect GDAL
     # Colors to possibly add
@@ -52,6 +52,61 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
         ('LinearPattern', "Linear Pattern", "Create a linear flyover")),
         name="Flyover", description="Import Flyover", default='NoFlyover')
 
+    #More flyovers of the same import, each in a scene of its own sharing the DTM
+    flyover_variants = EnumProperty(items=(
+        ('CirclePattern', "Circle Pattern", "Also create a circular flyover"),
+        ('DiamondPattern', "Diamond Pattern", "Also create a diagonal flyover"),
+        ('LinearPattern', "Linear Pattern", "Also create a linear flyover")),
+        name="More Flyovers", description="Also create these flyovers, each in its own scene linking the same DTM",
+        options={'ENUM_FLAG'}, default=set())
+
+    #Terrain following flight paths
+    follow_terrain = BoolProperty(name="Follow Terrain",
+        description="Sample the flyover path densely and keep it clear of the terrain between its points",
+        default=False
+        )
+
+    path_spacing = FloatProperty(name="Path Spacing",
+                                 description="Distance (in meters) between two points of a terrain following path",
+                                 min=0.1,
+                                 soft_max=1000.0,
+                                 default=10.0)
+
+    clearance = FloatProperty(name="Clearance",
+                              description="Minimum height of a terrain following path over the terrain",
+                              min=0.0,
+                              soft_max=100.0,
+                              default=2.5)
+
+    smoothing = FloatProperty(name="Smoothing",
+                              description="Length (in meters) the height of a terrain following path is smoothed over",
+                              min=0.0,
+                              soft_max=5000.0,
+                              default=200.0)
+
+    #Checks of the camera path against the terrain
+    verify_path = BoolProperty(name="Check Camera Path",
+        description="Report the frames where the camera is under the clearance or can't see its target",
+        default=False
+        )
+
+    auto_raise = BoolProperty(name="Raise Camera Path",
+        description="Raise the camera path over the frames that fail the check",
+        default=False
+        )
+
+    #Option to bake the camera motion
+    bake_motion = BoolProperty(name="Bake Camera Motion",
+        description="Key the camera and target on every frame instead of having them follow the path",
+        default=False
+        )
+
+    #Option to hide the tiles the camera doesn't see
+    cull_tiles = BoolProperty(name="Cull Unseen Tiles",
+        description="Hide tiles while they are out of the camera's view (a DTM without a tile size is split into 512 sample tiles)",
+        default=False
+        )
+
     #Option to add stars to the background of the image
     stars = BoolProperty(name="Apply Stars",
             description="Applies stars to the background",
@@ -86,12 +141,68 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
     bin_mode = EnumProperty(items=(
         ('NONE', "None", "Don't bin the image"),
         ('BIN2', "2x2", "use 2x2 binning to import the mesh"),
+        ('BIN4', "4x4", "use 4x4 binning to import the mesh"),
         ('BIN6', "6x6", "use 6x6 binning to import the mesh"),
         ('BIN6-FAST', "6x6 Fast", "use one sample per 6x6 region"),
+        ('BIN8', "8x8", "use 8x8 binning to import the mesh"),
         ('BIN12', "12x12", "use 12x12 binning to import the mesh"),
-        ('BIN12-FAST', "12x12 Fast", "use one sample per 12x12 region")),
+        ('BIN12-FAST', "12x12 Fast", "use one sample per 12x12 region"),
+        ('BIN16', "16x16", "use 16x16 binning to import the mesh"),
+        ('BIN24', "24x24", "use 24x24 binning to import the mesh")),
         name="Binning", description="Import Binning", default='BIN12-FAST')
 
+    #Option to keep every bin level of the DEM in memory after the first import
+    use_pyramid = BoolProperty(name="Keep Bin Levels",
+        description="Read the DEM once and keep every bin level so changing the binning doesn't re-read it",
+        default=False
+        )
+
+    #Option to keep decoded and binned DEMs on disk between imports
+    use_cache = BoolProperty(name="Cache Decoded DEM",
+        description="Keep the binned DEM on disk so importing it again skips decoding the .IMG",
+        default=False
+        )
+
+    #Mesh Control
+    mesh_mode = EnumProperty(items=(
+        ('GRID', "Grid", "One vertex for every (binned) sample"),
+        ('ADAPTIVE', "Adaptive", "Only keep the vertices needed to stay within the maximum error")),
+        name="Mesh", description="Mesh Type", default='GRID')
+
+    max_error = FloatProperty(name="Maximum Error",
+                              description="Vertical error (in meters) allowed by the adaptive mesh",
+                              min=0.0,
+                              soft_max=10.0,
+                              default=0.5)
+
+    #Option to split the DEM into tile objects (0 keeps a single object)
+    tile_size = IntProperty(name="Tile Size",
+                            description="Split the mesh into tiles of this many samples per side (0 for a single mesh)",
+                            min=0,
+                            soft_max=4096,
+                            default=0)
+
+    #Level of detail of the tiles, the flyover picks one per tile by distance to the camera
+    lod_levels = IntProperty(name="Detail Levels",
+                             description="Resolutions built for every tile, each half the previous one (needs a tile size)",
+                             min=1,
+                             max=6,
+                             default=1)
+
+    #Option to also write the mesh next to the DEM for tools outside of Blender
+    export_format = EnumProperty(items=(
+        ('NONE', "None", "Don't export the mesh"),
+        ('PLY', "PLY", "Binary PLY"),
+        ('GLB', "glTF Binary", "glTF 2.0 binary (.glb)"),
+        ('NPZ', "NumPy", "NumPy arrays (.npz), can be loaded back into Blender without decoding the DEM")),
+        name="Export Mesh", description="Also write the mesh to a file", default='NONE')
+
+    #Option to shade the mesh with normals computed from the DEM
+    use_normals = BoolProperty(name="Smooth Normals",
+        description="Shade the mesh smoothly with normals computed from the DEM heights",
+        default=False
+        )
+
     def execute(self, context):
         #####################################################################################
         ###############################    UNIT TESTS    ####################################
@@ -107,7 +218,9 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
 
         #####################################################################################
         input_DEM = self.filepath
-        if input_DEM != bpy.path.ensure_ext(input_DEM, ".IMG"):
+        #A .npz exported by an earlier import is loaded back as is, without decoding or GDAL
+        reload_mesh = input_DEM.lower().endswith(".npz")
+        if input_DEM != bpy.path.ensure_ext(input_DEM, ".IMG") and not reload_mesh:
             return {'CANCELLED'}
         dtm_location = self.filepath
 
@@ -116,7 +229,7 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
         ## Use the GDAL tools to create hill-shade and color-relief and merge them with
         ## hsv_merge.py to use as a texture for the DTM. Creates DTM_TEXTURE.tiff
         ################################################################################
-        if self.color_pattern == 'NoColorPattern':
+        if self.color_pattern == 'NoColorPattern' or reload_mesh:
             texture_location=None
             pass
         else:
@@ -148,11 +261,32 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
                             cropVars=False,
                             resolution=self.resolution,
                             stars=self.stars,
-                            mist=self.mist)
+                            mist=self.mist,
+                            use_pyramid=self.use_pyramid,
+                            use_cache=self.use_cache,
+                            mesh_mode=self.mesh_mode,
+                            max_error=self.max_error,
+                            tile_size=self.tile_size or (512 if self.cull_tiles else 0),
+                            lod_levels=self.lod_levels,
+                            export_format=self.export_format,
+                            use_normals=self.use_normals)
         ################################################################################
         ###############################Execute Flyovers#######################################
-        flyover = flyover_module.FlyoverDriver(self.scale)
-        if self.flyover_pattern == "NoFlyover":
+        flyover = flyover_module.FlyoverDriver(self.scale,
+                                               follow_terrain=self.follow_terrain,
+                                               path_spacing=self.path_spacing,
+                                               clearance=self.clearance,
+                                               smoothing=self.smoothing,
+                                               verify_path=self.verify_path,
+                                               auto_raise=self.auto_raise,
+                                               bake_motion=self.bake_motion,
+                                               cull_tiles=self.cull_tiles)
+        variants = [pattern for pattern in ('CirclePattern', 'DiamondPattern', 'LinearPattern')
+                    if pattern in self.flyover_variants and pattern != self.flyover_pattern]
+        if variants:
+            print("Entering batch of flyovers")
+            flyover.batch_flyover([self.flyover_pattern] + variants)
+        elif self.flyover_pattern == "NoFlyover":
             print("Skipping flyover")
             flyover.no_flyover()
         elif self.flyover_pattern == "CirclePattern":